@@ -0,0 +1,138 @@
+"""
+Accuracy parity, latency and memory of each sentiment inference backend.
+
+Every backend is scored against the original transformers pipeline on the same
+texts: top-label agreement and the largest per-label probability difference. Each
+measurement runs in a fresh process so resident memory is not shared between them.
+Exits with status 1 if a backend's agreement falls below --min-agreement.
+
+Run from the project root:
+    python -m benchmarks.bench_backends [--entries 200] [--backends pytorch pytorch-int8 onnx]
+"""
+import argparse
+import multiprocessing
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.bench_sentiment import SAMPLE_SENTENCES, _make_entries
+from core.inference import BACKENDS, create_backend
+from core.sentiment import MODEL_ID, DEFAULT_BATCH_SIZE
+
+# Texts timed one at a time for the single-entry latency figures.
+LATENCY_SAMPLES = 50
+
+def _rss_mib():
+    import psutil
+
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def _classify(backend, texts, batch_size):
+    """
+    Scores texts truncated to the model limit, like the pipeline, in the
+    pipeline's output shape: a {'label', 'score'} dict per emotion for each text.
+    """
+    results = []
+    for start in range(0, len(texts), batch_size):
+        encoded = backend.tokenizer(texts[start:start + batch_size], padding=True, truncation=True, return_tensors="np")
+        probabilities, _ = backend.forward(encoded)
+        results.extend(
+            [{"label": label, "score": float(p)} for label, p in zip(backend.labels, row)]
+            for row in probabilities
+        )
+    return results
+
+def _measure(name, texts, batch_size):
+    """Runs in a child process. Returns probabilities in label order plus timings."""
+    baseline_rss = _rss_mib()
+    start = time.perf_counter()
+    if name == "reference":
+        from transformers import pipeline
+
+        classifier = pipeline("text-classification", model=MODEL_ID, return_all_scores=True)
+        labels = [classifier.model.config.id2label[i] for i in range(classifier.model.config.num_labels)]
+        run = lambda batch, size: classifier(batch, batch_size=size, truncation=True)
+    else:
+        backend = create_backend(name, MODEL_ID)
+        backend.load()
+        labels = backend.labels
+        run = lambda batch, size: _classify(backend, batch, size)
+    load_seconds = time.perf_counter() - start
+    loaded_rss = _rss_mib()
+
+    run(texts[:4], batch_size) # Warm-up
+    latencies = []
+    for text in texts[:LATENCY_SAMPLES]:
+        start = time.perf_counter()
+        run([text], 1)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    outputs = run(texts, batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    probabilities = np.array([
+        [{s["label"]: s["score"] for s in scores}[label] for label in labels] for scores in outputs
+    ])
+    return {
+        "labels": labels,
+        "probabilities": probabilities,
+        "load_seconds": load_seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000,
+        "throughput": len(texts) / batch_seconds,
+        "model_rss_mib": loaded_rss - baseline_rss,
+        "peak_rss_mib": _rss_mib(),
+    }
+
+def _in_fresh_process(name, texts, batch_size):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_measure, (name, texts, batch_size))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=200, help="number of synthetic entries")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--min-agreement", type=float, default=0.97,
+                        help="lowest acceptable share of texts with the same top label as the reference")
+    args = parser.parse_args()
+
+    # The single sentences cover every mood clearly; the mixed entries exercise padding
+    texts = SAMPLE_SENTENCES + _make_entries(args.entries)
+    print(f"{len(texts)} texts, batch size {args.batch_size}\n")
+
+    reference = _in_fresh_process("reference", texts, args.batch_size)
+    reference_top = reference["probabilities"].argmax(axis=1)
+
+    print(f"{'backend':<14}{'agree':>8}{'max |dp|':>10}{'load s':>8}{'p50 ms':>8}{'p95 ms':>8}"
+          f"{'texts/s':>9}{'model MiB':>11}{'peak MiB':>10}")
+    failed = []
+    for name in ["reference"] + args.backends:
+        try:
+            result = reference if name == "reference" else _in_fresh_process(name, texts, args.batch_size)
+        except Exception as e:
+            print(f"{name:<14} unavailable: {e}")
+            continue
+        if result["labels"] != reference["labels"]:
+            print(f"{name:<14} label order differs from the reference: {result['labels']}")
+            failed.append(name)
+            continue
+
+        agreement = float((result["probabilities"].argmax(axis=1) == reference_top).mean())
+        max_diff = float(np.abs(result["probabilities"] - reference["probabilities"]).max())
+        print(f"{name:<14}{agreement:>8.1%}{max_diff:>10.4f}{result['load_seconds']:>8.1f}"
+              f"{result['p50_ms']:>8.1f}{result['p95_ms']:>8.1f}{result['throughput']:>9.1f}"
+              f"{result['model_rss_mib']:>11.0f}{result['peak_rss_mib']:>10.0f}")
+        if agreement < args.min_agreement:
+            failed.append(name)
+
+    if failed:
+        print(f"\nParity check failed for: {', '.join(failed)}")
+        sys.exit(1)
+    print("\nAll backends within parity tolerance.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Throughput of EncryptionHandler's single-item path vs. encrypt_many/decrypt_many.
+
+Run from the project root:
+    python -m benchmarks.bench_encryption [--entries 5000] [--size 1500]
+"""
+import argparse
+import os
+import time
+
+from cryptography.fernet import Fernet
+from core.encryption import EncryptionHandler
+
+def _timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed * 1000:9.1f} ms   {count / elapsed:10.0f} entries/s")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=5000, help="number of synthetic entries")
+    parser.add_argument("--size", type=int, default=1500, help="characters per entry")
+    args = parser.parse_args()
+
+    handler = EncryptionHandler(Fernet.generate_key())
+    texts = [os.urandom(args.size // 2).hex() for _ in range(args.entries)]
+    tokens = [handler.encrypt(text) for text in texts]
+    print(f"{args.entries} entries of {args.size} characters, {os.cpu_count()} CPUs\n")
+
+    print("encrypt")
+    _timed("single-item loop", args.entries, lambda: [handler.encrypt(t) for t in texts])
+    for workers in (1, 2, 4, 8):
+        _timed(f"encrypt_many(workers={workers})", args.entries,
+               lambda: list(handler.encrypt_many(texts, workers=workers)))
+
+    print("\ndecrypt")
+    _timed("single-item loop", args.entries, lambda: [handler.decrypt(t) for t in tokens])
+    for workers in (1, 2, 4, 8):
+        _timed(f"decrypt_many(workers={workers})", args.entries,
+               lambda: list(handler.decrypt_many(tokens, workers=workers)))
+
+if __name__ == "__main__":
+    main()
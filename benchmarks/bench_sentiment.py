@@ -0,0 +1,57 @@
+"""
+CPU throughput of SentimentAnalyzer.analyze vs. analyze_batch at several batch sizes.
+
+Run from the project root:
+    python -m benchmarks.bench_sentiment [--entries 256] [--backend pytorch]
+"""
+import argparse
+import random
+import time
+
+from core.inference import BACKENDS, SERVER_BACKEND
+from core.sentiment import SentimentAnalyzer, SentimentCache
+
+SAMPLE_SENTENCES = [
+    "I finally finished the project and the whole team celebrated together.",
+    "The appointment got cancelled again and I spent the afternoon waiting for nothing.",
+    "Walking home in the rain felt oddly calm tonight.",
+    "I can't believe they went behind my back like that.",
+    "There was a strange noise downstairs and I couldn't get back to sleep.",
+    "Grandma called out of the blue and told me stories about her childhood.",
+    "Groceries, laundry, emails. Nothing much happened today.",
+]
+
+def _make_entries(count, seed=0):
+    """Synthetic entries of 1 to 12 sentences, so batches contain mixed lengths."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(SAMPLE_SENTENCES, k=rng.randint(1, 12))) for _ in range(count)]
+
+def _timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<30} {elapsed:8.2f} s   {count / elapsed:8.1f} entries/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=256, help="number of synthetic entries")
+    parser.add_argument("--backend", choices=[*BACKENDS, SERVER_BACKEND], default=None, help="inference backend")
+    args = parser.parse_args()
+
+    analyzer = SentimentAnalyzer(backend=args.backend)
+    analyzer.load()
+    # Measure the model, not the caches: every pass scores the same texts, and each
+    # synthetic entry is a single paragraph that the paragraph cache would keep
+    analyzer.cache = SentimentCache(max_size=0)
+    analyzer.paragraph_cache = SentimentCache(max_size=0, normalize=False)
+    texts = _make_entries(args.entries)
+    analyzer.analyze_batch(texts[:8]) # Warm-up
+    print(f"{args.entries} entries\n")
+
+    _timed("analyze() loop", args.entries, lambda: [analyzer.analyze(t) for t in texts])
+    for batch_size in (1, 4, 8, 16, 32, 64):
+        _timed(f"analyze_batch(batch_size={batch_size})", args.entries,
+               lambda: analyzer.analyze_batch(texts, batch_size=batch_size))
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 
 
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
 from core.db import DatabaseHandler
-from core.encryption import generate_salt
+from core.encryption import generate_salt, generate_data_key, derive_key, wrap_key, unwrap_key
+from core.kdf import calibrate, load_kdf, needs_upgrade
+
+# bcrypt work factor for new password hashes. Hashes below it are upgraded on login.
+BCRYPT_ROUNDS = 12
+
+def _bcrypt_rounds(password_hash: bytes) -> int:
+    """Reads the cost factor from a '$2b$<rounds>$...' bcrypt hash."""
+    return int(password_hash.split(b'$')[2])
 
 class AuthHandler:
     """
@@ -21,7 +31,8 @@ class AuthHandler:
     def register_user(self, username: str, password: str) -> tuple[bool, str]:
         """
         Registers a new user. Hashes the password, generates an encryption salt,
-        and stores the new user in the database.
+        and stores the new user in the database. Slow (KDF calibration, a key
+        derivation and bcrypt), so call it from a worker thread.
 
         Args:
             username (str): The desired username.
@@ -41,44 +52,125 @@ class AuthHandler:
 
         # 1. Hash the password with bcrypt
         password_bytes = password.encode('utf-8')
-        bcrypt_salt = bcrypt.gensalt()
+        bcrypt_salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         password_hash = bcrypt.hashpw(password_bytes, bcrypt_salt)
 
-        # 2. Generate the separate salt for entry encryption
+        # 2. Generate a random data key for the entries and wrap it with a key derived
+        #    from the password, using a KDF cost calibrated to this machine
         encryption_salt = generate_salt()
+        kdf = calibrate()
+        wrapped_key = wrap_key(derive_key(password, encryption_salt, kdf), generate_data_key())
 
         # 3. Add user to the database
-        success = self.db_handler.add_user(username, password_hash, encryption_salt)
+        success = self.db_handler.add_user(
+            username, password_hash, encryption_salt, kdf.to_record(), wrapped_key
+        )
 
         if success:
             return (True, "Registration successful! You can now log in.")
         else:
             return (False, "An error occurred during registration. Please try again.")
 
-    def login_user(self, username: str, password: str) -> tuple[bool, str]:
+    def unlock(self, username: str, password: str) -> tuple[bool, str, bytes | None]:
         """
-        Authenticates a user by checking their password against the stored hash.
+        Authenticates a user and recovers their data encryption key in one step.
+
+        The bcrypt check and the key derivation do not depend on each other, so they
+        run concurrently; both spend their time in native code, so the total is
+        roughly the slower of the two rather than their sum. If the account's KDF or
+        bcrypt settings are weaker than current policy, they are upgraded in place
+        by re-wrapping the data key; entries are never re-encrypted. Intended to be
+        called from a worker thread, never from the GUI thread.
 
         Args:
             username (str): The username of the user trying to log in.
             password (str): The password provided by the user.
 
+        Returns:
+            tuple[bool, str, bytes | None]: Success flag, message, and the data
+                                            encryption key (None on failure).
+        """
+        record = self.db_handler.get_user_key_material(username)
+
+        if not record:
+            # Important: Use a generic error message to prevent username enumeration
+            return (False, "Invalid username or password.", None)
+
+        success, message, data_key = self._open_data_key(record, password)
+        if not success:
+            return (False, message, None)
+
+        kdf = load_kdf(record['kdf_params'])
+        if (record['wrapped_key'] is None or needs_upgrade(kdf)
+                or _bcrypt_rounds(record['password_hash']) < BCRYPT_ROUNDS):
+            # Accounts from before envelope encryption keep their old derived key as
+            # the data key; it just gets wrapped so future changes are O(1)
+            self._store_key_material(username, password, data_key)
+
+        return (True, "Login successful!", data_key)
+
+    def change_password(self, username: str, current_password: str, new_password: str) -> tuple[bool, str]:
+        """
+        Changes a user's master password.
+
+        Only the wrapped data key, salt, KDF settings and bcrypt hash are rewritten,
+        in a single row update; entries stay encrypted under the same data key.
+        Slow (two key derivations), so call it from a worker thread.
+
         Returns:
             tuple[bool, str]: A tuple containing a boolean for success
                               and a message string.
         """
-        # 1. Fetch the stored hash from the database
-        stored_hash = self.db_handler.get_user_hash(username)
+        if len(new_password) < 8:
+            return (False, "Your new master password must be at least 8 characters long.")
 
-        if not stored_hash:
-            # Important: Use a generic error message to prevent username enumeration
-            return (False, "Invalid username or password.")
+        record = self.db_handler.get_user_key_material(username)
+        if not record:
+            return (False, "Current password is incorrect.")
+
+        success, _, data_key = self._open_data_key(record, current_password)
+        if not success:
+            return (False, "Current password is incorrect.")
+
+        if self._store_key_material(username, new_password, data_key):
+            return (True, "Your master password has been changed.")
+        return (False, "An error occurred while changing your password. Your old password still works.")
+
+    def _open_data_key(self, record: dict, password: str) -> tuple[bool, str, bytes | None]:
+        """Verifies a password against a user record and unwraps the data key."""
+        kdf = load_kdf(record['kdf_params'])
 
-        # 2. Check the provided password against the stored hash
         password_bytes = password.encode('utf-8')
-        
-        # bcrypt.checkpw handles the comparison securely
-        if bcrypt.checkpw(password_bytes, stored_hash):
-            return (True, "Login successful!")
-        else:
-            return (False, "Invalid username or password.")
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            key_future = executor.submit(derive_key, password, record['encryption_salt'], kdf)
+            password_ok = bcrypt.checkpw(password_bytes, record['password_hash'])
+            wrapping_key = key_future.result()
+
+        if not password_ok:
+            return (False, "Invalid username or password.", None)
+
+        if record['wrapped_key'] is None:
+            # The account has no separate data key yet: entries are encrypted
+            # directly with the password-derived key
+            return (True, "", wrapping_key)
+        try:
+            return (True, "", unwrap_key(wrapping_key, record['wrapped_key']))
+        except InvalidToken:
+            return (False, "Could not unlock the vault: the stored key is damaged.", None)
+
+    def _store_key_material(self, username: str, password: str, data_key: bytes) -> bool:
+        """
+        Wraps a user's data key under `password` with freshly calibrated KDF settings
+        and a new salt, and stores it together with a current-cost bcrypt hash. On
+        failure the old settings are kept, since they still unlock the same data key.
+        """
+        kdf = calibrate()
+        salt = generate_salt()
+        wrapped_key = wrap_key(derive_key(password, salt, kdf), data_key)
+        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+        success = self.db_handler.update_user_key_material(
+            username, salt, kdf.to_record(), wrapped_key, password_hash
+        )
+        if success:
+            print(f"Stored wrapped data key for '{username}' using {kdf!r}.")
+        return success
@@ -1,10 +1,30 @@
-
-
 import sqlite3
 from sqlite3 import Error
 import os
+import calendar
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
+from core.migrations import BackfillRunner, migrate
+from core.rollups import ROLLUP_PERIODS, rollup_add, rollup_remove, recompute_rollups, recompute_rollups_for_dates
+from core.sentiment import unpack_scores
+
+# Upper bound on simultaneously open SQLite connections. SQLite serialises
+# writers anyway, so a few connections cover the GUI thread plus background workers.
+POOL_SIZE = 4
+# Seconds a thread waits for a free pooled connection before giving up.
+POOL_TIMEOUT = 10.0
+# Number of compiled statements each connection keeps in its LRU cache.
+# Every query in this module uses a fixed SQL string, so after the first call
+# the prepare step is skipped entirely.
+STATEMENT_CACHE_SIZE = 256
+# How often the background checkpointer folds the WAL back into the database file.
+CHECKPOINT_INTERVAL = 30.0
+# Persistent sentiment cache rows kept per user; least recently used go first.
+SENTIMENT_CACHE_MAX_ROWS = 5000
+
 # In core/db.py
 def get_db_path():
     """
@@ -21,215 +41,1016 @@ def get_db_path():
     print(f"Database path set to: {db_path}")
     return db_path
 
+def _replace_entry_terms(cursor, user_id, date, term_hashes):
+    """
+    Brings the search index rows of one entry in line with `term_hashes`. Only the
+    terms that were added or removed are written, so re-saving an entry after a
+    small edit touches a handful of rows.
+    """
+    cursor.execute("SELECT term_hash FROM entry_terms WHERE user_id = ? AND entry_date = ?", (user_id, date))
+    current = {row[0] for row in cursor.fetchall()}
+    wanted = set(term_hashes)
+    cursor.executemany(
+        "DELETE FROM entry_terms WHERE user_id = ? AND term_hash = ? AND entry_date = ?",
+        ((user_id, term_hash, date) for term_hash in current - wanted)
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO entry_terms (user_id, term_hash, entry_date) VALUES (?, ?, ?)",
+        ((user_id, term_hash, date) for term_hash in wanted - current)
+    )
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """
+    The set of SQLite PRAGMAs applied to every connection when it is opened.
+
+    The defaults put the database in WAL mode, so saves no longer block readers
+    (and vice versa), and relax synchronous to NORMAL, which in WAL mode only
+    fsyncs at checkpoints instead of on every commit.
+    """
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    cache_size: int = -16000            # Negative values are KiB, i.e. ~16 MB of page cache
+    mmap_size: int = 64 * 1024 * 1024   # Bytes of the database file to memory-map
+    temp_store: str = "MEMORY"
+    wal_autocheckpoint: int = 1000      # Pages; SQLite's own fallback checkpoint trigger
+    journal_size_limit: int = 16 * 1024 * 1024  # Bytes the WAL is truncated to after a checkpoint
+
+    def __post_init__(self):
+        # PRAGMA values cannot be bound as parameters, so validate them up front
+        choices = {
+            "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+            "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+            "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+        }
+        for name, allowed in choices.items():
+            if getattr(self, name).upper() not in allowed:
+                raise ValueError(f"Invalid {name} '{getattr(self, name)}'. Expected one of {sorted(allowed)}.")
+        for name in ("cache_size", "mmap_size", "wal_autocheckpoint", "journal_size_limit"):
+            if not isinstance(getattr(self, name), int):
+                raise ValueError(f"{name} must be an integer.")
+
+    @property
+    def uses_wal(self):
+        return self.journal_mode.upper() == "WAL"
+
+    def apply(self, conn):
+        """Applies the profile to an open connection."""
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        conn.execute(f"PRAGMA temp_store = {self.temp_store}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {self.wal_autocheckpoint}")
+        conn.execute(f"PRAGMA journal_size_limit = {self.journal_size_limit}")
+
+DEFAULT_STORAGE_PROFILE = StorageProfile()
+
+class ConnectionPool:
+    """
+    A bounded, thread-aware pool of long-lived SQLite connections.
+
+    Each thread checks out at most one connection at a time; nested checkouts on
+    the same thread (e.g. a helper called inside a transaction) reuse it. Connections
+    are opened lazily, kept open between calls and carry sqlite3's per-connection
+    prepared-statement cache, so repeated queries only pay for execution.
+    """
+    def __init__(self, db_path, profile=DEFAULT_STORAGE_PROFILE, max_size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        """
+        Args:
+            db_path (Path): Location of the SQLite database file.
+            profile (StorageProfile): PRAGMAs applied to each new connection.
+            max_size (int): Maximum number of connections open at once.
+            timeout (float): Seconds to wait for a free connection.
+        """
+        self.db_path = db_path
+        self.profile = profile
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+        # Bumped by close() so connections checked out at that moment are
+        # closed on return instead of going back into the idle list.
+        self._generation = 0
+
+    def _open(self):
+        """Opens and configures a new connection."""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,  # Connections move between threads, but only one uses them at a time
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        # Enable foreign key support, which is off by default in SQLite
+        conn.execute("PRAGMA foreign_keys = 1")
+        self.profile.apply(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a connection out of the pool for the duration of a `with` block.
+
+        Any transaction left open when the block exits is rolled back, so a failed
+        statement never leaks half-finished work into the next caller.
+
+        Raises:
+            sqlite3.OperationalError: If no connection becomes free within the timeout.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            # Re-entrant use on the same thread shares the outer connection
+            yield conn
+            return
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for a free database connection.")
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                generation = self._generation
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn, generation)
+            self._slots.release()
+
+    def _release(self, conn, generation):
+        """Returns a connection to the idle list, or closes it if the pool was closed meanwhile."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            conn.close()
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Closes every idle connection. Connections currently in use are closed as
+        soon as they are returned. The pool stays usable and reopens lazily.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._generation += 1
+        for conn in idle:
+            conn.close()
+
+
+class CheckpointScheduler:
+    """
+    Periodically checkpoints the WAL on a background thread so it does not grow
+    without limit between SQLite's own auto-checkpoints.
+
+    Routine checkpoints run in PASSIVE mode, which never waits on readers or
+    writers. A TRUNCATE checkpoint, which also shrinks the -wal file, is attempted
+    when the scheduler stops.
+    """
+    def __init__(self, pool, interval=CHECKPOINT_INTERVAL):
+        """
+        Args:
+            pool (ConnectionPool): The pool to borrow connections from.
+            interval (float): Seconds between checkpoints.
+        """
+        self.pool = pool
+        self.interval = interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def ensure_started(self):
+        """Starts the background thread if it is not already running (no-op outside WAL mode)."""
+        if self.running or not self.pool.profile.uses_wal:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+            self._thread.start()
+
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Runs a single checkpoint.
+
+        Returns:
+            tuple[int, int, int] | None: SQLite's (busy, wal_pages, checkpointed_pages),
+                                         or None if the checkpoint could not run.
+        """
+        try:
+            with self.pool.connection() as conn:
+                return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        except Error as e:
+            print(f"Error checkpointing WAL: {e}")
+            return None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.checkpoint("PASSIVE")
+
+    def stop(self):
+        """Stops the background thread and truncates the WAL."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join()
+        self.checkpoint("TRUNCATE")
+
 class DatabaseHandler:
     """
     Handles all database connections and queries for the MoodVault application using SQLite.
     """
-    def __init__(self):
-        """Initializes the handler and creates tables if they don't exist."""
+    def __init__(self, profile=DEFAULT_STORAGE_PROFILE):
+        """
+        Initializes the handler and creates tables if they don't exist.
+
+        Args:
+            profile (StorageProfile): The SQLite storage settings to open connections with.
+        """
         self.db_path = get_db_path()
+        self.pool = ConnectionPool(self.db_path, profile=profile)
+        self.checkpointer = CheckpointScheduler(self.pool)
+        self.backfills = BackfillRunner(self.pool)
         self.create_tables()
 
-    def _get_connection(self):
-        """Establishes a new database connection."""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path)
-            # Enable foreign key support, which is off by default in SQLite
-            conn.execute("PRAGMA foreign_keys = 1")
-        except Error as e:
-            print(f"Error connecting to SQLite Database: {e}")
-        return conn
+    def _connection(self):
+        """Checks out a pooled database connection for use in a `with` block."""
+        self.checkpointer.ensure_started()
+        self.backfills.ensure_started()
+        return self.pool.connection()
 
-    def create_tables(self):
-        """Creates the necessary tables if they do not already exist."""
-        conn = self._get_connection()
-        if not conn:
-            return
+    def close(self):
+        """
+        Stops the background backfills and WAL checkpointer and closes all pooled
+        connections. Call on logout and on application exit; everything restarts
+        lazily on next use.
+        """
+        self.backfills.stop()
+        self.checkpointer.stop()
+        self.pool.close()
 
+    def create_tables(self):
+        """
+        Creates or upgrades the schema by applying any pending migrations, then
+        starts the background backfills those migrations scheduled.
+        """
         try:
-            cursor = conn.cursor()
-            # User table with SQLite-compatible syntax
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                encryption_salt BLOB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            """)
-
-            # Entries table with SQLite-compatible syntax
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                entry_date DATE NOT NULL,
-                encrypted_entry BLOB NOT NULL,
-                sentiment_label TEXT,
-                sentiment_score REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, entry_date),
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            );
-            """)
-            conn.commit()
-            print("SQLite database tables checked/created successfully.")
+            # Straight from the pool: background jobs must not start before the schema exists
+            with self.pool.connection() as conn:
+                migrate(conn)
+                print("SQLite database tables checked/created successfully.")
         except Error as e:
             print(f"Error creating SQLite tables: {e}")
-        finally:
-            if conn:
-                conn.close()
+            return
+        self.backfills.ensure_started()
 
-    def add_user(self, username, password_hash, encryption_salt):
+    def add_user(self, username, password_hash, encryption_salt, kdf_params=None, wrapped_key=None):
         """Adds a new user to the database."""
-        sql = "INSERT INTO users (username, password_hash, encryption_salt) VALUES (?, ?, ?)"
-        conn = self._get_connection()
-        if not conn: return False
-        
+        sql = """
+        INSERT INTO users (username, password_hash, encryption_salt, kdf_params, wrapped_key)
+        VALUES (?, ?, ?, ?, ?)
+        """
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (username, password_hash, encryption_salt))
-            conn.commit()
-            return True
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (username, password_hash, encryption_salt, kdf_params, wrapped_key))
+                conn.commit()
+                return True
         except Error as e:
             print(f"Error adding user: {e}")
             return False
-        finally:
-            if conn:
-                conn.close()
 
     def get_user_hash(self, username):
         """Retrieves the password hash for a given username."""
         sql = "SELECT password_hash FROM users WHERE username = ?"
-        conn = self._get_connection()
-        if not conn: return None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (username,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (username,))
+                result = cursor.fetchone()
+                return result[0] if result else None
         except Error as e:
             print(f"Error fetching user hash: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def get_user_id(self, username):
         """Retrieves the user ID for a given username."""
         sql = "SELECT id FROM users WHERE username = ?"
-        conn = self._get_connection()
-        if not conn: return None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (username,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (username,))
+                result = cursor.fetchone()
+                return result[0] if result else None
         except Error as e:
             print(f"Error fetching user ID: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def get_first_user_id(self):
         """Checks if any user exists and returns the first user's ID."""
         sql = "SELECT id FROM users ORDER BY id LIMIT 1"
-        conn = self._get_connection()
-        if not conn: return None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql)
-            result = cursor.fetchone()
-            return result[0] if result else None
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql)
+                result = cursor.fetchone()
+                return result[0] if result else None
         except Error as e:
             print(f"Error fetching first user ID: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def get_user_salt(self, username):
         """Retrieves the encryption salt for a given username."""
         sql = "SELECT encryption_salt FROM users WHERE username = ?"
-        conn = self._get_connection()
-        if not conn: return None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (username,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (username,))
+                result = cursor.fetchone()
+                return result[0] if result else None
         except Error as e:
             print(f"Error fetching user salt: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
-    def add_or_update_entry(self, user_id, date, encrypted_data, mood, score):
-        """Adds a new entry or updates an existing one using INSERT OR REPLACE."""
+    def get_user_key_material(self, username):
+        """
+        Retrieves everything needed to authenticate a user and unlock their data key.
+
+        Returns:
+            dict | None: password_hash, encryption_salt, kdf_params and wrapped_key,
+                         or None if the user does not exist.
+        """
         sql = """
-        INSERT OR REPLACE INTO entries (user_id, entry_date, encrypted_entry, sentiment_label, sentiment_score)
-        VALUES (?, ?, ?, ?, ?);
+        SELECT password_hash, encryption_salt, kdf_params, wrapped_key
+        FROM users WHERE username = ?
         """
-        conn = self._get_connection()
-        if not conn: return False
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, (username,))
+                result = cursor.fetchone()
+                return dict(result) if result else None
+        except Error as e:
+            print(f"Error fetching user key material: {e}")
+            return None
 
+    def update_user_key_material(self, username, encryption_salt, kdf_params, wrapped_key, password_hash=None):
+        """
+        Replaces a user's salt, KDF settings and wrapped data key in one small update,
+        and optionally their password hash. Entries are not touched.
+        """
+        sql = """
+        UPDATE users SET encryption_salt = ?, kdf_params = ?, wrapped_key = ?,
+                         password_hash = COALESCE(?, password_hash)
+        WHERE username = ?
+        """
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (user_id, date, encrypted_data, mood, score))
-            conn.commit()
-            return True
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (encryption_salt, kdf_params, wrapped_key, password_hash, username))
+                conn.commit()
+                return cursor.rowcount == 1
+        except Error as e:
+            print(f"Error updating user key material: {e}")
+            return False
+
+    def add_or_update_entry(self, user_id, date, encrypted_data, mood, score, term_hashes=None,
+                            encrypted_embedding=None, sentiment_scores=None, model_version=None):
+        """
+        Adds a new entry or updates an existing one using INSERT OR REPLACE.
+        The mood and emotion rollups are updated in the same transaction; when an
+        entry is replaced, its previous results are backed out first.
+
+        Args:
+            term_hashes (Iterable[bytes], optional): The entry's blind search terms
+                                                     (see core.search). When given, the
+                                                     index is updated in the same transaction.
+            encrypted_embedding (bytes, optional): The entry's encrypted sentence embedding.
+            sentiment_scores (bytes, optional): The full emotion distribution, packed with
+                                                core.sentiment.pack_scores.
+            model_version (str, optional): SentimentAnalyzer.scoring_version of the scores;
+                                           None if the entry was not scored.
+        """
+        sql = """
+        INSERT OR REPLACE INTO entries
+            (user_id, entry_date, encrypted_entry, sentiment_label, sentiment_score, encrypted_embedding,
+             sentiment_scores, model_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """
+        previous_sql = """
+        SELECT sentiment_label, sentiment_score, sentiment_scores FROM entries WHERE user_id = ? AND entry_date = ?
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                # Take the write lock before reading the old row so the rollup delta
+                # cannot race with another writer
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(previous_sql, (user_id, date))
+                previous = cursor.fetchone()
+                cursor.execute(sql, (
+                    user_id, date, encrypted_data, mood, score, encrypted_embedding, sentiment_scores, model_version
+                ))
+                if previous:
+                    rollup_remove(cursor, user_id, date, *previous)
+                rollup_add(cursor, user_id, date, mood, score, sentiment_scores)
+                if term_hashes is not None:
+                    _replace_entry_terms(cursor, user_id, date, term_hashes)
+                conn.commit()
+                return True
         except Error as e:
             print(f"Error adding/updating entry: {e}")
             return False
-        finally:
-            if conn:
-                conn.close()
+
+    def add_or_update_entries(self, user_id, entries, job_id=None, position=None, term_hashes=None):
+        """
+        Adds or replaces many entries in a single transaction using executemany.
+
+        Args:
+            user_id (int): The owner of the entries.
+            entries (list[tuple]): (date, encrypted_data, mood, score, encrypted_embedding,
+                                   sentiment_scores, model_version) tuples; the last three may
+                                   be None. Rollups of the months they fall in are rebuilt.
+            job_id (str, optional): Import job to record a checkpoint for. The checkpoint
+                                    is committed atomically with the entries.
+            position (int, optional): Number of source items consumed once this batch is written.
+            term_hashes (dict, optional): Blind search terms per entry date, indexed in the
+                                          same transaction.
+
+        Returns:
+            bool: True if the whole batch was committed, False if it was rolled back.
+        """
+        sql = """
+        INSERT OR REPLACE INTO entries
+            (user_id, entry_date, encrypted_entry, sentiment_label, sentiment_score, encrypted_embedding,
+             sentiment_scores, model_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """
+        checkpoint_sql = """
+        INSERT OR REPLACE INTO import_checkpoints (user_id, job_id, position, updated_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP);
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(sql, ((user_id, *entry) for entry in entries))
+                # Rebuilding the touched months once is cheaper than a delta per row
+                recompute_rollups_for_dates(cursor, user_id, [entry[0] for entry in entries])
+                for date, hashes in (term_hashes or {}).items():
+                    _replace_entry_terms(cursor, user_id, date, hashes)
+                if job_id is not None:
+                    cursor.execute(checkpoint_sql, (user_id, job_id, position))
+                conn.commit()
+                return True
+        except Error as e:
+            print(f"Error adding/updating entries in bulk: {e}")
+            return False
+
+    def get_import_checkpoint(self, user_id, job_id):
+        """Returns how many source items an import job has already committed (0 if none)."""
+        sql = "SELECT position FROM import_checkpoints WHERE user_id = ? AND job_id = ?"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, job_id))
+                result = cursor.fetchone()
+                return result[0] if result else 0
+        except Error as e:
+            print(f"Error fetching import checkpoint: {e}")
+            return 0
+
+    def clear_import_checkpoint(self, user_id, job_id):
+        """Removes the checkpoint of a finished import job."""
+        sql = "DELETE FROM import_checkpoints WHERE user_id = ? AND job_id = ?"
+        try:
+            with self._connection() as conn:
+                conn.execute(sql, (user_id, job_id))
+                conn.commit()
+                return True
+        except Error as e:
+            print(f"Error clearing import checkpoint: {e}")
+            return False
+
+    def get_entries_not_in_format(self, user_id, prefix, after_id=0, limit=100):
+        """
+        Retrieves encrypted entries whose blob does not start with `prefix`, in id order.
+        Used to find rows still stored in an older encryption format.
+
+        Returns:
+            list[tuple[int, bytes]]: (id, encrypted_entry) pairs with id > after_id.
+        """
+        sql = """
+        SELECT id, encrypted_entry FROM entries
+        WHERE user_id = ? AND id > ? AND substr(encrypted_entry, 1, ?) != ?
+        ORDER BY id LIMIT ?
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, after_id, len(prefix), prefix, limit))
+                return cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching entries to convert: {e}")
+            return []
+
+    def replace_entry_blobs(self, replacements):
+        """
+        Swaps the encrypted blob of existing entries in one transaction. A row is only
+        updated if it still holds the expected old blob, so an entry saved by the user
+        in the meantime is never overwritten.
+
+        Args:
+            replacements (list[tuple[int, bytes, bytes]]): (id, old_blob, new_blob) triples.
+
+        Returns:
+            int | None: Number of rows updated, or None on error.
+        """
+        sql = "UPDATE entries SET encrypted_entry = ? WHERE id = ? AND encrypted_entry = ?"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(sql, ((new, entry_id, old) for entry_id, old, new in replacements))
+                conn.commit()
+                return cursor.rowcount
+        except Error as e:
+            print(f"Error replacing entry blobs: {e}")
+            return None
 
     def get_entry_by_date(self, user_id, date):
         """Retrieves a single entry by user and date."""
         sql = "SELECT encrypted_entry, sentiment_label FROM entries WHERE user_id = ? AND entry_date = ?"
-        conn = self._get_connection()
-        if not conn: return None, None
-
         try:
-            cursor = conn.cursor()
-            cursor.execute(sql, (user_id, date))
-            result = cursor.fetchone()
-            return result if result else (None, None)
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, date))
+                result = cursor.fetchone()
+                return result if result else (None, None)
         except Error as e:
             print(f"Error fetching entry by date: {e}")
             return None, None
-        finally:
-            if conn:
-                conn.close()
 
     def get_all_entries_for_user(self, user_id):
         """Retrieves all entry metadata for a user (for visualizations)."""
         sql = "SELECT entry_date, sentiment_label, sentiment_score FROM entries WHERE user_id = ? ORDER BY entry_date ASC"
-        conn = self._get_connection()
-        if not conn: return []
-        
         try:
-            # Use sqlite3.Row to make rows behave like dictionaries
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(sql, (user_id,))
-            results = [dict(row) for row in cursor.fetchall()]
-            return results
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                # Use sqlite3.Row to make rows behave like dictionaries. Set on the cursor,
+                # not the connection, because pooled connections are shared between calls.
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, (user_id,))
+                results = [dict(row) for row in cursor.fetchall()]
+                return results
         except Error as e:
             print(f"Error fetching all entries: {e}")
             return []
-        finally:
-            if conn:
-                conn.close()
+
+    def get_entries_between(self, user_id, start, end, limit=None, after=None):
+        """
+        Retrieves entry metadata for an inclusive date range, oldest first.
+
+        Supports keyset pagination: pass the `entry_date` of the last row of one page
+        as `after` to fetch the next page. Each page is a single index range scan,
+        however deep into the history it starts.
+
+        Args:
+            user_id (int): The owner of the entries.
+            start (date | str): First date of the range.
+            end (date | str): Last date of the range.
+            limit (int, optional): Maximum number of rows to return.
+            after (date | str, optional): Only return entries dated strictly after this.
+
+        Returns:
+            list[dict]: Rows with entry_date, sentiment_label and sentiment_score.
+        """
+        sql = """
+        SELECT entry_date, sentiment_label, sentiment_score FROM entries
+        WHERE user_id = ? AND entry_date >= ? AND entry_date <= ? AND entry_date > ?
+        ORDER BY entry_date ASC LIMIT ?
+        """
+        # An empty string sorts before every date, and LIMIT -1 means no limit in SQLite
+        params = (user_id, start, end, after if after is not None else "", limit if limit is not None else -1)
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except Error as e:
+            print(f"Error fetching entries between {start} and {end}: {e}")
+            return []
+
+    def get_entry_blobs_between(self, user_id, start, end):
+        """
+        Retrieves full entries, including the encrypted text, for an inclusive date
+        range in one query. Used to prefetch the months around the calendar view.
+
+        Returns:
+            list[tuple]: (entry_date, encrypted_entry, sentiment_label) rows, oldest first.
+        """
+        sql = """
+        SELECT entry_date, encrypted_entry, sentiment_label FROM entries
+        WHERE user_id = ? AND entry_date >= ? AND entry_date <= ?
+        ORDER BY entry_date ASC
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, start, end))
+                return cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching entries between {start} and {end}: {e}")
+            return []
+
+    def get_month_entries(self, user_id, year, month):
+        """Retrieves entry metadata for a single calendar month."""
+        last_day = calendar.monthrange(year, month)[1]
+        start = f"{year:04d}-{month:02d}-01"
+        end = f"{year:04d}-{month:02d}-{last_day:02d}"
+        return self.get_entries_between(user_id, start, end)
+
+    # --- Mood rollups ---
+
+    def rebuild_rollups(self):
+        """Rebuilds all mood rollups from scratch, e.g. after manual edits to entries."""
+        try:
+            with self._connection() as conn:
+                recompute_rollups(conn.cursor())
+                conn.commit()
+                return True
+        except Error as e:
+            print(f"Error rebuilding mood rollups: {e}")
+            return False
+
+    def get_mood_rollups(self, user_id, period="month", start=None, end=None):
+        """
+        Retrieves pre-aggregated mood statistics, oldest period first.
+
+        Args:
+            user_id (int): The owner of the entries.
+            period (str): 'day', 'week' or 'month'.
+            start (date | str, optional): Earliest period start to include.
+            end (date | str, optional): Latest period start to include.
+
+        Returns:
+            list[dict]: One row per (period_start, sentiment_label) with entry_count,
+                        score_sum, mean_score, score_min and score_max.
+        """
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f"Unknown rollup period '{period}'.")
+        sql = """
+        SELECT period_start, sentiment_label, entry_count, score_sum,
+               score_sum / entry_count AS mean_score, score_min, score_max
+        FROM mood_rollups
+        WHERE user_id = ? AND period = ? AND period_start >= ? AND period_start <= ?
+        ORDER BY period_start ASC, sentiment_label ASC
+        """
+        # '9999-12-31' sorts after every real date
+        params = (user_id, period, start if start is not None else "", end if end is not None else "9999-12-31")
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except Error as e:
+            print(f"Error fetching mood rollups: {e}")
+            return []
+
+    def get_emotion_rollups(self, user_id, period="month", start=None, end=None):
+        """
+        Retrieves the per-period averages of the stored emotion distributions,
+        oldest period first. Arguments as for `get_mood_rollups`.
+
+        Returns:
+            list[dict]: One row per (period_start, emotion) with entry_count, score_sum
+                        and mean_score, the emotion's average share of an entry.
+        """
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f"Unknown rollup period '{period}'.")
+        sql = """
+        SELECT period_start, emotion, entry_count, score_sum, score_sum / entry_count AS mean_score
+        FROM emotion_rollups
+        WHERE user_id = ? AND period = ? AND period_start >= ? AND period_start <= ?
+        ORDER BY period_start ASC, emotion ASC
+        """
+        params = (user_id, period, start if start is not None else "", end if end is not None else "9999-12-31")
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except Error as e:
+            print(f"Error fetching emotion rollups: {e}")
+            return []
+
+    def get_entry_scores_between(self, user_id, start, end):
+        """
+        Retrieves the stored emotion distribution of every entry in an inclusive
+        date range that has one, for charts that need more than the rollups.
+
+        Returns:
+            list[tuple[str, np.ndarray]]: (entry_date, scores) rows, oldest first. Each
+                                          scores array is a read-only view of the fetched
+                                          blob in SCORE_LABELS order (see unpack_scores),
+                                          so no per-row copy is made.
+        """
+        sql = """
+        SELECT entry_date, sentiment_scores FROM entries
+        WHERE user_id = ? AND entry_date >= ? AND entry_date <= ? AND sentiment_scores IS NOT NULL
+        ORDER BY entry_date ASC
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, start, end))
+                return [(entry_date, unpack_scores(scores)) for entry_date, scores in cursor.fetchall()]
+        except Error as e:
+            print(f"Error fetching emotion scores between {start} and {end}: {e}")
+            return []
+
+    # --- Sentiment cache ---
+
+    def get_cached_sentiment(self, user_id, key_hash):
+        """Returns the encrypted cached result for a key hash, or None, and marks it as used."""
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT encrypted_result FROM sentiment_cache WHERE user_id = ? AND key_hash = ?",
+                    (user_id, key_hash)
+                )
+                result = cursor.fetchone()
+                if result:
+                    cursor.execute(
+                        "UPDATE sentiment_cache SET last_used = CURRENT_TIMESTAMP WHERE user_id = ? AND key_hash = ?",
+                        (user_id, key_hash)
+                    )
+                    conn.commit()
+                return result[0] if result else None
+        except Error as e:
+            print(f"Error reading sentiment cache: {e}")
+            return None
+
+    def put_cached_sentiment(self, user_id, key_hash, encrypted_result):
+        """Stores an encrypted sentiment result under a key hash."""
+        sql = """
+        INSERT OR REPLACE INTO sentiment_cache (user_id, key_hash, encrypted_result, last_used)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute(sql, (user_id, key_hash, encrypted_result))
+                conn.commit()
+                return True
+        except Error as e:
+            print(f"Error writing sentiment cache: {e}")
+            return False
+
+    def prune_sentiment_cache(self, user_id, keep=SENTIMENT_CACHE_MAX_ROWS):
+        """Deletes all but the `keep` most recently used cache rows of a user."""
+        sql = """
+        DELETE FROM sentiment_cache WHERE user_id = ? AND key_hash NOT IN (
+            SELECT key_hash FROM sentiment_cache WHERE user_id = ?
+            ORDER BY last_used DESC LIMIT ?
+        )
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, user_id, keep))
+                conn.commit()
+                return cursor.rowcount
+        except Error as e:
+            print(f"Error pruning sentiment cache: {e}")
+            return 0
+
+    # --- Re-scoring ---
+
+    def count_stale_entries(self, user_id, model_version):
+        """Counts entries not scored by `model_version`, including never-versioned ones."""
+        sql = "SELECT COUNT(*) FROM entries WHERE user_id = ? AND (model_version IS NULL OR model_version != ?)"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, model_version))
+                return cursor.fetchone()[0]
+        except Error as e:
+            print(f"Error counting entries to re-score: {e}")
+            return 0
+
+    def get_stale_entries(self, user_id, model_version, after_id=0, limit=100):
+        """
+        Retrieves entries not scored by `model_version`, in id order.
+
+        Returns:
+            list[tuple[int, str, bytes]]: (id, entry_date, encrypted_entry) rows with id > after_id.
+        """
+        sql = """
+        SELECT id, entry_date, encrypted_entry FROM entries
+        WHERE user_id = ? AND id > ? AND (model_version IS NULL OR model_version != ?)
+        ORDER BY id LIMIT ?
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, after_id, model_version, limit))
+                return cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching entries to re-score: {e}")
+            return []
+
+    def update_entry_scores(self, user_id, updates):
+        """
+        Replaces the mood results of several entries in one transaction, keeping the
+        rollups in step. An entry is skipped if its text changed since it was read;
+        the save that changed it scored it already.
+
+        Args:
+            user_id (int): The owner of the entries.
+            updates (list[tuple]): (entry_date, encrypted_entry as read, mood, score,
+                                   encrypted_embedding, sentiment_scores, model_version) tuples.
+
+        Returns:
+            int | None: Number of entries updated, or None on error.
+        """
+        current_sql = """
+        SELECT encrypted_entry, sentiment_label, sentiment_score, sentiment_scores FROM entries
+        WHERE user_id = ? AND entry_date = ?
+        """
+        update_sql = """
+        UPDATE entries SET sentiment_label = ?, sentiment_score = ?, encrypted_embedding = ?,
+            sentiment_scores = ?, model_version = ?
+        WHERE user_id = ? AND entry_date = ?
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                updated = 0
+                for entry_date, blob, mood, score, embedding, scores, model_version in updates:
+                    cursor.execute(current_sql, (user_id, entry_date))
+                    row = cursor.fetchone()
+                    if row is None or row[0] != blob:
+                        continue
+                    cursor.execute(update_sql, (mood, score, embedding, scores, model_version, user_id, entry_date))
+                    rollup_remove(cursor, user_id, entry_date, *row[1:])
+                    rollup_add(cursor, user_id, entry_date, mood, score, scores)
+                    updated += 1
+                conn.commit()
+                return updated
+        except Error as e:
+            print(f"Error updating entry scores: {e}")
+            return None
+
+    def get_entry_embeddings(self, user_id):
+        """
+        Retrieves the encrypted embedding of every entry that has one, to build the
+        in-memory similarity index.
+
+        Returns:
+            list[tuple[str, bytes]]: (entry_date, encrypted_embedding) rows, oldest first.
+        """
+        sql = """
+        SELECT entry_date, encrypted_embedding FROM entries
+        WHERE user_id = ? AND encrypted_embedding IS NOT NULL
+        ORDER BY entry_date ASC
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id,))
+                return cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching entry embeddings: {e}")
+            return []
+
+    # --- Search index ---
+
+    def get_entries_to_index(self, user_id, after_id=0, limit=100, missing_only=True):
+        """
+        Retrieves encrypted entries for (re)building the search index, in id order.
+
+        Args:
+            user_id (int): The owner of the entries.
+            after_id (int): Only return entries with a larger id (keyset pagination).
+            limit (int): Maximum number of rows to return.
+            missing_only (bool): Only return entries without any indexed terms.
+
+        Returns:
+            list[tuple[int, str, bytes]]: (id, entry_date, encrypted_entry) rows.
+        """
+        if missing_only:
+            sql = """
+            SELECT id, entry_date, encrypted_entry FROM entries AS e
+            WHERE user_id = ? AND id > ? AND NOT EXISTS (
+                SELECT 1 FROM entry_terms AS t WHERE t.user_id = e.user_id AND t.entry_date = e.entry_date
+            )
+            ORDER BY id LIMIT ?
+            """
+        else:
+            sql = "SELECT id, entry_date, encrypted_entry FROM entries WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, after_id, limit))
+                return cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching entries to index: {e}")
+            return []
+
+    def update_entry_terms(self, user_id, updates):
+        """
+        Replaces the indexed terms of several entries in one transaction. An entry is
+        skipped if its blob changed since it was read, because the save that changed
+        it has already indexed the newer text.
+
+        Args:
+            user_id (int): The owner of the entries.
+            updates (list[tuple[str, bytes, Iterable[bytes]]]): (entry_date, encrypted_entry
+                                                                as read, term_hashes) triples.
+
+        Returns:
+            int | None: Number of entries updated, or None on error.
+        """
+        current_sql = "SELECT encrypted_entry FROM entries WHERE user_id = ? AND entry_date = ?"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                updated = 0
+                for entry_date, blob, term_hashes in updates:
+                    cursor.execute(current_sql, (user_id, entry_date))
+                    row = cursor.fetchone()
+                    if row is None or row[0] != blob:
+                        continue
+                    _replace_entry_terms(cursor, user_id, entry_date, term_hashes)
+                    updated += 1
+                conn.commit()
+                return updated
+        except Error as e:
+            print(f"Error updating search index: {e}")
+            return None
+
+    def get_dates_for_terms(self, user_id, term_hashes):
+        """
+        Looks up the entries containing each term. Only the index is read; no entry
+        is decrypted.
+
+        Returns:
+            dict[bytes, set[str]]: The matching entry dates for each term hash.
+        """
+        sql = "SELECT entry_date FROM entry_terms WHERE user_id = ? AND term_hash = ?"
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                matches = {}
+                for term_hash in term_hashes:
+                    cursor.execute(sql, (user_id, term_hash))
+                    matches[term_hash] = {row[0] for row in cursor.fetchall()}
+                return matches
+        except Error as e:
+            print(f"Error searching entries: {e}")
+            return {}
+
+    def prune_entry_terms(self, user_id):
+        """Deletes index rows of dates that no longer have an entry. Returns the row count."""
+        sql = """
+        DELETE FROM entry_terms WHERE user_id = ? AND entry_date NOT IN (
+            SELECT entry_date FROM entries WHERE user_id = ?
+        )
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, (user_id, user_id))
+                conn.commit()
+                return cursor.rowcount
+        except Error as e:
+            print(f"Error pruning search index: {e}")
+            return None
 
 # # --- Testing Block ---
 # # This code will only run when you execute this file directly.
@@ -1,54 +1,135 @@
-
-
 import os
+import zlib
 import base64
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from core.kdf import KDF, load_kdf
+
+try:
+    # Optional: better ratio and much faster than zlib when installed
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Worker threads used by the batch APIs. The AES and HMAC work runs in native
+# code, so a few threads help on multi-core machines without oversubscribing.
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+# Items handed to a worker at a time; amortizes the per-task executor overhead.
+BATCH_CHUNK_SIZE = 64
+
+# --- Entry envelope format ---
+# Version 1 layout:  b"MV" | version (1 byte) | flags (1 byte) | nonce (12 bytes) | AES-GCM ciphertext + tag
+# The 4-byte header is authenticated as associated data. Legacy rows are Fernet
+# tokens, which are base64 text starting with "g", so they never match the magic.
+ENVELOPE_MAGIC = b"MV"
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER_SIZE = 4
+NONCE_SIZE = 12
+FLAG_ZLIB = 0x01
+FLAG_ZSTD = 0x02
+# Entries shorter than this are stored uncompressed; the savings would not pay for the CPU.
+COMPRESSION_MIN_BYTES = 256
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+# HKDF context binding the AES-GCM key to this purpose, so it differs from the Fernet keys.
+ENTRY_KEY_INFO = b"moodvault entry envelope v1"
 
-# It is recommended to use a high number of iterations.
-# OWASP recommends at least 100,000 for PBKDF2-HMAC-SHA256.
-# We use a higher value for better security.
-PBKDF2_ITERATIONS = 390000
+# Outcome of one item in a batch operation. Exactly one of `value` and `error`
+# is set; `index` is the item's position in the input.
+CryptoResult = namedtuple("CryptoResult", ["index", "value", "error"])
 
 def generate_salt():
     """Generates a cryptographically secure random salt."""
     return os.urandom(16)
 
-def derive_key(password: str, salt: bytes) -> bytes:
+def derive_key(password: str, salt: bytes, kdf: KDF | None = None) -> bytes:
     """
-    Derives a secure encryption key from a password and salt using PBKDF2.
+    Derives a secure encryption key from a password and salt.
     The key is returned in a URL-safe base64 encoded format suitable for Fernet.
+
+    Args:
+        password (str): The user's master password.
+        salt (bytes): The user's encryption salt.
+        kdf (KDF, optional): The user's key derivation settings. Defaults to the
+                             legacy PBKDF2 parameters older accounts were created with.
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=PBKDF2_ITERATIONS,
-        backend=default_backend()
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    kdf = kdf or load_kdf(None)
+    key = base64.urlsafe_b64encode(kdf.derive(password, salt))
     return key
 
+def generate_data_key() -> bytes:
+    """
+    Generates a random data encryption key (DEK) for a new account.
+    Entries are encrypted with this key; the password only ever protects it.
+    """
+    return Fernet.generate_key()
+
+def wrap_key(wrapping_key: bytes, data_key: bytes) -> bytes:
+    """
+    Encrypts (wraps) a data key under a password-derived key, so the password
+    or its KDF settings can change without touching the data the key protects.
+    """
+    return Fernet(wrapping_key).encrypt(data_key)
+
+def unwrap_key(wrapping_key: bytes, wrapped_key: bytes) -> bytes:
+    """
+    Recovers a data key wrapped with wrap_key.
+
+    Raises:
+        InvalidToken: If the wrapping key is wrong or the wrapped key was tampered with.
+    """
+    return Fernet(wrapping_key).decrypt(wrapped_key)
+
 class EncryptionHandler:
     """
-    Handles the encryption and decryption of diary entries using a derived key.
+    Handles the encryption and decryption of diary entries using the user's data key.
     An instance of this class should be created after user login and held
     for the duration of the session.
+
+    The data key is random and stored only wrapped by the password-derived key
+    (envelope encryption), so it is unwrapped exactly once per login and a
+    password change never has to re-encrypt entries.
     """
     def __init__(self, key: bytes):
         """
-        Initializes the handler with a Fernet instance using the provided key.
+        Initializes the handler with AES-GCM and Fernet instances for the provided key.
         
         Args:
-            key (bytes): The URL-safe base64 encoded key derived from the user's password.
+            key (bytes): The URL-safe base64 encoded data key.
         """
+        # Fernet is kept to read entries written before the versioned envelope
         self.fernet = Fernet(key)
+        self._key_material = base64.urlsafe_b64decode(key)
+        self.aead = AESGCM(self.derive_subkey(ENTRY_KEY_INFO))
+
+    def derive_subkey(self, info: bytes, length: int = 32) -> bytes:
+        """
+        Derives an independent key for another purpose (e.g. keyed hashes) from the
+        data key with HKDF, so the data key itself is never reused directly.
+
+        Args:
+            info (bytes): A unique label for the purpose of the subkey.
+            length (int): Length of the subkey in bytes.
+        """
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=length,
+            salt=None,
+            info=info,
+        ).derive(self._key_material)
 
     def encrypt(self, plaintext: str) -> bytes:
         """
-        Encrypts a plaintext string.
+        Encrypts a plaintext string into a versioned envelope. Longer entries are
+        compressed first (zstd if available, else zlib), and the result is stored
+        as raw bytes rather than base64 text.
         
         Args:
             plaintext (str): The diary entry text to encrypt.
@@ -56,11 +137,71 @@ class EncryptionHandler:
         Returns:
             bytes: The encrypted data.
         """
-        return self.fernet.encrypt(plaintext.encode('utf-8'))
+        return self.encrypt_bytes(plaintext.encode('utf-8'))
+
+    def encrypt_bytes(self, data: bytes, compress: bool = True) -> bytes:
+        """
+        Encrypts binary data, e.g. a packed array, into the same envelope as `encrypt`.
+
+        Args:
+            data (bytes): The data to encrypt.
+            compress (bool): Whether to try compressing it first. Pass False for data
+                             that does not compress, such as float arrays.
+
+        Returns:
+            bytes: The encrypted data. Decrypt it with `decrypt_bytes`.
+        """
+        flags = 0
+        if compress and len(data) >= COMPRESSION_MIN_BYTES:
+            if zstandard is not None:
+                compressed, flag = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), FLAG_ZSTD
+            else:
+                compressed, flag = zlib.compress(data, ZLIB_LEVEL), FLAG_ZLIB
+            if len(compressed) < len(data):
+                data, flags = compressed, flag
+
+        header = ENVELOPE_MAGIC + bytes([ENVELOPE_VERSION, flags])
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + self.aead.encrypt(nonce, data, header)
+
+    def _open(self, encrypted_data: bytes) -> str:
+        """
+        Decrypts either envelope format to text.
+
+        Raises:
+            InvalidToken: If the key is wrong, the data was tampered with, or the
+                          envelope uses an unknown version or compression.
+        """
+        return self._open_bytes(encrypted_data).decode('utf-8')
+
+    def _open_bytes(self, encrypted_data: bytes) -> bytes:
+        """Decrypts either envelope format to the raw bytes. Raises InvalidToken like `_open`."""
+        if encrypted_data[:2] != ENVELOPE_MAGIC:
+            # Legacy row: a Fernet token of the raw UTF-8 text
+            return self.fernet.decrypt(encrypted_data)
+
+        header = encrypted_data[:ENVELOPE_HEADER_SIZE]
+        if len(encrypted_data) < ENVELOPE_HEADER_SIZE + NONCE_SIZE or header[2] != ENVELOPE_VERSION:
+            raise InvalidToken
+        flags = header[3]
+        nonce = encrypted_data[ENVELOPE_HEADER_SIZE:ENVELOPE_HEADER_SIZE + NONCE_SIZE]
+        try:
+            data = self.aead.decrypt(nonce, encrypted_data[ENVELOPE_HEADER_SIZE + NONCE_SIZE:], header)
+        except InvalidTag:
+            raise InvalidToken
+        if flags == FLAG_ZLIB:
+            data = zlib.decompress(data)
+        elif flags == FLAG_ZSTD:
+            if zstandard is None:
+                raise InvalidToken("Entry is zstd-compressed but the zstandard package is not installed.")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif flags != 0:
+            raise InvalidToken
+        return data
 
     def decrypt(self, encrypted_data: bytes) -> str | None:
         """
-        Decrypts data.
+        Decrypts data in either the current envelope or the legacy Fernet format.
         
         Args:
             encrypted_data (bytes): The data to decrypt.
@@ -70,12 +211,103 @@ class EncryptionHandler:
                  (e.g., wrong key, corrupted data).
         """
         try:
-            decrypted_bytes = self.fernet.decrypt(encrypted_data)
-            return decrypted_bytes.decode('utf-8')
+            return self._open(encrypted_data)
         except InvalidToken:
             # This error occurs if the key is incorrect or the data is tampered with.
             print("Decryption failed: Invalid token. Key may be wrong or data corrupted.")
             return None
         except Exception as e:
             print(f"An unexpected error occurred during decryption: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def decrypt_bytes(self, encrypted_data: bytes) -> bytes | None:
+        """
+        Decrypts data written by `encrypt_bytes`.
+
+        Returns:
+            bytes: The decrypted data, or None if decryption fails.
+        """
+        try:
+            return self._open_bytes(encrypted_data)
+        except InvalidToken:
+            print("Decryption failed: Invalid token. Key may be wrong or data corrupted.")
+            return None
+        except Exception as e:
+            print(f"An unexpected error occurred during decryption: {e}")
+            return None
+
+    def encrypt_many(self, plaintexts: Iterable[str], workers: int = BATCH_WORKERS,
+                     chunk_size: int = BATCH_CHUNK_SIZE) -> Iterator[CryptoResult]:
+        """
+        Encrypts many strings, streaming results in input order.
+
+        Args:
+            plaintexts (Iterable[str]): The texts to encrypt. Consumed lazily.
+            workers (int): Number of worker threads (1 runs inline).
+            chunk_size (int): Items per worker task.
+
+        Yields:
+            CryptoResult: `value` is the encrypted bytes, or `error` the exception raised.
+        """
+        return self._run_many(self._encrypt_one, plaintexts, workers, chunk_size)
+
+    def decrypt_many(self, tokens: Iterable[bytes], workers: int = BATCH_WORKERS,
+                     chunk_size: int = BATCH_CHUNK_SIZE, binary: bool = False) -> Iterator[CryptoResult]:
+        """
+        Decrypts many tokens, streaming results in input order.
+
+        Unlike `decrypt`, failures are not printed: each failing item is reported
+        with its exception (e.g. InvalidToken for a wrong key or tampered data)
+        and the rest of the batch carries on.
+
+        Args:
+            tokens (Iterable[bytes]): The encrypted entries. Consumed lazily.
+            workers (int): Number of worker threads (1 runs inline).
+            chunk_size (int): Items per worker task.
+            binary (bool): Return bytes, for data written by `encrypt_bytes`.
+
+        Yields:
+            CryptoResult: `value` is the plaintext string (bytes if `binary`), or `error`
+                          the exception raised.
+        """
+        operation = self._open_bytes if binary else self._decrypt_one
+        return self._run_many(operation, tokens, workers, chunk_size)
+
+    def _encrypt_one(self, plaintext):
+        return self.encrypt(plaintext)
+
+    def _decrypt_one(self, token):
+        return self._open(token)
+
+    def _run_many(self, operation, items, workers, chunk_size):
+        """Applies `operation` to every item across a thread pool, preserving order."""
+        def process(start, chunk):
+            results = []
+            for offset, item in enumerate(chunk):
+                try:
+                    results.append(CryptoResult(start + offset, operation(item), None))
+                except Exception as e:
+                    results.append(CryptoResult(start + offset, None, e))
+            return results
+
+        iterator = iter(items)
+        if workers <= 1:
+            for index, item in enumerate(iterator):
+                yield from process(index, [item])
+            return
+
+        # Keep a bounded number of chunks in flight so huge inputs stream
+        # through in constant memory
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            start = 0
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(process, start, chunk))
+                start += len(chunk)
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
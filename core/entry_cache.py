@@ -0,0 +1,152 @@
+import calendar
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from core.db import DatabaseHandler
+from core.encryption import EncryptionHandler
+from core.rollups import as_date
+
+# Decrypted entries kept per session. A few months around the calendar view fit
+# comfortably; the least recently used entries are dropped first.
+ENTRY_CACHE_SIZE = 200
+# Months prefetched on each side of the month the calendar is showing.
+PREFETCH_NEIGHBOUR_MONTHS = 1
+
+def _month_bounds(year, month):
+    """First and last day of a month as ISO strings."""
+    last_day = calendar.monthrange(year, month)[1]
+    return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}"
+
+def _shift_month(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+class EntryCache:
+    """
+    Session-scoped cache of decrypted entries for calendar navigation.
+
+    `prefetch` loads whole months (the visible one and its neighbours) with one
+    range query and decrypts them on a background thread. Once a month is loaded,
+    clicks on any of its days are answered from memory, including days without an
+    entry. The cache is a bounded LRU; evicting an entry also forgets that its
+    month was complete, so a later miss goes back to the database.
+
+    Writes must go through `put`. A prefetch that read a day before a newer write
+    does not overwrite it.
+    """
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler, user_id: int,
+                 max_size=ENTRY_CACHE_SIZE):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            user_id (int): The user whose entries are cached.
+            max_size (int): Maximum number of decrypted entries kept.
+        """
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.user_id = user_id
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._loaded_months = set()
+        self._loading_months = set()
+        # Bumped by every put/invalidate, so an older prefetch can tell it is stale
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="entry-prefetch")
+
+    def get(self, day):
+        """
+        Looks up a day.
+
+        Returns:
+            tuple[bool, str | None, str | None]: (found, text, mood_label). `found` is True
+                                                 for a cached entry and for a day known to
+                                                 have no entry (text None); False means ask
+                                                 the database.
+        """
+        with self._lock:
+            if day in self._entries:
+                self._entries.move_to_end(day)
+                text, mood_label = self._entries[day]
+                return True, text, mood_label
+            if (day.year, day.month) in self._loaded_months:
+                return True, None, None
+        return False, None, None
+
+    def put(self, day, text, mood_label):
+        """Stores the current text of a day, e.g. after loading or saving it."""
+        with self._lock:
+            self._versions[day] = self._versions.get(day, 0) + 1
+            self._remember(day, text, mood_label)
+
+    def invalidate(self, day):
+        """Forgets a day, so the next lookup reads it from the database."""
+        with self._lock:
+            self._versions[day] = self._versions.get(day, 0) + 1
+            self._entries.pop(day, None)
+            self._loaded_months.discard((day.year, day.month))
+
+    def prefetch(self, year, month, neighbours=PREFETCH_NEIGHBOUR_MONTHS):
+        """Loads a month and its neighbours in the background, skipping months already loaded."""
+        months = [_shift_month(year, month, delta) for delta in range(-neighbours, neighbours + 1)]
+        with self._lock:
+            months = [m for m in months if m not in self._loaded_months and m not in self._loading_months]
+            if not months:
+                return None
+            self._loading_months.update(months)
+            versions = dict(self._versions)
+        return self._executor.submit(self._load_months, months, versions)
+
+    def _load_months(self, months, versions):
+        """Runs on the prefetch thread: one range query, then a batch decrypt."""
+        try:
+            start = _month_bounds(*min(months))[0]
+            end = _month_bounds(*max(months))[1]
+            rows = self.db_handler.get_entry_blobs_between(self.user_id, start, end)
+            # Decrypt before taking the lock, so lookups from the GUI thread never wait on it
+            results = list(self.enc_handler.decrypt_many(blob for _, blob, _ in rows))
+
+            with self._lock:
+                complete = True
+                for result in results:
+                    entry_date, _, mood_label = rows[result.index]
+                    day = as_date(entry_date)
+                    if result.error is not None:
+                        # Leave it to the direct path, which reports the failure
+                        complete = False
+                        continue
+                    if self._versions.get(day, 0) == versions.get(day, 0):
+                        self._remember(day, result.value, mood_label)
+                # Only mark months complete if every entry in them made it in. A day
+                # invalidated meanwhile may have an entry this query did not see.
+                invalidated = any(
+                    version != versions.get(day, 0) and day not in self._entries
+                    for day, version in self._versions.items() if (day.year, day.month) in months
+                )
+                if complete and not invalidated and len(rows) <= self.max_size:
+                    self._loaded_months.update(months)
+        finally:
+            with self._lock:
+                self._loading_months.difference_update(months)
+
+    def _remember(self, day, text, mood_label):
+        """Inserts under the lock and evicts the least recently used entries."""
+        self._entries[day] = (text, mood_label)
+        self._entries.move_to_end(day)
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self._loaded_months.discard((evicted.year, evicted.month))
+
+    def clear(self):
+        """Drops every decrypted entry held by the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._loaded_months.clear()
+            self._versions.clear()
+
+    def close(self):
+        """Waits for a running prefetch, then wipes the cache. Call on logout."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.clear()
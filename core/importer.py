@@ -0,0 +1,125 @@
+from collections import namedtuple
+from itertools import islice
+
+from core.db import DatabaseHandler
+from core.encryption import EncryptionHandler
+from core.search import SearchIndex
+from core.sentiment import SentimentAnalyzer, pack_scores
+from core.similarity import pack_embedding
+
+# Number of entries encrypted, scored and committed together. Each chunk is one
+# transaction, so this is also the granularity at which an import can resume.
+IMPORT_CHUNK_SIZE = 200
+
+# Snapshot passed to the progress callback after every committed chunk.
+ImportProgress = namedtuple("ImportProgress", ["processed", "written", "chunks", "last_date"])
+
+class EntryImporter:
+    """
+    Bulk-loads journal history for one user.
+
+    Entries are consumed lazily from any iterable of (date, plaintext) pairs,
+    encrypted and scored a chunk at a time, and written with one executemany per
+    chunk. Every chunk commits together with a checkpoint, so an interrupted import
+    can be re-run with the same job id and picks up at the last chunk boundary.
+    """
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler,
+                 sentiment_analyzer: SentimentAnalyzer, user_id: int, search_index: SearchIndex | None = None):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            sentiment_analyzer (SentimentAnalyzer): Used to score each entry.
+            user_id (int): The user the entries belong to.
+            search_index (SearchIndex, optional): When given, imported entries are added
+                                                  to the keyword index with each chunk.
+        """
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.sentiment_analyzer = sentiment_analyzer
+        self.user_id = user_id
+        self.search_index = search_index
+
+    def add_or_update_entries(self, entries, job_id=None, chunk_size=IMPORT_CHUNK_SIZE,
+                              progress_callback=None) -> ImportProgress:
+        """
+        Imports entries, replacing any existing entry on the same date.
+
+        Args:
+            entries (Iterable[tuple[date, str]]): (date, plaintext) pairs, e.g. a generator
+                                                  reading an export file. Must yield the
+                                                  same sequence when an import is resumed.
+            job_id (str, optional): A stable name for this import. When given, progress is
+                                    checkpointed and a repeated call resumes after the last
+                                    committed chunk. The checkpoint is removed on completion.
+            chunk_size (int): Entries per transaction.
+            progress_callback (callable, optional): Called with an ImportProgress after each chunk.
+
+        Returns:
+            ImportProgress: The final progress. `processed` counts source items consumed,
+                            including any skipped because an earlier run committed them.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1.")
+
+        iterator = iter(entries)
+        processed = 0
+        if job_id is not None:
+            # Skip everything a previous run already committed
+            processed = self.db_handler.get_import_checkpoint(self.user_id, job_id)
+            for _ in islice(iterator, processed):
+                pass
+
+        written = 0
+        chunks = 0
+        last_date = None
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+
+            rows, term_hashes = self._prepare_chunk(chunk)
+            if not self.db_handler.add_or_update_entries(
+                self.user_id, rows, job_id=job_id, position=processed + len(chunk), term_hashes=term_hashes
+            ):
+                raise RuntimeError(f"Import stopped: failed to write entries after item {processed}.")
+
+            processed += len(chunk)
+            written += len(rows)
+            chunks += 1
+            last_date = chunk[-1][0]
+            if progress_callback:
+                progress_callback(ImportProgress(processed, written, chunks, last_date))
+
+        if job_id is not None:
+            self.db_handler.clear_import_checkpoint(self.user_id, job_id)
+        return ImportProgress(processed, written, chunks, last_date)
+
+    def _prepare_chunk(self, chunk):
+        """
+        Encrypts and scores a chunk, dropping empty entries. The embeddings come
+        from the same forward passes as the scores.
+
+        Returns:
+            tuple[list[tuple], dict | None]: The entry rows, and their search terms by
+                                             date if a search index is attached.
+        """
+        chunk = [(entry_date, text) for entry_date, text in chunk if text and text.strip()]
+        analyses = self._score([text for _, text in chunk])
+        rows = []
+        for (entry_date, text), analysis in zip(chunk, analyses):
+            mood, score, embedding, distribution, version = None, None, None, None, None
+            if analysis is not None:
+                mood, score, distribution = analysis.label, analysis.score, pack_scores(analysis.mean_scores)
+                version = self.sentiment_analyzer.scoring_version
+                if analysis.embedding is not None:
+                    embedding = self.enc_handler.encrypt_bytes(pack_embedding(analysis.embedding), compress=False)
+            rows.append((entry_date, self.enc_handler.encrypt(text), mood, score, embedding, distribution, version))
+        term_hashes = None
+        if self.search_index is not None:
+            term_hashes = {entry_date: self.search_index.term_hashes(text) for entry_date, text in chunk}
+        return rows, term_hashes
+
+    def _score(self, texts):
+        """Returns a ChunkedAnalysis (or None) for each text, scored in batched forward passes."""
+        return self.sentiment_analyzer.analyze_chunked_batch(texts)
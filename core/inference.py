@@ -0,0 +1,312 @@
+import os
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+# Backend used when none is requested explicitly or via the environment.
+DEFAULT_BACKEND = "pytorch"
+# Environment variable that selects the backend, e.g. MOODVAULT_INFERENCE_BACKEND=onnx
+BACKEND_ENV_VAR = "MOODVAULT_INFERENCE_BACKEND"
+# Backend that sends windows to a shared inference server (see core.inference_server).
+SERVER_BACKEND = "server"
+
+# Where exported ONNX models are kept, next to the database in the project root.
+MODEL_DIR = Path(__file__).resolve().parent.parent / "models"
+# ONNX opset used for export; 17 is supported by every onnxruntime release since 1.13.
+ONNX_OPSET = 17
+
+# A slice of one text that fits the model: character span and model-ready token ids.
+Window = namedtuple("Window", ["start", "end", "input_ids"])
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """Row-wise softmax, stable for large logits."""
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+def _mean_pool(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Averages the final hidden states over the real (unpadded) tokens of each sequence."""
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1.0)
+
+class InferenceBackend(ABC):
+    """
+    Base class for the ways the emotion model can be run on the CPU.
+
+    A backend owns a tokenizer and a forward pass that turns one tokenized batch
+    into per-label probabilities, plus a sentence embedding taken from the same
+    pass (the final hidden states, mean-pooled). `windows` and `forward_windows`
+    build on it to score texts of any length the same way on every backend, so
+    callers do not depend on which backend is active.
+    """
+    name = None
+
+    def __init__(self, model_id: str):
+        """
+        Args:
+            model_id (str): Hugging Face model id of the classifier.
+        """
+        self.model_id = model_id
+        self.tokenizer = None
+        # Label names in logit order, e.g. ['anger', 'disgust', ...]
+        self.labels = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.labels is not None
+
+    @abstractmethod
+    def load(self):
+        """Loads the tokenizer and model. Slow; may download on first use."""
+
+    @abstractmethod
+    def forward(self, encoded) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Runs the model on one tokenized batch.
+
+        Args:
+            encoded (BatchEncoding): Tokenizer output with NumPy arrays.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Probabilities of shape (batch, len(labels)) and
+                                           float32 embeddings of shape (batch, hidden size).
+        """
+
+    @property
+    def max_window_tokens(self) -> int:
+        """Text tokens per window: the model's limit minus its special tokens."""
+        return self.tokenizer.model_max_length - self.tokenizer.num_special_tokens_to_add()
+
+    def windows(self, text: str, overlap: int, window_tokens: int | None = None) -> list[Window]:
+        """
+        Tokenizes a text once and splits it into overlapping windows that each fit
+        the model, so nothing is truncated away.
+
+        Args:
+            text (str): The text to split.
+            overlap (int): Tokens shared by consecutive windows, so no sentence is
+                           only ever seen cut in half.
+            window_tokens (int, optional): Text tokens per window. Defaults to the
+                                           model's limit.
+
+        Returns:
+            list[Window]: At least one window for non-empty text, in text order.
+        """
+        window_tokens = window_tokens or self.max_window_tokens
+        if not 0 <= overlap < window_tokens:
+            raise ValueError("overlap must be at least 0 and smaller than the window.")
+
+        encoded = self.tokenizer(
+            text, add_special_tokens=False, truncation=False,
+            return_offsets_mapping=self.tokenizer.is_fast, verbose=False
+        )
+        ids = encoded["input_ids"]
+        offsets = encoded.get("offset_mapping")
+        if not ids:
+            return []
+
+        windows = []
+        step = window_tokens - overlap
+        for start in range(0, len(ids), step):
+            end = min(start + window_tokens, len(ids))
+            windows.append(Window(
+                offsets[start][0] if offsets else None,
+                offsets[end - 1][1] if offsets else None,
+                self.tokenizer.build_inputs_with_special_tokens(ids[start:end]),
+            ))
+            if end == len(ids):
+                break
+        return windows
+
+    def forward_windows(self, windows: list[list[int]], batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Scores pre-tokenized windows in batches of `batch_size`, in the given order.
+        Sort them by length first to keep padding low.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Probabilities of shape (len(windows), len(labels))
+                                           and the embedding of each window.
+        """
+        probabilities = []
+        embeddings = []
+        for start in range(0, len(windows), batch_size):
+            batch = [{"input_ids": ids} for ids in windows[start:start + batch_size]]
+            batch_probabilities, batch_embeddings = self.forward(self.tokenizer.pad(batch, return_tensors="np"))
+            probabilities.append(batch_probabilities)
+            embeddings.append(batch_embeddings)
+        if not probabilities:
+            return np.empty((0, len(self.labels))), np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(probabilities), np.concatenate(embeddings)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.model_id!r})"
+
+class TorchBackend(InferenceBackend):
+    """
+    The model in full precision with PyTorch. Computes exactly what the
+    transformers pipeline does (tokenize, forward, softmax) without its per-call
+    overhead.
+    """
+    name = "pytorch"
+
+    def __init__(self, model_id):
+        super().__init__(model_id)
+        self.model = None
+
+    def load(self):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_id)
+        model.eval()
+        self.model = self._prepare(model)
+        self.labels = [model.config.id2label[i] for i in range(model.config.num_labels)]
+
+    def _prepare(self, model):
+        """Hook for subclasses to transform the loaded model."""
+        return model
+
+    def forward(self, encoded):
+        import torch
+
+        with torch.inference_mode():
+            outputs = self.model(
+                **{name: torch.from_numpy(array) for name, array in encoded.items()}, output_hidden_states=True
+            )
+            probabilities = torch.softmax(outputs.logits, dim=-1).numpy()
+            hidden = outputs.hidden_states[-1].float().numpy()
+        return probabilities, _mean_pool(hidden, encoded["attention_mask"])
+
+class QuantizedTorchBackend(TorchBackend):
+    """
+    PyTorch with dynamic int8 quantization of the Linear layers, which hold
+    nearly all of the model's weights. Roughly a quarter of the weight memory and
+    faster matrix multiplies on CPU, at a small cost in accuracy.
+    """
+    name = "pytorch-int8"
+
+    def _prepare(self, model):
+        import torch
+
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+class OnnxBackend(InferenceBackend):
+    """
+    The model exported to ONNX and run with onnxruntime on the CPU. The export
+    happens once, on first load, and is reused from MODEL_DIR afterwards; a model
+    exported before embeddings were used, without the hidden-state output, is
+    exported again. Requires the optional onnxruntime package.
+    """
+    name = "onnx"
+
+    def __init__(self, model_id, model_dir=MODEL_DIR):
+        super().__init__(model_id)
+        self.path = Path(model_dir) / (model_id.replace("/", "--") + ".onnx")
+        self.session = None
+        self._input_names = ()
+
+    def load(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("The 'onnx' inference backend needs onnxruntime: pip install onnxruntime") from None
+        from transformers import AutoConfig, AutoTokenizer
+
+        if not self.path.exists():
+            export_onnx(self.model_id, self.path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(self.path), options, providers=["CPUExecutionProvider"])
+        if "last_hidden_state" not in {node.name for node in self.session.get_outputs()}:
+            export_onnx(self.model_id, self.path)
+            self.session = onnxruntime.InferenceSession(str(self.path), options, providers=["CPUExecutionProvider"])
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        config = AutoConfig.from_pretrained(self.model_id)
+        self.labels = [config.id2label[i] for i in range(config.num_labels)]
+
+    def forward(self, encoded):
+        feeds = {name: array.astype(np.int64) for name, array in encoded.items() if name in self._input_names}
+        logits, hidden = self.session.run(["logits", "last_hidden_state"], feeds)
+        return _softmax(logits), _mean_pool(hidden.astype(np.float32), encoded["attention_mask"])
+
+def export_onnx(model_id: str, path: Path):
+    """
+    Exports a sequence classification model to ONNX with dynamic batch and
+    sequence axes. Besides the logits, the graph outputs the final hidden states
+    for embeddings. The file is written under a temporary name and renamed, so an
+    interrupted export never leaves a truncated model behind.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    class WithHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+            return outputs.logits, outputs.hidden_states[-1]
+
+    print(f"Exporting {model_id} to ONNX (one-time)...")
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForSequenceClassification.from_pretrained(model_id)
+    model.eval()
+    sample = tokenizer(["An example entry."], return_tensors="pt")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".onnx.tmp")
+    torch.onnx.export(
+        WithHiddenState(model),
+        (sample["input_ids"], sample["attention_mask"]),
+        str(temp_path),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits", "last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=ONNX_OPSET,
+    )
+    os.replace(temp_path, path)
+    print(f"Saved ONNX model to {path}")
+
+# Available backends by name
+BACKENDS = {cls.name: cls for cls in (TorchBackend, QuantizedTorchBackend, OnnxBackend)}
+
+def create_backend(name: str | None, model_id: str) -> InferenceBackend:
+    """
+    Creates an (unloaded) backend.
+
+    Args:
+        name (str | None): One of BACKENDS, or SERVER_BACKEND. None uses
+                           $MOODVAULT_INFERENCE_BACKEND, falling back to DEFAULT_BACKEND.
+                           An unknown value in the environment is reported and
+                           DEFAULT_BACKEND used instead, so a typo cannot stop the app.
+        model_id (str): Hugging Face model id of the classifier.
+
+    Raises:
+        ValueError: If a name passed explicitly is not a known backend.
+    """
+    if name is None:
+        name = os.environ.get(BACKEND_ENV_VAR) or DEFAULT_BACKEND
+        if name != SERVER_BACKEND and name not in BACKENDS:
+            print(f"Warning: unknown inference backend '{name}' in ${BACKEND_ENV_VAR}; "
+                  f"using '{DEFAULT_BACKEND}'. Choose one of: {', '.join(BACKENDS)}, {SERVER_BACKEND}.")
+            name = DEFAULT_BACKEND
+    if name == SERVER_BACKEND:
+        # Imported here: the server module builds on this one
+        from core.inference_server import RemoteBackend
+        return RemoteBackend(model_id)
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}, {SERVER_BACKEND}."
+        )
+    return BACKENDS[name](model_id)
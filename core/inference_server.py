@@ -0,0 +1,498 @@
+"""
+Shared local inference server.
+
+One process loads the emotion model and serves every MoodVault session on the
+machine over a Unix socket, so the weights are held in memory once. Requests
+from all clients that arrive within a few milliseconds of each other are scored
+together in length-sorted batches.
+
+Start it, then run the app with the 'server' backend:
+    python -m core.inference_server [--backend pytorch-int8] [--socket PATH]
+    MOODVAULT_INFERENCE_BACKEND=server python main.py
+
+Entries are only sent to a server run by the client's own user, or by a user or
+group named in $MOODVAULT_INFERENCE_TRUSTED_USER / $MOODVAULT_INFERENCE_TRUSTED_GROUP.
+"""
+import os
+import stat
+import json
+import getpass
+import tempfile
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+
+from core.inference import BACKENDS, DEFAULT_BACKEND, InferenceBackend, SERVER_BACKEND, create_backend
+
+# Environment variable that points clients and the server at another socket.
+SOCKET_ENV_VAR = "MOODVAULT_INFERENCE_SOCKET"
+# Environment variables naming a user and a group, besides the client's own user,
+# whose server may receive entries, e.g. a dedicated service account.
+TRUSTED_USER_ENV_VAR = "MOODVAULT_INFERENCE_TRUSTED_USER"
+TRUSTED_GROUP_ENV_VAR = "MOODVAULT_INFERENCE_TRUSTED_GROUP"
+# Most windows scored in one forward pass.
+MAX_BATCH_WINDOWS = 32
+# How long the server waits for other clients' requests before running a batch
+# that is not full. Small next to the forward pass, so a lone client barely notices.
+MAX_BATCH_WAIT = 0.005
+# Seconds a client waits to connect, and for a reply once connected. Replies can
+# queue behind other clients' long entries, so the latter is generous.
+CONNECT_TIMEOUT = 2.0
+REQUEST_TIMEOUT = 120.0
+# Upper bound on one message, so a misbehaving client cannot exhaust memory.
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+_LENGTH = struct.Struct("!I")
+
+# A client request waiting for the batcher: token id windows and the Future their scores go to.
+PendingRequest = namedtuple("PendingRequest", ["windows", "future"])
+
+def default_socket_path() -> str:
+    """
+    The socket used when neither the command line nor the environment names one:
+    inside a directory private to the current user, so no one else can bind it.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        directory = os.path.join(runtime_dir, "moodvault")
+    else:
+        directory = os.path.join(tempfile.gettempdir(), f"moodvault-{getpass.getuser()}")
+    return os.path.join(directory, "inference.sock")
+
+def _prepare_socket_dir(directory):
+    """
+    Creates the socket's directory if needed (owner-only) and checks that no one
+    else can add, remove or replace files in it.
+
+    Raises:
+        PermissionError: If the directory belongs to another user or is writable by others.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f"{directory} must be owned by this user and writable by no one else.")
+
+def _remove_stale_socket(path):
+    """
+    Removes a socket left behind by a server that did not shut down cleanly.
+
+    Raises:
+        PermissionError: If the path is not a socket owned by this user.
+        OSError: If a server is still listening on it.
+    """
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if info.st_uid != os.getuid() or not stat.S_ISSOCK(info.st_mode):
+        raise PermissionError(f"{path} is not a socket owned by this user; not removing it.")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Another inference server is already listening on {path}.")
+
+def _resolve_id(value, lookup, attribute, env_var):
+    if value.isdigit():
+        return int(value)
+    try:
+        return getattr(lookup(value), attribute)
+    except KeyError:
+        raise ValueError(f"Unknown name '{value}' in ${env_var}.")
+
+def check_server_trusted(sock, path):
+    """
+    Checks who runs the server on the other end of a connected socket, before
+    anything is sent to it. Uses the kernel's peer credentials where available,
+    else the owner of the socket file.
+
+    Raises:
+        PermissionError: If the server runs as a user that is not trusted.
+        ValueError: If a trusted user or group in the environment does not exist.
+    """
+    import pwd
+    import grp
+
+    if hasattr(socket, "SO_PEERCRED"):
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, gid = struct.unpack("3i", credentials)
+    else:
+        info = os.stat(path)
+        uid, gid = info.st_uid, info.st_gid
+
+    trusted_uids = {os.getuid()}
+    trusted_gids = set()
+    if os.environ.get(TRUSTED_USER_ENV_VAR):
+        trusted_uids.add(_resolve_id(os.environ[TRUSTED_USER_ENV_VAR], pwd.getpwnam, "pw_uid", TRUSTED_USER_ENV_VAR))
+    if os.environ.get(TRUSTED_GROUP_ENV_VAR):
+        trusted_gids.add(_resolve_id(os.environ[TRUSTED_GROUP_ENV_VAR], grp.getgrnam, "gr_gid", TRUSTED_GROUP_ENV_VAR))
+    if uid not in trusted_uids and gid not in trusted_gids:
+        raise PermissionError(f"the server runs as uid {uid}, which is not trusted")
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+def send_message(sock, payload: bytes):
+    """Sends one length-prefixed message."""
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+def recv_message(sock) -> bytes | None:
+    """
+    Receives one length-prefixed message. Returns None if the peer closed the
+    connection.
+
+    Raises:
+        ValueError: If the message is larger than MAX_MESSAGE_BYTES.
+    """
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    (size,) = _LENGTH.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes exceeds the limit.")
+    return _recv_exactly(sock, size)
+
+def _send_json(sock, value):
+    send_message(sock, json.dumps(value).encode("utf-8"))
+
+def _recv_json(sock):
+    message = recv_message(sock)
+    return None if message is None else json.loads(message)
+
+class InferenceServer:
+    """
+    Owns one local backend and scores token windows for any number of clients.
+
+    Each connection is served by its own thread, which hands its windows to a
+    single batching thread and waits for the result. The batcher collects
+    requests until MAX_BATCH_WINDOWS windows are waiting or MAX_BATCH_WAIT has
+    passed, sorts all windows by length to keep padding low, runs them through
+    the model, and returns each client's rows.
+
+    Only token ids cross the socket; clients tokenize for themselves. Requests
+    are JSON and results raw float32 arrays, so nothing received is unpickled.
+    """
+    def __init__(self, socket_path=None, backend=None, model_id=None,
+                 max_batch=MAX_BATCH_WINDOWS, max_wait=MAX_BATCH_WAIT, mode=0o600):
+        """
+        Args:
+            socket_path (str, optional): Where to listen. Defaults to `default_socket_path()`.
+                                         Its directory must be writable only by this user.
+            backend (str, optional): A local backend from core.inference.BACKENDS.
+            model_id (str, optional): Model to serve. Defaults to core.sentiment.MODEL_ID.
+            max_batch (int): Most windows per forward pass.
+            max_wait (float): Seconds to wait for more requests before running a batch.
+            mode (int): Permissions of the socket file. The default admits only the
+                        owner; use e.g. 0o660, in a directory the group can enter,
+                        to share it with a group.
+        """
+        if model_id is None:
+            from core.sentiment import MODEL_ID
+            model_id = MODEL_ID
+        self.socket_path = socket_path or default_socket_path()
+        self.backend = create_backend(backend or DEFAULT_BACKEND, model_id)
+        if self.backend.name not in BACKENDS:
+            raise ValueError("The server needs a local backend.")
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.mode = mode
+        self._requests = queue.Queue()
+        self._stop_event = threading.Event()
+        self._listener = None
+
+    def serve_forever(self):
+        """
+        Loads the model, then accepts clients until `shutdown` is called.
+
+        Raises:
+            OSError: If the socket cannot be set up safely, e.g. its directory is
+                     shared or another server is running.
+        """
+        _prepare_socket_dir(os.path.dirname(os.path.abspath(self.socket_path)))
+        _remove_stale_socket(self.socket_path)
+        print(f"Loading {self.backend.model_id} ({self.backend.name})...")
+        self.backend.load()
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Bind owner-only, so no one can connect before the requested mode is set
+        umask = os.umask(0o177)
+        try:
+            self._listener.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, self.mode)
+        self._listener.listen()
+        threading.Thread(target=self._batch_loop, name="inference-batcher", daemon=True).start()
+        print(f"Serving on {self.socket_path}")
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    conn, _ = self._listener.accept()
+                except OSError:
+                    break # Listener closed by shutdown()
+                threading.Thread(target=self._serve_client, args=(conn,), name="inference-client", daemon=True).start()
+        finally:
+            self._listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self):
+        """Stops accepting clients; `serve_forever` returns."""
+        self._stop_event.set()
+        if self._listener is not None:
+            # Closing alone does not wake a thread blocked in accept() on Linux
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+
+    def _serve_client(self, conn):
+        with conn:
+            try:
+                while True:
+                    request = _recv_json(conn)
+                    if request is None:
+                        return
+                    if request.get("op") == "hello":
+                        _send_json(conn, {
+                            "model_id": self.backend.model_id,
+                            "backend": self.backend.name,
+                            "labels": self.backend.labels,
+                        })
+                    elif request.get("op") == "forward":
+                        self._forward(conn, request.get("windows"))
+                    else:
+                        _send_json(conn, {"error": f"Unknown operation {request.get('op')!r}."})
+            except (OSError, ValueError) as e:
+                print(f"Dropping client: {e}")
+
+    def _forward(self, conn, windows):
+        """Queues one client's windows for the batcher and sends back their scores."""
+        limit = self.backend.tokenizer.model_max_length
+        if not isinstance(windows, list) or not all(
+            isinstance(ids, list) and 0 < len(ids) <= limit and all(isinstance(i, int) for i in ids)
+            for ids in windows
+        ):
+            _send_json(conn, {"error": f"Expected a list of token id lists of at most {limit} tokens."})
+            return
+
+        future = Future()
+        self._requests.put(PendingRequest(windows, future))
+        try:
+            probabilities, embeddings = future.result()
+        except Exception as e:
+            _send_json(conn, {"error": str(e)})
+            return
+        _send_json(conn, {"probabilities": list(probabilities.shape), "embeddings": list(embeddings.shape)})
+        send_message(conn, probabilities.astype(np.float32).tobytes() + embeddings.astype(np.float32).tobytes())
+
+    def _batch_loop(self):
+        """Runs on the batching thread: gathers requests from all clients into shared batches."""
+        while not self._stop_event.is_set():
+            try:
+                requests = [self._requests.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            waiting = len(requests[0].windows)
+            deadline = time.monotonic() + self.max_wait
+            while waiting < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                waiting += len(request.windows)
+            self._run(requests)
+
+    def _run(self, requests):
+        """Scores the windows of several requests together and resolves each request's Future."""
+        flat = [(r, w) for r, request in enumerate(requests) for w in range(len(request.windows))]
+        order = sorted(range(len(flat)), key=lambda f: len(requests[flat[f][0]].windows[flat[f][1]]))
+        try:
+            probabilities, embeddings = self.backend.forward_windows(
+                [requests[flat[f][0]].windows[flat[f][1]] for f in order], self.max_batch
+            )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+
+        # Undo the length sort, then hand each request its own slice
+        inverse = np.empty(len(order), dtype=int)
+        inverse[order] = np.arange(len(order))
+        probabilities, embeddings = probabilities[inverse], embeddings[inverse]
+        start = 0
+        for request in requests:
+            end = start + len(request.windows)
+            request.future.set_result((probabilities[start:end], embeddings[start:end]))
+            start = end
+
+class RemoteBackend(InferenceBackend):
+    """
+    Client side of the inference server, usable wherever a backend is.
+
+    Only the tokenizer is loaded in-process; windows are scored by the server.
+    If no server is listening when the backend loads, or the connection breaks
+    later, it falls back to running the model in-process with a local backend,
+    so the app keeps working either way.
+    """
+    name = SERVER_BACKEND
+
+    def __init__(self, model_id, socket_path=None, fallback=DEFAULT_BACKEND):
+        """
+        Args:
+            model_id (str): Hugging Face model id of the classifier.
+            socket_path (str, optional): The server's socket. Defaults to
+                                         $MOODVAULT_INFERENCE_SOCKET, then `default_socket_path()`.
+            fallback (str): Local backend used when the server is unavailable.
+        """
+        super().__init__(model_id)
+        self.socket_path = socket_path or os.environ.get(SOCKET_ENV_VAR)
+        self.fallback_name = fallback
+        self.fallback = None
+        self._sock = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_remote(self) -> bool:
+        """True while windows are scored by the server."""
+        return self._sock is not None
+
+    def load(self):
+        from transformers import AutoTokenizer
+
+        try:
+            sock, labels = self._connect()
+        except (OSError, ValueError) as e:
+            print(f"Inference server at {self.socket_path} unavailable ({e}); running the model in-process.")
+            self._use_fallback()
+            return
+        # Nothing is assigned until the tokenizer is in hand too, so a failed
+        # load never leaves the backend looking loaded
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        except Exception:
+            sock.close()
+            raise
+        self.tokenizer = tokenizer
+        self._sock = sock
+        self.labels = labels
+        print(f"Using the inference server at {self.socket_path}.")
+
+    def _connect(self):
+        """Connects and handshakes with the server. Returns the socket and the server's labels."""
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("Unix sockets are not supported on this platform")
+        self.socket_path = self.socket_path or default_socket_path()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(self.socket_path)
+            # Whoever listens here receives the entries; make sure it is not another user
+            check_server_trusted(sock, self.socket_path)
+            _send_json(sock, {"op": "hello"})
+            reply = _recv_json(sock)
+            if reply is None:
+                raise OSError("connection closed")
+            if reply.get("model_id") != self.model_id:
+                raise ValueError(f"server runs {reply.get('model_id')}, not {self.model_id}")
+            sock.settimeout(REQUEST_TIMEOUT)
+        except Exception:
+            sock.close()
+            raise
+        return sock, reply["labels"]
+
+    def _use_fallback(self):
+        """Switches to in-process inference, loading the local backend if needed."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self.fallback is None:
+            backend = create_backend(self.fallback_name, self.model_id)
+            backend.load()
+            self.fallback = backend
+        self.tokenizer = self.fallback.tokenizer
+        self.labels = self.fallback.labels
+
+    def forward(self, encoded):
+        # Strip the padding; the server pads each of its batches itself
+        windows = [
+            ids[mask.astype(bool)].tolist() for ids, mask in zip(encoded["input_ids"], encoded["attention_mask"])
+        ]
+        return self.forward_windows(windows, len(windows))
+
+    def forward_windows(self, windows, batch_size):
+        """Scores windows on the server, which picks its own batch sizes; locally if it is gone."""
+        if not windows:
+            return np.empty((0, len(self.labels))), np.empty((0, 0), dtype=np.float32)
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    return self._request(windows)
+                except (OSError, ValueError) as e:
+                    print(f"Lost the inference server ({e}); running the model in-process.")
+                    self._use_fallback()
+        return self.fallback.forward_windows(windows, batch_size)
+
+    def _request(self, windows):
+        _send_json(self._sock, {"op": "forward", "windows": [list(map(int, ids)) for ids in windows]})
+        header = _recv_json(self._sock)
+        if header is None:
+            raise OSError("connection closed")
+        if "error" in header:
+            raise ValueError(header["error"])
+        body = recv_message(self._sock)
+        if body is None:
+            raise OSError("connection closed")
+
+        probabilities_shape, embeddings_shape = header["probabilities"], header["embeddings"]
+        split = int(np.prod(probabilities_shape)) * 4
+        probabilities = np.frombuffer(body[:split], dtype=np.float32).reshape(probabilities_shape)
+        embeddings = np.frombuffer(body[split:], dtype=np.float32).reshape(embeddings_shape)
+        return probabilities, embeddings
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.environ.get(SOCKET_ENV_VAR), help="default: a private per-user directory")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND, help="local backend to serve")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_WINDOWS, help="most windows per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_BATCH_WAIT * 1000,
+                        help="how long to wait for other clients before running a batch")
+    parser.add_argument("--mode", type=lambda value: int(value, 8), default=0o600,
+                        help="octal permissions of the socket, e.g. 660 to share it with a group")
+    args = parser.parse_args()
+
+    server = InferenceServer(args.socket, args.backend, max_batch=args.max_batch,
+                             max_wait=args.max_wait_ms / 1000, mode=args.mode)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    except OSError as e:
+        raise SystemExit(str(e))
+
+if __name__ == "__main__":
+    main()
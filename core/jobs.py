@@ -0,0 +1,47 @@
+import threading
+from abc import ABC, abstractmethod
+
+class BackgroundBatchJob(ABC):
+    """
+    Base class for jobs that work through a user's entries a small batch at a
+    time on a background thread, such as re-scoring, format conversion and
+    search indexing.
+
+    Subclasses implement `run`, check `_stop_event` before each batch and sleep
+    between batches with `_stop_event.wait(self.pause)`, so `stop` returns once
+    the batch in progress is written. Every job writes whole batches and finds
+    its remaining work from the database, so stopping is safe at any point and
+    the next run picks up the rows that are left.
+    """
+    # Name of the background thread, for debuggers and logs.
+    thread_name = "background-batch-job"
+
+    def __init__(self, batch_size, pause):
+        """
+        Args:
+            batch_size (int): Entries per transaction.
+            pause (float): Seconds to sleep between batches.
+        """
+        self.batch_size = batch_size
+        self.pause = pause
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Starts the job in the background, unless it is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops after the batch in progress and waits for the thread to exit."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @abstractmethod
+    def run(self):
+        """Does the work until it is finished or stopped. Runs on the background thread."""
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.backends import default_backend
+
+try:
+    # Argon2id ships with cryptography >= 44 but may be missing on some OpenSSL builds
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:
+    Argon2id = None
+
+# Length in bytes of every derived key.
+KEY_LENGTH = 32
+
+# How long unlocking the vault should take on this machine. Calibration picks
+# the highest cost that stays near this target (never below the floors below).
+TARGET_UNLOCK_SECONDS = 0.5
+
+# Minimum acceptable parameters per algorithm (OWASP password storage guidance).
+# Stored parameters below these are upgraded on the next login.
+MIN_PBKDF2_ITERATIONS = 600000
+MIN_SCRYPT_N = 2 ** 17
+MIN_ARGON2_ITERATIONS = 2
+ARGON2_MEMORY_KIB = 64 * 1024
+ARGON2_LANES = 4
+
+# The parameters every account used before KDF settings were stored per user.
+# OWASP recommended at least 100,000 iterations for PBKDF2-HMAC-SHA256 at the time.
+LEGACY_PBKDF2_ITERATIONS = 390000
+
+class KDF(ABC):
+    """
+    Base class for password-based key derivation functions.
+
+    Subclasses hold their cost parameters and know how to derive a key, describe
+    themselves as a JSON record for the users table, and scale their cost.
+    """
+    name = None
+
+    @abstractmethod
+    def derive(self, password: str, salt: bytes) -> bytes:
+        """Derives KEY_LENGTH raw key bytes from a password and salt."""
+
+    @property
+    @abstractmethod
+    def params(self) -> dict:
+        """The cost parameters, as stored in the user's KDF record."""
+
+    @abstractmethod
+    def meets_minimum(self) -> bool:
+        """Whether the parameters are at least the configured floor."""
+
+    @abstractmethod
+    def scaled(self, factor: float) -> "KDF":
+        """Returns a copy whose cost is multiplied by roughly `factor` (never below the floor)."""
+
+    @classmethod
+    @abstractmethod
+    def probe(cls) -> "KDF":
+        """A cheap instance used to time this machine during calibration."""
+
+    def to_record(self) -> str:
+        """Serializes the algorithm and parameters for storage."""
+        return json.dumps({"algorithm": self.name, **self.params}, sort_keys=True)
+
+    def __eq__(self, other):
+        return isinstance(other, KDF) and self.name == other.name and self.params == other.params
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.params})"
+
+class PBKDF2KDF(KDF):
+    """PBKDF2-HMAC-SHA256. Always available; the legacy scheme."""
+    name = "pbkdf2-sha256"
+
+    def __init__(self, iterations=MIN_PBKDF2_ITERATIONS):
+        self.iterations = int(iterations)
+
+    def derive(self, password, salt):
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=KEY_LENGTH,
+            salt=salt,
+            iterations=self.iterations,
+            backend=default_backend()
+        )
+        return kdf.derive(password.encode())
+
+    @property
+    def params(self):
+        return {"iterations": self.iterations}
+
+    def meets_minimum(self):
+        return self.iterations >= MIN_PBKDF2_ITERATIONS
+
+    def scaled(self, factor):
+        return PBKDF2KDF(max(MIN_PBKDF2_ITERATIONS, int(self.iterations * factor)))
+
+    @classmethod
+    def probe(cls):
+        return cls(20000)
+
+class ScryptKDF(KDF):
+    """scrypt: memory-hard, available in every supported cryptography release."""
+    name = "scrypt"
+
+    def __init__(self, n=MIN_SCRYPT_N, r=8, p=1):
+        self.n = int(n)
+        self.r = int(r)
+        self.p = int(p)
+
+    def derive(self, password, salt):
+        kdf = Scrypt(salt=salt, length=KEY_LENGTH, n=self.n, r=self.r, p=self.p, backend=default_backend())
+        return kdf.derive(password.encode())
+
+    @property
+    def params(self):
+        return {"n": self.n, "r": self.r, "p": self.p}
+
+    def meets_minimum(self):
+        return self.n >= MIN_SCRYPT_N
+
+    def scaled(self, factor):
+        # n must stay a power of two, so round the scaled cost down to one
+        n = self.n
+        while n * 2 <= self.n * factor:
+            n *= 2
+        return ScryptKDF(max(MIN_SCRYPT_N, n), self.r, self.p)
+
+    @classmethod
+    def probe(cls):
+        return cls(2 ** 14)
+
+class Argon2idKDF(KDF):
+    """Argon2id: the preferred memory-hard KDF when the backend provides it."""
+    name = "argon2id"
+
+    def __init__(self, iterations=MIN_ARGON2_ITERATIONS, memory_cost=ARGON2_MEMORY_KIB, lanes=ARGON2_LANES):
+        self.iterations = int(iterations)
+        self.memory_cost = int(memory_cost)
+        self.lanes = int(lanes)
+
+    def derive(self, password, salt):
+        kdf = Argon2id(
+            salt=salt,
+            length=KEY_LENGTH,
+            iterations=self.iterations,
+            lanes=self.lanes,
+            memory_cost=self.memory_cost,
+        )
+        return kdf.derive(password.encode())
+
+    @property
+    def params(self):
+        return {"iterations": self.iterations, "memory_cost": self.memory_cost, "lanes": self.lanes}
+
+    def meets_minimum(self):
+        return self.iterations >= MIN_ARGON2_ITERATIONS and self.memory_cost >= ARGON2_MEMORY_KIB
+
+    def scaled(self, factor):
+        # Memory stays fixed; time cost scales linearly with iterations
+        iterations = max(MIN_ARGON2_ITERATIONS, int(self.iterations * factor))
+        return Argon2idKDF(iterations, self.memory_cost, self.lanes)
+
+    @classmethod
+    def probe(cls):
+        return cls(1)
+
+# Registered algorithms, most preferred first.
+KDF_CLASSES = [cls for cls in (Argon2idKDF, ScryptKDF, PBKDF2KDF) if cls is not Argon2idKDF or Argon2id is not None]
+KDF_BY_NAME = {cls.name: cls for cls in KDF_CLASSES}
+
+def preferred_kdf_class():
+    """Returns the strongest KDF available in this environment."""
+    return KDF_CLASSES[0]
+
+def load_kdf(record: str | None) -> KDF:
+    """
+    Rebuilds a KDF from its stored JSON record.
+
+    Args:
+        record (str | None): The user's kdf_params value. None means the account
+                             predates per-user settings and uses the legacy PBKDF2 cost.
+
+    Raises:
+        ValueError: If the record names an algorithm this build cannot run.
+    """
+    if record is None:
+        return PBKDF2KDF(LEGACY_PBKDF2_ITERATIONS)
+    params = json.loads(record)
+    name = params.pop("algorithm")
+    if name not in KDF_BY_NAME:
+        raise ValueError(f"Unsupported key derivation algorithm '{name}'.")
+    return KDF_BY_NAME[name](**params)
+
+def needs_upgrade(kdf: KDF) -> bool:
+    """Whether a stored KDF is weaker than what a new account would get."""
+    return kdf.name != preferred_kdf_class().name or not kdf.meets_minimum()
+
+_calibration_cache = {}
+
+def calibrate(kdf_class=None, target_seconds=TARGET_UNLOCK_SECONDS) -> KDF:
+    """
+    Picks a cost for `kdf_class` that takes about `target_seconds` on this machine.
+
+    A cheap probe derivation is timed and its cost scaled linearly to the target.
+    The result never falls below the algorithm's minimum and is cached per process.
+    """
+    kdf_class = kdf_class or preferred_kdf_class()
+    key = (kdf_class.name, target_seconds)
+    if key not in _calibration_cache:
+        probe = kdf_class.probe()
+        salt = os.urandom(16)
+        probe.derive("calibration", salt) # Warm-up, so one-time setup is not measured
+        start = time.perf_counter()
+        probe.derive("calibration", salt)
+        elapsed = max(time.perf_counter() - start, 1e-4)
+        _calibration_cache[key] = probe.scaled(target_seconds / elapsed)
+    return _calibration_cache[key]
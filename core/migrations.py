@@ -0,0 +1,400 @@
+import datetime
+import threading
+from collections import namedtuple
+from sqlite3 import Error
+
+from core.rollups import recompute_rollups, recompute_emotion_rollups, period_bounds
+
+# Pause between backfill chunks. Each chunk is its own short write transaction,
+# and the pause lets UI saves get the write lock in between.
+BACKFILL_PAUSE = 0.05
+# Months of one user's history recomputed per rollup backfill chunk.
+ROLLUP_BACKFILL_MONTHS = 6
+# Failed runs after which a backfill is given up on. A failing backfill is
+# retried once per app start, never once per query.
+BACKFILL_MAX_FAILURES = 3
+
+# A schema change. `apply` receives a cursor inside the migration's transaction.
+Migration = namedtuple("Migration", ["version", "description", "apply"])
+
+# --- Schema migrations ---
+# Each migration runs in its own transaction together with the bump of
+# PRAGMA user_version, so a database is never left between two versions.
+# Append new migrations at the end; never edit or reorder released ones.
+
+def _create_baseline_schema(cursor):
+    """Version 1: the original users and entries tables."""
+    # User table with SQLite-compatible syntax
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        encryption_salt BLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+    # Entries table with SQLite-compatible syntax
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        entry_date DATE NOT NULL,
+        encrypted_entry BLOB NOT NULL,
+        sentiment_label TEXT,
+        sentiment_score REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, entry_date),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
+
+def _add_range_index_and_import_checkpoints(cursor):
+    """Version 2: covering index for date-range queries and bulk-import resume points."""
+    # Covering index for date-range metadata queries: calendar months and stats
+    # windows are answered from the index alone, without touching the entry blobs.
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_entries_user_date_mood
+    ON entries (user_id, entry_date, sentiment_label, sentiment_score);
+    """)
+
+    # Resume points for bulk imports, written in the same transaction as each chunk
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        user_id INTEGER NOT NULL,
+        job_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, job_id),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    );
+    """)
+
+def _add_mood_rollups(cursor):
+    """Version 3: per-period mood aggregates, filled in by a background backfill."""
+    # Per-period mood aggregates, one row per (period, label). Kept current by every
+    # write so statistics read O(periods) rows instead of scanning all entries.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS mood_rollups (
+        user_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start DATE NOT NULL,
+        sentiment_label TEXT NOT NULL,
+        entry_count INTEGER NOT NULL,
+        score_sum REAL NOT NULL,
+        score_min REAL,
+        score_max REAL,
+        PRIMARY KEY (user_id, period, period_start, sentiment_label),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+    schedule_backfill(cursor, "mood_rollups")
+
+def _add_user_key_material(cursor):
+    """Version 4: per-user KDF settings and a wrapped data key."""
+    # NULL kdf_params means the legacy PBKDF2 cost; NULL wrapped_key means the
+    # password-derived key is used to encrypt entries directly.
+    _add_column(cursor, "users", "kdf_params", "TEXT")
+    _add_column(cursor, "users", "wrapped_key", "BLOB")
+
+def _add_sentiment_cache(cursor):
+    """Version 5: persistent, encrypted cache of sentiment results."""
+    # key_hash is an HMAC of the text hash under a per-user key, and the result
+    # is encrypted, so neither the text nor its mood can be read from this table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sentiment_cache (
+        user_id INTEGER NOT NULL,
+        key_hash BLOB NOT NULL,
+        encrypted_result BLOB NOT NULL,
+        last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, key_hash),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+
+def _add_search_index(cursor):
+    """Version 6: blind keyword index over entry text."""
+    # term_hash is a truncated HMAC of a word (or word prefix) under a per-user
+    # key, so the table reveals which entries share a term but not the term itself
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS entry_terms (
+        user_id INTEGER NOT NULL,
+        term_hash BLOB NOT NULL,
+        entry_date DATE NOT NULL,
+        PRIMARY KEY (user_id, term_hash, entry_date),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+    # Replacing the terms of one entry looks them up by date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_entry_terms_user_date ON entry_terms (user_id, entry_date);")
+
+def _add_entry_embeddings(cursor):
+    """Version 7: encrypted sentence embedding per entry, for similarity search."""
+    # NULL for entries saved before embeddings existed or without the mood model
+    _add_column(cursor, "entries", "encrypted_embedding", "BLOB")
+
+def _add_sentiment_scores(cursor):
+    """Version 8: the full emotion distribution of each entry."""
+    # Packed float16 probabilities in core.sentiment.SCORE_LABELS order; NULL for
+    # entries scored before the distribution was kept
+    _add_column(cursor, "entries", "sentiment_scores", "BLOB")
+
+def _add_model_version(cursor):
+    """Version 9: which model and scoring scheme produced each entry's mood."""
+    # NULL for entries scored before versions were recorded; they count as stale
+    _add_column(cursor, "entries", "model_version", "TEXT")
+
+def _add_emotion_rollups(cursor):
+    """Version 10: per-period sums of the stored emotion distributions."""
+    # One row per (period, emotion), kept current by every write like mood_rollups,
+    # so the emotion chart reads O(periods) rows instead of every entry's scores
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS emotion_rollups (
+        user_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start DATE NOT NULL,
+        emotion TEXT NOT NULL,
+        entry_count INTEGER NOT NULL,
+        score_sum REAL NOT NULL,
+        PRIMARY KEY (user_id, period, period_start, emotion),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """)
+    schedule_backfill(cursor, "emotion_rollups")
+
+def _add_backfill_failures(cursor):
+    """Version 11: counts failed runs of each backfill."""
+    # Reset to 0 whenever a backfill is (re)scheduled
+    _add_column(cursor, "migration_backfills", "failures", "INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    Migration(1, "baseline users and entries tables", _create_baseline_schema),
+    Migration(2, "entry range index and import checkpoints", _add_range_index_and_import_checkpoints),
+    Migration(3, "mood rollup tables", _add_mood_rollups),
+    Migration(4, "per-user KDF parameters and wrapped data key", _add_user_key_material),
+    Migration(5, "encrypted sentiment result cache", _add_sentiment_cache),
+    Migration(6, "blind keyword search index", _add_search_index),
+    Migration(7, "encrypted entry embeddings", _add_entry_embeddings),
+    Migration(8, "per-entry emotion distribution", _add_sentiment_scores),
+    Migration(9, "per-entry model version", _add_model_version),
+    Migration(10, "emotion rollup table", _add_emotion_rollups),
+    Migration(11, "backfill failure counts", _add_backfill_failures),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def _add_column(cursor, table, column, declaration):
+    """ALTER TABLE ... ADD COLUMN, skipped if the column already exists."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _create_backfill_table(cursor):
+    """Creates the bookkeeping table for resumable backfills."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS migration_backfills (
+        name TEXT PRIMARY KEY,
+        position TEXT,
+        done INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+def schedule_backfill(cursor, name):
+    """
+    Queues a registered backfill to run (again) from the beginning. Call it from a
+    migration so the backfill is scheduled atomically with the schema change.
+    """
+    if name not in BACKFILLS:
+        raise ValueError(f"Unknown backfill '{name}'.")
+    cursor.execute("""
+    INSERT OR REPLACE INTO migration_backfills (name, position, done, updated_at)
+    VALUES (?, NULL, 0, CURRENT_TIMESTAMP)
+    """, (name,))
+
+def get_schema_version(conn):
+    """Returns the schema version recorded in PRAGMA user_version."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """
+    Brings the database schema up to LATEST_VERSION.
+
+    Args:
+        conn (sqlite3.Connection): An open connection with no transaction in progress.
+
+    Returns:
+        list[int]: The versions that were applied, in order.
+
+    Raises:
+        sqlite3.Error: If a migration fails. That migration is rolled back and the
+                       database stays at the last successfully applied version.
+    """
+    current = get_schema_version(conn)
+    if current > LATEST_VERSION:
+        print(f"Database schema version {current} is newer than this app supports ({LATEST_VERSION}).")
+        return []
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            _create_backfill_table(cursor)
+            migration.apply(cursor)
+            # PRAGMA values cannot be bound; the version is always one of our own ints
+            cursor.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        print(f"Applied database migration {migration.version}: {migration.description}")
+        applied.append(migration.version)
+    return applied
+
+# --- Backfills ---
+# A backfill processes one chunk per call: it receives the position it stopped at
+# (None on the first call) and returns the next position, or None once finished.
+# Chunks must be idempotent, because a chunk interrupted before its commit is re-run.
+
+def _backfill_by_months(cursor, position, recompute):
+    """Calls `recompute` for a few months of one user's history at a time."""
+    user_id, after = position.split(",") if position else (0, "")
+    cursor.execute("""
+    SELECT user_id, entry_date FROM entries
+    WHERE (user_id, entry_date) > (?, ?)
+    ORDER BY user_id, entry_date LIMIT 1
+    """, (int(user_id), after))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    user_id, first_date = row
+    start = period_bounds("month", first_date)[0]
+    last_month = start.year * 12 + start.month - 1 + ROLLUP_BACKFILL_MONTHS - 1
+    end = period_bounds("month", datetime.date(last_month // 12, last_month % 12 + 1, 1))[1]
+    recompute(cursor, user_id, start, end)
+    return f"{user_id},{end.isoformat()}"
+
+def _backfill_mood_rollups(cursor, position):
+    """Recomputes rollups a few months of one user's history at a time."""
+    return _backfill_by_months(cursor, position, recompute_rollups)
+
+def _backfill_emotion_rollups(cursor, position):
+    """Sums the emotion distributions of entries saved before the emotion rollups existed."""
+    return _backfill_by_months(cursor, position, recompute_emotion_rollups)
+
+BACKFILLS = {
+    "mood_rollups": _backfill_mood_rollups,
+    "emotion_rollups": _backfill_emotion_rollups,
+}
+
+class BackfillRunner:
+    """
+    Runs pending backfills on a background thread, one short transaction per chunk.
+
+    Progress is committed with each chunk, so a backfill interrupted by logout or
+    exit continues where it stopped the next time the runner starts. A backfill
+    that raises is rolled back to its last chunk, counted as failed and skipped
+    until the next app start; after BACKFILL_MAX_FAILURES it is given up on.
+    """
+    def __init__(self, pool, pause=BACKFILL_PAUSE):
+        """
+        Args:
+            pool (ConnectionPool): The pool to borrow connections from.
+            pause (float): Seconds to sleep between chunks.
+        """
+        self.pool = pool
+        self.pause = pause
+        self.finished = False
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def ensure_started(self):
+        """Starts the background thread unless it is running or has already had its run."""
+        if self.finished or self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="migration-backfill", daemon=True)
+            self._thread.start()
+
+    def _pending(self):
+        """Returns the (name, position, failures) of every backfill still to run."""
+        with self.pool.connection() as conn:
+            return conn.execute("""
+            SELECT name, position, failures FROM migration_backfills
+            WHERE done = 0 AND failures < ? ORDER BY name
+            """, (BACKFILL_MAX_FAILURES,)).fetchall()
+
+    def _record_failure(self, name):
+        """Counts a failed run of a backfill."""
+        with self.pool.connection() as conn:
+            conn.execute("""
+            UPDATE migration_backfills SET failures = failures + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE name = ?
+            """, (name,))
+            conn.commit()
+
+    def run_chunk(self, name, position):
+        """Runs and commits a single chunk of a backfill. Returns the new position."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            position = BACKFILLS[name](cursor, position)
+            cursor.execute("""
+            UPDATE migration_backfills SET position = ?, done = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE name = ?
+            """, (position, int(position is None), name))
+            conn.commit()
+            return position
+
+    def _run(self):
+        try:
+            pending = self._pending()
+        except Error as e:
+            print(f"Error reading pending backfills: {e}")
+            # Not retried on every query; the next app start tries again
+            self.finished = True
+            return
+
+        for name, position, failures in pending:
+            if name not in BACKFILLS:
+                print(f"Skipping unknown backfill '{name}'.")
+                continue
+            try:
+                while not self._stop_event.is_set():
+                    position = self.run_chunk(name, position)
+                    if position is None:
+                        print(f"Backfill '{name}' complete.")
+                        break
+                    self._stop_event.wait(self.pause)
+            except Exception as e:
+                print(f"Backfill '{name}' failed (attempt {failures + 1} of {BACKFILL_MAX_FAILURES}): {e}")
+                try:
+                    self._record_failure(name)
+                except Error as record_error:
+                    print(f"Error recording the backfill failure: {record_error}")
+                continue
+            if self._stop_event.is_set():
+                return
+        self.finished = True
+
+    def stop(self):
+        """Stops after the chunk in progress; the remaining work resumes on the next start."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join()
@@ -0,0 +1,68 @@
+from core.db import DatabaseHandler
+from core.encryption import (
+    EncryptionHandler, ENVELOPE_MAGIC, ENVELOPE_VERSION
+)
+from core.jobs import BackgroundBatchJob
+
+# Entries converted per transaction.
+CONVERT_BATCH_SIZE = 50
+# Pause between batches so the job never competes with the user for long.
+CONVERT_PAUSE = 0.2
+
+class EntryFormatConverter(BackgroundBatchJob):
+    """
+    Rewrites a user's legacy Fernet entries into the current encryption envelope.
+
+    Rows are read in id order, converted with the batch crypto APIs and written back
+    one transaction per batch. A row is only replaced if it is unchanged since it
+    was read, so the user's own saves always win.
+    """
+    thread_name = "entry-format-converter"
+
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler, user_id: int,
+                 batch_size=CONVERT_BATCH_SIZE, pause=CONVERT_PAUSE):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            user_id (int): The user whose entries are converted.
+            batch_size (int): Entries per transaction.
+            pause (float): Seconds to sleep between batches.
+        """
+        super().__init__(batch_size, pause)
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.user_id = user_id
+        self.converted = 0
+        self.failed = 0
+
+    def run(self):
+        """Converts every remaining legacy entry, or until stopped."""
+        prefix = ENVELOPE_MAGIC + bytes([ENVELOPE_VERSION])
+        after_id = 0
+        while not self._stop_event.is_set():
+            rows = self.db_handler.get_entries_not_in_format(
+                self.user_id, prefix, after_id=after_id, limit=self.batch_size
+            )
+            if not rows:
+                break
+            after_id = rows[-1][0]
+
+            replacements = []
+            for result in self.enc_handler.decrypt_many(blob for _, blob in rows):
+                entry_id, old_blob = rows[result.index]
+                if result.error is not None:
+                    # Leave undecryptable rows untouched rather than lose them
+                    self.failed += 1
+                    continue
+                replacements.append((entry_id, old_blob, self.enc_handler.encrypt(result.value)))
+
+            if replacements:
+                updated = self.db_handler.replace_entry_blobs(replacements)
+                if updated is None:
+                    break
+                self.converted += updated
+            self._stop_event.wait(self.pause)
+
+        if self.converted or self.failed:
+            print(f"Converted {self.converted} entries to the current format ({self.failed} could not be read).")
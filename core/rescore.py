@@ -0,0 +1,118 @@
+from collections import namedtuple
+
+from core.db import DatabaseHandler
+from core.encryption import EncryptionHandler
+from core.jobs import BackgroundBatchJob
+from core.rollups import as_date
+from core.sentiment import SentimentAnalyzer, pack_scores
+from core.similarity import pack_embedding
+
+# Entries scored and written per transaction. Small, so the analyzer is never
+# held for long and a save from the user waits at most one batch.
+RESCORE_BATCH_SIZE = 8
+# Pause between batches, so re-scoring uses only part of the CPU.
+RESCORE_PAUSE = 0.5
+# How long to back off while the user has analyses or saves running.
+RESCORE_YIELD_PAUSE = 1.0
+
+# Snapshot passed to the progress callback after every batch. `dates` are the
+# days of the batch just processed, empty in the final report.
+RescoreProgress = namedtuple("RescoreProgress", ["done", "total", "finished", "dates"])
+
+class EntryRescorer(BackgroundBatchJob):
+    """
+    Re-scores a user's entries whose stored mood was produced by another model or
+    scoring scheme than the analyzer's current `scoring_version`.
+
+    Stale rows are found by their model_version column, decrypted and scored, and
+    written back with their rollups in one transaction per batch. A row the user
+    saved in the meantime is left alone. Nothing needs to be checkpointed: a
+    written row is no longer stale.
+    """
+    thread_name = "entry-rescorer"
+
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler,
+                 sentiment_analyzer: SentimentAnalyzer, user_id: int, batch_size=RESCORE_BATCH_SIZE,
+                 pause=RESCORE_PAUSE, should_yield=None, progress_callback=None):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            sentiment_analyzer (SentimentAnalyzer): A loaded analyzer.
+            user_id (int): The user whose entries are re-scored.
+            batch_size (int): Entries per transaction.
+            pause (float): Seconds to sleep between batches.
+            should_yield (callable, optional): Returns True while foreground work is running;
+                                               the job waits until it returns False.
+            progress_callback (callable, optional): Called with a RescoreProgress from the
+                                                    background thread.
+        """
+        super().__init__(batch_size, pause)
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.sentiment_analyzer = sentiment_analyzer
+        self.user_id = user_id
+        self.should_yield = should_yield
+        self.progress_callback = progress_callback
+        self.rescored = 0
+        self.failed = 0
+
+    def run(self):
+        """Re-scores every stale entry, or until stopped."""
+        version = self.sentiment_analyzer.scoring_version
+        total = self.db_handler.count_stale_entries(self.user_id, version)
+        if not total:
+            return
+        print(f"Re-scoring {total} entries with {version}...")
+        done = 0
+        after_id = 0
+        while not self._stop_event.is_set():
+            if self.should_yield is not None and self.should_yield():
+                self._stop_event.wait(RESCORE_YIELD_PAUSE)
+                continue
+
+            rows = self.db_handler.get_stale_entries(self.user_id, version, after_id=after_id, limit=self.batch_size)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+
+            updated = self._rescore_batch(rows, version)
+            if updated is None:
+                break
+            self.rescored += updated
+            done += len(rows)
+            self._report(done, total, False, tuple(as_date(entry_date) for _, entry_date, _ in rows))
+            self._stop_event.wait(self.pause)
+
+        finished = not self._stop_event.is_set()
+        self._report(done, total, finished, ())
+        if finished:
+            print(f"Re-scored {self.rescored} entries ({self.failed} could not be read or scored).")
+
+    def _rescore_batch(self, rows, version):
+        """Decrypts, scores and writes one batch. Returns the number of rows written, or None on error."""
+        texts = []
+        for result in self.enc_handler.decrypt_many(blob for _, _, blob in rows):
+            texts.append(result.value if result.error is None else "")
+
+        updates = []
+        analyses = self.sentiment_analyzer.analyze_chunked_batch(texts)
+        for (_, entry_date, blob), analysis in zip(rows, analyses):
+            if analysis is None:
+                # Unreadable, empty or failed; left stale rather than overwritten
+                self.failed += 1
+                continue
+            embedding = None
+            if analysis.embedding is not None:
+                embedding = self.enc_handler.encrypt_bytes(pack_embedding(analysis.embedding), compress=False)
+            updates.append((
+                entry_date, blob, analysis.label, analysis.score, embedding,
+                pack_scores(analysis.mean_scores), version,
+            ))
+        if not updates:
+            return 0
+        return self.db_handler.update_entry_scores(self.user_id, updates)
+
+    def _report(self, done, total, finished, dates):
+        if self.progress_callback:
+            self.progress_callback(RescoreProgress(done, total, finished, dates))
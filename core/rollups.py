@@ -0,0 +1,227 @@
+import calendar
+import datetime
+
+import numpy as np
+
+from core.sentiment import SCORE_LABELS, unpack_scores
+
+# SQL expressions mapping entries.entry_date to the first day of each rollup period.
+# Weeks start on Monday, matching period_bounds() below.
+ROLLUP_PERIODS = {
+    "day": "entry_date",
+    "week": "date(entry_date, '-' || ((CAST(strftime('%w', entry_date) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "strftime('%Y-%m-01', entry_date)",
+}
+
+def as_date(value):
+    """Accepts a date or an ISO 'YYYY-MM-DD' string and returns a date."""
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def period_bounds(period, day):
+    """
+    Returns the first and last day of the rollup period containing a date.
+
+    Args:
+        period (str): One of ROLLUP_PERIODS ('day', 'week' or 'month').
+        day (date | str): Any date inside the period.
+
+    Returns:
+        tuple[date, date]: The inclusive (start, end) of the period.
+    """
+    day = as_date(day)
+    if period == "day":
+        return day, day
+    if period == "week":
+        start = day - datetime.timedelta(days=day.weekday())
+        return start, start + datetime.timedelta(days=6)
+    if period == "month":
+        last_day = calendar.monthrange(day.year, day.month)[1]
+        return day.replace(day=1), day.replace(day=last_day)
+    raise ValueError(f"Unknown rollup period '{period}'.")
+
+def _emotion_values(scores):
+    """Pairs each emotion with its share in a packed distribution."""
+    return zip(SCORE_LABELS, unpack_scores(scores).astype(np.float64).tolist())
+
+def rollup_add(cursor, user_id, date, label, score, scores=None):
+    """
+    Counts one scored entry into the day, week and month rollups, and its packed
+    emotion distribution (see core.sentiment.pack_scores), if any, into the
+    emotion rollups.
+    """
+    if label is None or score is None:
+        return
+    sql = """
+    INSERT INTO mood_rollups (user_id, period, period_start, sentiment_label, entry_count, score_sum, score_min, score_max)
+    VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+    ON CONFLICT (user_id, period, period_start, sentiment_label) DO UPDATE SET
+        entry_count = entry_count + 1,
+        score_sum = score_sum + excluded.score_sum,
+        score_min = MIN(score_min, excluded.score_min),
+        score_max = MAX(score_max, excluded.score_max)
+    """
+    cursor.executemany(sql, [
+        (user_id, period, period_bounds(period, date)[0], label, score, score, score)
+        for period in ROLLUP_PERIODS
+    ])
+    if scores is not None:
+        cursor.executemany("""
+        INSERT INTO emotion_rollups (user_id, period, period_start, emotion, entry_count, score_sum)
+        VALUES (?, ?, ?, ?, 1, ?)
+        ON CONFLICT (user_id, period, period_start, emotion) DO UPDATE SET
+            entry_count = entry_count + 1,
+            score_sum = score_sum + excluded.score_sum
+        """, [
+            (user_id, period, period_bounds(period, date)[0], emotion, value)
+            for period in ROLLUP_PERIODS for emotion, value in _emotion_values(scores)
+        ])
+
+def rollup_remove(cursor, user_id, date, label, score, scores=None):
+    """
+    Backs one entry's previous label, score and emotion distribution out of the
+    rollups. Must run after the entry row itself was replaced, because min/max are
+    re-derived from entries when the removed score was an extreme.
+    """
+    if label is None or score is None:
+        return
+    for period in ROLLUP_PERIODS:
+        start, end = period_bounds(period, date)
+        key = (user_id, period, start, label)
+        cursor.execute("""
+        UPDATE mood_rollups SET entry_count = entry_count - 1, score_sum = score_sum - ?
+        WHERE user_id = ? AND period = ? AND period_start = ? AND sentiment_label = ?
+        """, (score, *key))
+        cursor.execute("""
+        SELECT entry_count, score_min, score_max FROM mood_rollups
+        WHERE user_id = ? AND period = ? AND period_start = ? AND sentiment_label = ?
+        """, key)
+        row = cursor.fetchone()
+        if row is None:
+            continue
+        count, score_min, score_max = row
+        if count <= 0:
+            cursor.execute("""
+            DELETE FROM mood_rollups
+            WHERE user_id = ? AND period = ? AND period_start = ? AND sentiment_label = ?
+            """, key)
+        elif score <= score_min or score >= score_max:
+            cursor.execute("""
+            UPDATE mood_rollups SET (score_min, score_max) = (
+                SELECT MIN(sentiment_score), MAX(sentiment_score) FROM entries
+                WHERE user_id = ? AND sentiment_label = ? AND entry_date BETWEEN ? AND ?
+            )
+            WHERE user_id = ? AND period = ? AND period_start = ? AND sentiment_label = ?
+            """, (user_id, label, start, end, *key))
+
+    if scores is not None:
+        starts = {period: period_bounds(period, date)[0] for period in ROLLUP_PERIODS}
+        cursor.executemany("""
+        UPDATE emotion_rollups SET entry_count = entry_count - 1, score_sum = score_sum - ?
+        WHERE user_id = ? AND period = ? AND period_start = ? AND emotion = ?
+        """, [
+            (value, user_id, period, start, emotion)
+            for period, start in starts.items() for emotion, value in _emotion_values(scores)
+        ])
+        cursor.executemany("""
+        DELETE FROM emotion_rollups
+        WHERE user_id = ? AND period = ? AND period_start = ? AND entry_count <= 0
+        """, [(user_id, period, start) for period, start in starts.items()])
+
+def recompute_rollups(cursor, user_id=None, start=None, end=None):
+    """
+    Rebuilds the mood and emotion rollups from the entries table, either for every
+    user or for the periods overlapping [start, end] of one user.
+    """
+    for period, period_expr in ROLLUP_PERIODS.items():
+        if user_id is None:
+            cursor.execute("DELETE FROM mood_rollups WHERE period = ?", (period,))
+            where, params = "", ()
+        else:
+            first = period_bounds(period, start)[0]
+            last_start, last = period_bounds(period, end)
+            cursor.execute("""
+            DELETE FROM mood_rollups
+            WHERE user_id = ? AND period = ? AND period_start BETWEEN ? AND ?
+            """, (user_id, period, first, last_start))
+            where, params = "AND user_id = ? AND entry_date BETWEEN ? AND ?", (user_id, first, last)
+        cursor.execute(f"""
+        INSERT INTO mood_rollups (user_id, period, period_start, sentiment_label, entry_count, score_sum, score_min, score_max)
+        SELECT user_id, ?, {period_expr} AS bucket, sentiment_label,
+               COUNT(*), SUM(sentiment_score), MIN(sentiment_score), MAX(sentiment_score)
+        FROM entries
+        WHERE sentiment_label IS NOT NULL AND sentiment_score IS NOT NULL {where}
+        GROUP BY user_id, bucket, sentiment_label
+        """, (period, *params))
+    recompute_emotion_rollups(cursor, user_id, start, end)
+
+def recompute_rollups_for_dates(cursor, user_id, dates):
+    """
+    Rebuilds one user's rollups for the months containing the given dates, e.g.
+    after a bulk write. Runs of consecutive months are rebuilt together and the
+    months between runs are left alone, so dates scattered across years cost only
+    their own months.
+    """
+    months = sorted({day.year * 12 + day.month - 1 for day in map(as_date, dates)})
+    runs = []
+    for month in months:
+        if runs and runs[-1][1] == month - 1:
+            runs[-1][1] = month
+        else:
+            runs.append([month, month])
+    for first, last in runs:
+        start = datetime.date(first // 12, first % 12 + 1, 1)
+        end = period_bounds("month", datetime.date(last // 12, last % 12 + 1, 1))[1]
+        recompute_rollups(cursor, user_id, start, end)
+
+def recompute_emotion_rollups(cursor, user_id=None, start=None, end=None):
+    """
+    Rebuilds only the emotion rollups, like `recompute_rollups`. The distributions
+    are packed, so they are summed here rather than in SQL.
+    """
+    bounds = {}
+    for period in ROLLUP_PERIODS:
+        if user_id is None:
+            cursor.execute("DELETE FROM emotion_rollups WHERE period = ?", (period,))
+            continue
+        first = period_bounds(period, start)[0]
+        last_start, last = period_bounds(period, end)
+        cursor.execute("""
+        DELETE FROM emotion_rollups
+        WHERE user_id = ? AND period = ? AND period_start BETWEEN ? AND ?
+        """, (user_id, period, first, last_start))
+        bounds[period] = (first, last)
+
+    if user_id is None:
+        cursor.execute("""
+        SELECT user_id, entry_date, sentiment_scores FROM entries
+        WHERE sentiment_label IS NOT NULL AND sentiment_score IS NOT NULL AND sentiment_scores IS NOT NULL
+        """)
+    else:
+        # One read over the widest span; weeks can reach past the first and last month
+        cursor.execute("""
+        SELECT user_id, entry_date, sentiment_scores FROM entries
+        WHERE sentiment_label IS NOT NULL AND sentiment_score IS NOT NULL AND sentiment_scores IS NOT NULL
+          AND user_id = ? AND entry_date BETWEEN ? AND ?
+        """, (user_id, min(b[0] for b in bounds.values()), max(b[1] for b in bounds.values())))
+
+    totals = {}
+    for row_user, entry_date, scores in cursor.fetchall():
+        day = as_date(entry_date)
+        values = unpack_scores(scores).astype(np.float64)
+        for period in ROLLUP_PERIODS:
+            if bounds and not bounds[period][0] <= day <= bounds[period][1]:
+                continue
+            key = (row_user, period, period_bounds(period, day)[0])
+            count, total = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, total + values)
+
+    cursor.executemany("""
+    INSERT INTO emotion_rollups (user_id, period, period_start, emotion, entry_count, score_sum)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (row_user, period, period_start, emotion, count, float(value))
+        for (row_user, period, period_start), (count, total) in totals.items()
+        for emotion, value in zip(SCORE_LABELS, total)
+    ])
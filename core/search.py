@@ -0,0 +1,247 @@
+"""
+Blind keyword search over encrypted entries.
+
+Run from the project root to query or rebuild a user's index:
+    python -m core.search --user alice "sister OR brother"
+    python -m core.search --user alice --rebuild
+"""
+import re
+import hmac
+import hashlib
+import time
+
+from core.db import DatabaseHandler
+from core.encryption import EncryptionHandler
+from core.jobs import BackgroundBatchJob
+from core.rollups import as_date
+
+# HKDF label of the search key; distinct from every other subkey of the data key.
+SEARCH_KEY_INFO = b"moodvault search index v1"
+# Bytes of each HMAC kept in the index. 128 bits makes collisions between a
+# user's terms practically impossible while halving the index size.
+TERM_HASH_SIZE = 16
+# Shortest prefix that can be searched with `word*`. Shorter prefixes would
+# match most of the journal and add the most index rows.
+MIN_PREFIX_LENGTH = 3
+# Prefixes are indexed up to this length; a longer `prefix*` query matches on
+# its first MAX_PREFIX_LENGTH characters.
+MAX_PREFIX_LENGTH = 20
+# Entries decrypted and indexed per transaction when building the index.
+INDEX_BATCH_SIZE = 50
+# Pause between batches of the background builder, so it never competes with the user.
+INDEX_PAUSE = 0.2
+
+_WORD_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into case-folded words, in order, including repeats."""
+    return _WORD_RE.findall(text.casefold())
+
+def parse_query(query: str) -> list[list[tuple[str, str]]]:
+    """
+    Parses a search query into OR-groups of AND-ed terms.
+
+    Words are AND-ed by default, `OR` (upper case) separates alternatives and binds
+    more loosely than AND, and a trailing `*` makes a word a prefix. `AND` may be
+    written out for readability. E.g. `walk* AND park OR beach` is
+    (walk* AND park) OR beach.
+
+    Returns:
+        list[list[tuple[str, str]]]: ('word' | 'prefix', value) terms for each group.
+
+    Raises:
+        ValueError: If the query has no terms or a prefix is too short.
+    """
+    groups = [[]]
+    for part in query.split():
+        if part == "OR":
+            groups.append([])
+            continue
+        if part == "AND":
+            continue
+        words = tokenize(part)
+        if not words:
+            continue
+        is_prefix = part.endswith("*")
+        for word in words[:-1]:
+            groups[-1].append(("word", word))
+        if is_prefix:
+            if len(words[-1]) < MIN_PREFIX_LENGTH:
+                raise ValueError(f"Prefix searches need at least {MIN_PREFIX_LENGTH} characters: '{part}'.")
+            groups[-1].append(("prefix", words[-1][:MAX_PREFIX_LENGTH]))
+        else:
+            groups[-1].append(("word", words[-1]))
+
+    groups = [group for group in groups if group]
+    if not groups:
+        raise ValueError("The search query contains no words.")
+    return groups
+
+class SearchIndex:
+    """
+    Keyword index of one user's entries that never stores a plaintext word.
+
+    Every word of an entry, and each of its prefixes from MIN_PREFIX_LENGTH
+    characters up, is replaced by an HMAC under a key derived from the user's data
+    key, and the (hash, date) pairs are kept in the entry_terms table. A query is
+    hashed the same way and answered from the index alone: no entry is decrypted,
+    matching or not. Without the key, the table shows only which entries share
+    some term, and how often each term occurs.
+
+    Saves keep the index current by passing `term_hashes(text)` to
+    `DatabaseHandler.add_or_update_entry`. `index_entries` fills it in for entries
+    written before the index existed and rebuilds it on request.
+    """
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler, user_id: int):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            user_id (int): The user whose entries are indexed.
+        """
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.user_id = user_id
+        self._key = enc_handler.derive_subkey(SEARCH_KEY_INFO)
+
+    def _hash(self, kind: str, value: str) -> bytes:
+        # The kind tag keeps a whole word and an equal prefix apart: "walk" the word
+        # must not match "walked", but the prefix "walk" must
+        message = f"{kind}:{value}".encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).digest()[:TERM_HASH_SIZE]
+
+    def term_hashes(self, text: str) -> set[bytes]:
+        """Returns the blind terms of a text: each distinct word and its prefixes."""
+        hashes = set()
+        for word in set(tokenize(text)):
+            hashes.add(self._hash("word", word))
+            for length in range(MIN_PREFIX_LENGTH, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                hashes.add(self._hash("prefix", word[:length]))
+        return hashes
+
+    def search(self, query: str) -> list:
+        """
+        Finds the entries matching a query (see `parse_query` for the syntax).
+
+        Returns:
+            list[date]: Matching entry dates, oldest first.
+
+        Raises:
+            ValueError: If the query is not valid.
+        """
+        groups = [[self._hash(kind, value) for kind, value in group] for group in parse_query(query)]
+        matches = self.db_handler.get_dates_for_terms(self.user_id, {h for group in groups for h in group})
+
+        dates = set()
+        for group in groups:
+            # Intersect the rarest terms first, so the working set stays small
+            candidates = sorted((matches.get(h, set()) for h in group), key=len)
+            dates |= set.intersection(*candidates)
+        return sorted(as_date(d) for d in dates)
+
+    def index_entries(self, missing_only=True, batch_size=INDEX_BATCH_SIZE, stop_event=None, pause=0):
+        """
+        Decrypts entries a batch at a time and writes their terms to the index.
+
+        Args:
+            missing_only (bool): Only index entries that have no terms yet. Pass False
+                                 to rebuild the index for every entry.
+            batch_size (int): Entries per transaction.
+            stop_event (threading.Event, optional): Stops after the current batch once set.
+            pause (float): Seconds to wait between batches.
+
+        Returns:
+            int: Number of entries indexed.
+        """
+        indexed = 0
+        after_id = 0
+        while stop_event is None or not stop_event.is_set():
+            rows = self.db_handler.get_entries_to_index(
+                self.user_id, after_id=after_id, limit=batch_size, missing_only=missing_only
+            )
+            if not rows:
+                break
+            after_id = rows[-1][0]
+
+            updates = []
+            for result in self.enc_handler.decrypt_many(blob for _, _, blob in rows):
+                _, entry_date, blob = rows[result.index]
+                if result.error is None:
+                    updates.append((entry_date, blob, self.term_hashes(result.value)))
+            updated = self.db_handler.update_entry_terms(self.user_id, updates)
+            if updated is None:
+                break
+            indexed += updated
+
+            if pause:
+                if stop_event is not None:
+                    stop_event.wait(pause)
+                else:
+                    time.sleep(pause)
+        return indexed
+
+    def rebuild(self) -> int:
+        """Re-indexes every entry and drops terms of dates without an entry. Returns the count."""
+        indexed = self.index_entries(missing_only=False)
+        self.db_handler.prune_entry_terms(self.user_id)
+        return indexed
+
+class SearchIndexBuilder(BackgroundBatchJob):
+    """
+    Indexes a user's not yet indexed entries, e.g. the history written before
+    the search index existed.
+    """
+    thread_name = "search-index-builder"
+
+    def __init__(self, search_index: SearchIndex, batch_size=INDEX_BATCH_SIZE, pause=INDEX_PAUSE):
+        """
+        Args:
+            search_index (SearchIndex): The index to fill in.
+            batch_size (int): Entries per transaction.
+            pause (float): Seconds to sleep between batches.
+        """
+        super().__init__(batch_size, pause)
+        self.search_index = search_index
+
+    def run(self):
+        """Indexes every entry that has no terms yet, or until stopped."""
+        indexed = self.search_index.index_entries(
+            missing_only=True, batch_size=self.batch_size, stop_event=self._stop_event, pause=self.pause
+        )
+        if indexed:
+            print(f"Added {indexed} entries to the search index.")
+
+def main():
+    import argparse
+    import getpass
+
+    from core.auth import AuthHandler
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", required=True, help="username whose entries are searched")
+    parser.add_argument("--rebuild", action="store_true", help="re-index every entry before searching")
+    parser.add_argument("query", nargs="*", help="words; OR between alternatives, word* for a prefix")
+    args = parser.parse_args()
+
+    db_handler = DatabaseHandler()
+    try:
+        success, message, key = AuthHandler(db_handler).unlock(args.user, getpass.getpass("Password: "))
+        if not success:
+            raise SystemExit(message)
+        index = SearchIndex(db_handler, EncryptionHandler(key), db_handler.get_user_id(args.user))
+
+        if args.rebuild:
+            print(f"Indexed {index.rebuild()} entries.")
+        if args.query:
+            try:
+                dates = index.search(" ".join(args.query))
+            except ValueError as e:
+                raise SystemExit(str(e))
+            for entry_date in dates:
+                print(entry_date.isoformat())
+            print(f"{len(dates)} matching entries.")
+    finally:
+        db_handler.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,300 @@
-from transformers import pipeline
+import re
+import hmac
+import json
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from core.inference import create_backend
 
 # Define the set of emotions the model can predict
 EMOTION_LABELS = {"anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"}
+# Fixed order of the labels in a packed score distribution (see pack_scores).
+SCORE_LABELS = tuple(sorted(EMOTION_LABELS))
+# 7 x float16 = 14 bytes per entry; probabilities need no more than three decimals.
+SCORES_DTYPE = np.float16
+
+# The Hugging Face model used for classification. Part of every cache key, so
+# switching models never serves stale results.
+MODEL_ID = "j-hartmann/emotion-english-distilroberta-base"
+
+# Texts per forward pass in analyze_batch. Larger batches amortize per-call
+# overhead; on CPU the gains flatten out past a few dozen (see benchmarks/).
+DEFAULT_BATCH_SIZE = 16
+
+# Tokens shared by consecutive windows when a paragraph is longer than the model's
+# limit. Enough for a sentence, so none is only ever seen cut in half.
+CHUNK_OVERLAP_TOKENS = 64
+# How texts are turned into scores. Part of model_version, so change it whenever
+# the splitting or aggregation changes.
+SCORING_SCHEME = f"blank-line-paragraphs+windows{CHUNK_OVERLAP_TOKENS}"
+# A blank line (possibly holding only whitespace) ends a paragraph. Single line
+# breaks do not, so lists and short multi-line entries are scored as one unit.
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Scores of one window of a long entry: character span, text tokens, per-label scores.
+ChunkScore = namedtuple("ChunkScore", ["start", "end", "tokens", "scores"])
+# Full result of a windowed analysis. mean_scores are weighted by window length, and
+# embedding is the unit-length, length-weighted mean of the window embeddings (None
+# for text without tokens).
+ChunkedAnalysis = namedtuple("ChunkedAnalysis", ["label", "score", "mean_scores", "max_scores", "chunks", "embedding"])
+# Cached scores of one paragraph: text tokens, length-weighted sum and maximum of its
+# window scores (arrays in label order), its windows with paragraph-relative spans,
+# and the length-weighted sum of its window embeddings.
+ParagraphScore = namedtuple("ParagraphScore", ["tokens", "weighted_sum", "peak", "chunks", "embedding_sum"])
+
+# Number of analysis results kept in memory.
+CACHE_SIZE = 1024
+# Number of paragraph scores kept in memory. Editing an entry only rescores the
+# paragraphs that changed; the rest come from here.
+PARAGRAPH_CACHE_SIZE = 4096
+# Version of the cache key scheme. Bump it whenever texts that used to share a key
+# may now score differently, so stale results in memory and on disk are never hit.
+CACHE_KEY_VERSION = 3
+# HKDF label for the key that hashes cache keys before they are written to disk.
+DISK_CACHE_KEY_INFO = b"moodvault sentiment cache v1"
+
+def pack_scores(scores: dict) -> bytes | None:
+    """
+    Packs a per-label score distribution, e.g. ChunkedAnalysis.mean_scores, into
+    SCORE_LABELS order. Returns None for an empty distribution.
+    """
+    if not scores:
+        return None
+    return np.array([scores.get(label, 0.0) for label in SCORE_LABELS], dtype=SCORES_DTYPE).tobytes()
+
+def unpack_scores(data: bytes | None) -> np.ndarray | None:
+    """
+    Reads a packed distribution as a read-only array in SCORE_LABELS order. The
+    array is a view of `data`, not a copy.
+    """
+    if data is None:
+        return None
+    return np.frombuffer(data, dtype=SCORES_DTYPE)
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace within each line and runs of blank lines, so edits that
+    only touch spacing hit the cache. Line and paragraph breaks are kept: the model
+    sees line breaks, and paragraphs are scored separately (see `split_paragraphs`).
+    """
+    return "\n\n".join(
+        "\n".join(" ".join(line.split()) for line in paragraph.split("\n"))
+        for _, paragraph in split_paragraphs(text)
+    )
+
+def split_paragraphs(text: str) -> list[tuple[int, str]]:
+    """
+    Returns (offset, paragraph) for each block of text between blank lines, without
+    surrounding whitespace. Line breaks inside a block are kept.
+    """
+    paragraphs = []
+    start = 0
+    for boundary in [*PARAGRAPH_BREAK.finditer(text), None]:
+        end = boundary.start() if boundary else len(text)
+        block = text[start:end]
+        if block.strip():
+            paragraphs.append((start + len(block) - len(block.lstrip()), block.strip()))
+        if boundary:
+            start = boundary.end()
+    return paragraphs
+
+class SentimentCache:
+    """
+    A thread-safe LRU memo of analysis results, keyed by a SHA-256 hash of the
+    key scheme version, the model id and the (by default normalized) text.
+    Plaintext is never stored.
+
+    An optional second tier (see EncryptedSentimentStore) persists results across
+    sessions; memory misses fall through to it and its hits are promoted.
+    """
+    def __init__(self, model_id=MODEL_ID, max_size=CACHE_SIZE, normalize=True):
+        """
+        Args:
+            model_id (str): Identifier of the model whose results are cached.
+            max_size (int): Maximum number of results kept in memory.
+            normalize (bool): Whether texts differing only in whitespace within lines share a key.
+        """
+        self.model_id = model_id
+        self.max_size = max_size
+        self.normalize = normalize
+        self.store = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> bytes:
+        """Returns the cache key for a text."""
+        if self.normalize:
+            text = normalize_text(text)
+        return hashlib.sha256(f"{CACHE_KEY_VERSION}\0{self.model_id}\0{text}".encode('utf-8')).digest()
+
+    def get(self, key: bytes):
+        """Returns the cached (label, score) for a key, or None on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.store is not None:
+            result = self.store.load(key)
+            if result is not None:
+                self._remember(key, result)
+                return result
+        return None
+
+    def put(self, key: bytes, result):
+        """Caches a (label, score) result in memory and, if attached, on disk."""
+        self._remember(key, result)
+        if self.store is not None:
+            self.store.save(key, result)
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def attach_store(self, store):
+        """Enables a persistent tier, e.g. an EncryptedSentimentStore after login."""
+        self.store = store
+
+    def clear(self):
+        """Forgets all in-memory results and detaches the persistent tier (on logout)."""
+        with self._lock:
+            self._entries.clear()
+        self.store = None
+
+class EncryptedSentimentStore:
+    """
+    Persistent cache tier in the user's database.
+
+    Keys are HMAC'd with a key derived from the user's data key, so the stored
+    hashes cannot be matched against guessed texts, and results are encrypted
+    with the user's EncryptionHandler.
+    """
+    def __init__(self, db_handler, enc_handler, user_id):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            user_id (int): The user whose cache this is.
+        """
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.user_id = user_id
+        self._hmac_key = enc_handler.derive_subkey(DISK_CACHE_KEY_INFO)
+
+    def _disk_key(self, key):
+        return hmac.new(self._hmac_key, key, hashlib.sha256).digest()
+
+    def load(self, key):
+        blob = self.db_handler.get_cached_sentiment(self.user_id, self._disk_key(key))
+        if blob is None:
+            return None
+        decrypted = self.enc_handler.decrypt(blob)
+        if decrypted is None:
+            return None
+        label, score = json.loads(decrypted)
+        return label, score
+
+    def save(self, key, result):
+        blob = self.enc_handler.encrypt(json.dumps(list(result)))
+        self.db_handler.put_cached_sentiment(self.user_id, self._disk_key(key), blob)
 
 class SentimentAnalyzer:
     """
     A wrapper class for a sophisticated Hugging Face emotion classification model.
     Provides a simple interface to get a specific mood label and its confidence score.
+
+    The model runs on a selectable CPU backend (see core.inference): full-precision
+    PyTorch by default, int8-quantized PyTorch, or ONNX Runtime. All backends
+    produce the same EMOTION_LABELS.
+
+    Analysis is thread-safe; model work from concurrent callers is serialized.
+
+    Creating the analyzer is cheap: transformers is imported and the model loaded on
+    the first call to `load`, which the app makes on a background thread at startup.
+    `analyze` loads the model itself if nothing else has yet.
     """
-    def __init__(self):
+    def __init__(self, backend=None):
         """
-        Initializes the emotion classification pipeline.
-        The model is downloaded automatically on the first run.
+        Prepares the analyzer without loading the model.
+        The model is downloaded automatically on the first load.
+
+        Args:
+            backend (str, optional): 'pytorch', 'pytorch-int8' or 'onnx'. Defaults to
+                                     $MOODVAULT_INFERENCE_BACKEND, then 'pytorch'.
         """
-        print("Initializing sentiment analyzer... (This may take a moment on first run)")
-        # We use a specific, well-regarded model fine-tuned for emotion
-        # The 'pipeline' function is a high-level helper from the transformers library
-        self.classifier = pipeline(
-            "text-classification", 
-            model="j-hartmann/emotion-english-distilroberta-base",
-            return_all_scores=True
-        )
-        print("Sentiment analyzer initialized successfully.")
+        self.backend = create_backend(backend, MODEL_ID)
+        self.load_error = None
+        self._load_lock = threading.Lock()
+        # Fast tokenizers cannot be used from two threads at once, and parallel
+        # forward passes would only compete for the same cores
+        self._inference_lock = threading.Lock()
+        # Repeat analyses of unchanged text are answered from here, even before
+        # the model has loaded. Backends differ slightly in their scores, so each
+        # has its own cache keys.
+        self.cache = SentimentCache(self.model_version)
+        # Per-paragraph scores, kept exactly (not normalized) so window spans stay valid
+        self.paragraph_cache = SentimentCache(self.model_version, PARAGRAPH_CACHE_SIZE, normalize=False)
+
+    @property
+    def model_version(self):
+        """Identifies everything that determines a score: model, backend and windowing."""
+        return f"{MODEL_ID}:{self.backend.name}:{SCORING_SCHEME}"
+
+    @property
+    def scoring_version(self):
+        """
+        Identifies the scores stored with an entry: model and windowing. Backends
+        are left out; they agree within the tolerance benchmarks/bench_backends.py
+        checks, so switching one does not make the stored history stale.
+        """
+        return f"{MODEL_ID}:{SCORING_SCHEME}"
+
+    def clear_cache(self):
+        """Forgets all cached results and detaches the persistent tier (on logout)."""
+        self.cache.clear()
+        self.paragraph_cache.clear()
+
+    @property
+    def is_ready(self):
+        """True once the model is loaded."""
+        return self.backend.is_loaded
+
+    def load(self):
+        """
+        Loads the emotion classification model if it is not loaded yet.
+        Safe to call from any thread; concurrent callers wait for the same load.
+
+        Raises:
+            Exception: If the model cannot be loaded. The error is remembered and
+                       raised again by later calls instead of retrying the download.
+        """
+        with self._load_lock:
+            if self.backend.is_loaded:
+                return
+            if self.load_error is not None:
+                raise self.load_error
+
+            print(f"Initializing sentiment analyzer ({self.backend.name})... (This may take a moment on first run)")
+            try:
+                # Importing transformers alone takes seconds, so the backend defers it to here
+                self.backend.load()
+            except Exception as e:
+                self.load_error = e
+                raise
+            print("Sentiment analyzer initialized successfully.")
 
     def analyze(self, text: str) -> tuple[str, float] | tuple[None, None]:
         """
         Analyzes the emotional content of a given text.
 
+        The text is scored paragraph by paragraph (see `analyze_chunked`), so after
+        an edit only the changed paragraphs go through the model again.
+
         Args:
             text (str): The text to be analyzed.
 
@@ -37,24 +305,226 @@ class SentimentAnalyzer:
         if not text.strip():
             return None, None
 
+        key = self.cache.key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
-            # The classifier returns a list of dictionaries, one for each emotion
-            # e.g., [[{'label': 'sadness', 'score': 0.9...}, {'label': 'joy', 'score': 0.0...}]]
-            scores = self.classifier(text)
-            
-            # The result is nested in a list, so we take the first element
-            if not scores or not scores[0]:
-                return "neutral", 0.0
-
-            # Find the emotion with the highest score
-            dominant_mood = max(scores[0], key=lambda x: x['score'])
-            
-            mood_label = dominant_mood['label'].capitalize()
-            mood_score = dominant_mood['score']
-            
-            return mood_label, mood_score
+            analysis = self._analyze_texts([text], DEFAULT_BATCH_SIZE)[0]
+            result = analysis.label, analysis.score
+            self.cache.put(key, result)
+            return result
 
         except Exception as e:
             print(f"Error during sentiment analysis: {e}")
             return None, None
 
+    def analyze_chunked(self, text: str, batch_size: int = DEFAULT_BATCH_SIZE) -> ChunkedAnalysis | None:
+        """
+        Analyzes a text of any length and returns the per-window detail.
+
+        Each paragraph (text between blank lines) is tokenized once and split into windows
+        of the model's maximum length that overlap by CHUNK_OVERLAP_TOKENS; the
+        windows are scored in batches and combined into a length-weighted mean and
+        a per-label maximum. The cost grows linearly with the length of the text.
+        Paragraph scores are cached, so re-analyzing an edited entry only scores
+        the paragraphs that changed and recombines the rest.
+
+        Args:
+            text (str): The text to be analyzed.
+            batch_size (int): Number of windows per forward pass.
+
+        Returns:
+            ChunkedAnalysis | None: The dominant label and score (from the mean), the mean
+                                    and max scores per label, and a ChunkScore per window.
+                                    None for empty text or on error.
+        """
+        if not text.strip():
+            return None
+        try:
+            return self._analyze_texts([text], batch_size)[0]
+        except Exception as e:
+            print(f"Error during sentiment analysis: {e}")
+            return None
+
+    def analyze_batch(self, texts: list[str], batch_size: int = DEFAULT_BATCH_SIZE) -> list[tuple[str, float] | tuple[None, None]]:
+        """
+        Analyzes many texts with batched forward passes through the model.
+
+        All texts are split into windows as in `analyze_chunked`, and the windows
+        are sorted by length before batching so each padded batch wastes as little
+        compute as possible; results are returned in the original order.
+        Cached texts and duplicates within the batch skip the model.
+
+        Args:
+            texts (list[str]): The texts to be analyzed.
+            batch_size (int): Number of windows per forward pass.
+
+        Returns:
+            list[tuple]: One (mood_label, score) tuple per text, as returned by `analyze`.
+                         Empty texts, or every text if the batch fails, give (None, None).
+        """
+        results = [(None, None)] * len(texts)
+        # Cache misses grouped by key, so repeated texts are scored only once
+        misses = {}
+        for i, text in enumerate(texts):
+            if not text.strip():
+                continue
+            key = self.cache.key(text)
+            cached = self.cache.get(key) if key not in misses else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                misses.setdefault(key, []).append(i)
+        if not misses:
+            return results
+
+        try:
+            analyses = self._analyze_texts([texts[indices[0]] for indices in misses.values()], batch_size)
+        except Exception as e:
+            print(f"Error during batched sentiment analysis: {e}")
+            return results
+
+        for (key, indices), analysis in zip(misses.items(), analyses):
+            result = analysis.label, analysis.score
+            self.cache.put(key, result)
+            for i in indices:
+                results[i] = result
+        return results
+
+    def analyze_chunked_batch(self, texts: list[str], batch_size: int = DEFAULT_BATCH_SIZE) -> list[ChunkedAnalysis | None]:
+        """
+        Like `analyze_batch`, but returns the full ChunkedAnalysis of each text,
+        including its embedding, as `analyze_chunked` does.
+
+        Returns:
+            list[ChunkedAnalysis | None]: One result per text; None for empty texts, or for
+                                          every text if the batch fails.
+        """
+        results = [None] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text.strip()]
+        if not indices:
+            return results
+        try:
+            analyses = self._analyze_texts([texts[i] for i in indices], batch_size)
+        except Exception as e:
+            print(f"Error during batched sentiment analysis: {e}")
+            return results
+        for i, analysis in zip(indices, analyses):
+            results[i] = analysis
+        return results
+
+    def _analyze_texts(self, texts, batch_size):
+        """Scores the paragraphs of all texts that are not cached yet, then aggregates per text."""
+        self.load()
+        layouts = []
+        scores = {}
+        pending = {}
+        for text in texts:
+            layout = []
+            for offset, paragraph in split_paragraphs(text):
+                key = self.paragraph_cache.key(paragraph)
+                layout.append((offset, key))
+                if key in scores or key in pending:
+                    continue
+                cached = self.paragraph_cache.get(key)
+                if cached is not None:
+                    scores[key] = cached
+                else:
+                    pending[key] = paragraph
+            layouts.append(layout)
+
+        if pending:
+            with self._inference_lock:
+                scores.update(self._score_paragraphs(pending, batch_size))
+        return [self._aggregate(layout, scores) for layout in layouts]
+
+    def _score_paragraphs(self, paragraphs, batch_size):
+        """Scores paragraphs ({key: text}) in shared batches of windows and caches each result."""
+        if not paragraphs:
+            return {}
+        keys = list(paragraphs)
+        windows = [self.backend.windows(paragraphs[key], CHUNK_OVERLAP_TOKENS) for key in keys]
+        flat = [(p, w) for p, paragraph_windows in enumerate(windows) for w in range(len(paragraph_windows))]
+
+        # Sort by length to minimize padding, then put the scores back per paragraph
+        order = sorted(range(len(flat)), key=lambda f: len(windows[flat[f][0]][flat[f][1]].input_ids))
+        probabilities, embeddings = self.backend.forward_windows(
+            [windows[flat[f][0]][flat[f][1]].input_ids for f in order], batch_size
+        )
+        rows = [[None] * len(paragraph_windows) for paragraph_windows in windows]
+        vectors = [[None] * len(paragraph_windows) for paragraph_windows in windows]
+        for f, row, vector in zip(order, probabilities, embeddings):
+            p, w = flat[f]
+            rows[p][w] = row
+            vectors[p][w] = vector
+
+        labels = self.backend.labels
+        # Window length without the special tokens
+        special = self.backend.tokenizer.num_special_tokens_to_add()
+        results = {}
+        for key, paragraph_windows, paragraph_rows, paragraph_vectors in zip(keys, windows, rows, vectors):
+            lengths = np.array([len(window.input_ids) - special for window in paragraph_windows], dtype=float)
+            paragraph_rows = np.stack(paragraph_rows) if paragraph_rows else np.zeros((0, len(labels)))
+            embedding_sum = None
+            if paragraph_vectors:
+                embedding_sum = (np.stack(paragraph_vectors) * lengths[:, None].astype(np.float32)).sum(axis=0)
+            result = ParagraphScore(
+                int(lengths.sum()),
+                (paragraph_rows * lengths[:, None]).sum(axis=0),
+                paragraph_rows.max(axis=0, initial=0.0),
+                [
+                    ChunkScore(window.start, window.end, int(length), dict(zip(labels, row.tolist())))
+                    for window, length, row in zip(paragraph_windows, lengths, paragraph_rows)
+                ],
+                embedding_sum,
+            )
+            self.paragraph_cache.put(key, result)
+            results[key] = result
+        return results
+
+    def _aggregate(self, layout, scores):
+        """Combines the scores of a text's paragraphs ([(offset, key)]) into a ChunkedAnalysis."""
+        paragraphs = [(offset, scores[key]) for offset, key in layout]
+        tokens = sum(paragraph.tokens for _, paragraph in paragraphs)
+        if not tokens:
+            label, score = self._dominant(None)
+            return ChunkedAnalysis(label, score, {}, {}, [], None)
+
+        labels = self.backend.labels
+        mean = sum(paragraph.weighted_sum for _, paragraph in paragraphs) / tokens
+        peak = np.max([paragraph.peak for _, paragraph in paragraphs], axis=0)
+        embedding = sum(paragraph.embedding_sum for _, paragraph in paragraphs if paragraph.tokens)
+        embedding = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+        label, score = self._dominant([{"label": l, "score": float(p)} for l, p in zip(labels, mean)])
+        # Window spans are stored relative to their paragraph
+        chunks = [
+            chunk._replace(
+                start=offset + chunk.start if chunk.start is not None else None,
+                end=offset + chunk.end if chunk.end is not None else None,
+            )
+            for offset, paragraph in paragraphs for chunk in paragraph.chunks
+        ]
+        return ChunkedAnalysis(
+            label, score,
+            dict(zip(labels, mean.tolist())), dict(zip(labels, peak.tolist())),
+            chunks,
+            embedding.astype(np.float32),
+        )
+
+    @staticmethod
+    def _dominant(scores):
+        """Picks the highest-scoring emotion from the backend's per-label scores."""
+        if not scores:
+            return "neutral", 0.0
+
+        # Find the emotion with the highest score
+        dominant_mood = max(scores, key=lambda x: x['score'])
+        
+        mood_label = dominant_mood['label'].capitalize()
+        mood_score = dominant_mood['score']
+        
+        return mood_label, mood_score
+
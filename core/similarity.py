@@ -0,0 +1,170 @@
+import threading
+
+import numpy as np
+
+from core.db import DatabaseHandler
+from core.encryption import EncryptionHandler
+from core.rollups import as_date
+
+# Embeddings are stored as float16: half the size of float32, and cosine
+# similarities of unit vectors change only in the third decimal.
+EMBEDDING_DTYPE = np.float16
+# Number of similar entries returned by default.
+DEFAULT_TOP_K = 10
+# Rows allocated up front; the matrix doubles whenever it fills up.
+INITIAL_CAPACITY = 256
+
+def pack_embedding(embedding: np.ndarray) -> bytes:
+    """Packs a unit-length embedding into compact float16 bytes for storage."""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+def unpack_embedding(data: bytes) -> np.ndarray:
+    """Reads bytes written by `pack_embedding` back as a float32 array."""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE).astype(np.float32)
+
+class SimilarityIndex:
+    """
+    In-memory nearest-neighbour index over the embeddings of one user's entries.
+
+    The encrypted embeddings are read and decrypted once, on the first query,
+    into a single float32 matrix of unit rows; a query is then one matrix-vector
+    product (cosine similarity) and an `argpartition` for the top k, with no
+    model run. Saves update the matrix in place through `update`. Float32 is kept
+    in memory because NumPy has no fast float16 matrix product on CPU.
+    """
+    def __init__(self, db_handler: DatabaseHandler, enc_handler: EncryptionHandler, user_id: int):
+        """
+        Args:
+            db_handler (DatabaseHandler): An active database handler.
+            enc_handler (EncryptionHandler): The logged-in user's encryption handler.
+            user_id (int): The user whose entries are indexed.
+        """
+        self.db_handler = db_handler
+        self.enc_handler = enc_handler
+        self.user_id = user_id
+        self._matrix = None
+        self._dates = []
+        self._rows = {}
+        # Updates made while the index was loading; they are newer than what it read
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._matrix is not None
+
+    def __len__(self):
+        return len(self._dates)
+
+    def load(self):
+        """Reads and decrypts every stored embedding, unless already loaded. Safe from any thread."""
+        with self._load_lock:
+            if self.is_loaded:
+                return
+            rows = self.db_handler.get_entry_embeddings(self.user_id)
+            vectors = {}
+            for result in self.enc_handler.decrypt_many((blob for _, blob in rows), binary=True):
+                if result.error is None:
+                    vectors[as_date(rows[result.index][0])] = unpack_embedding(result.value)
+
+            with self._lock:
+                vectors.update(self._pending)
+                self._pending = {}
+                self._matrix = np.zeros((max(len(vectors), INITIAL_CAPACITY), 0), dtype=np.float32)
+                for day, vector in vectors.items():
+                    self._set_row(day, vector)
+
+    def update(self, day, embedding):
+        """Adds or replaces the embedding of a day's entry, e.g. after it was saved."""
+        if embedding is None:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self._matrix is None:
+                self._pending[day] = embedding
+            else:
+                self._set_row(day, embedding)
+
+    def _set_row(self, day, vector):
+        """Writes one unit row under the lock, growing the matrix as needed."""
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        if self._matrix.shape[1] != len(vector):
+            if self._dates:
+                # A different model; the old vectors cannot be compared with the new ones
+                print(f"Skipping embedding of {day}: dimension {len(vector)} != {self._matrix.shape[1]}.")
+                return
+            self._matrix = np.zeros((len(self._matrix), len(vector)), dtype=np.float32)
+
+        row = self._rows.get(day)
+        if row is None:
+            row = len(self._dates)
+            if row == len(self._matrix):
+                grown = np.zeros((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+            self._rows[day] = row
+            self._dates.append(day)
+        self._matrix[row] = vector
+
+    def similar_to(self, day, k=DEFAULT_TOP_K) -> list[tuple]:
+        """
+        Finds the entries most similar to a day's entry.
+
+        Returns:
+            list[tuple[date, float]]: Up to k (date, cosine similarity) pairs, most similar
+                                      first, without the day itself. Empty if the day has
+                                      no embedding.
+        """
+        self.load()
+        with self._lock:
+            row = self._rows.get(day)
+            if row is None:
+                return []
+            vector = self._matrix[row].copy()
+        return self.nearest(vector, k, exclude=day)
+
+    def nearest(self, vector, k=DEFAULT_TOP_K, exclude=None) -> list[tuple]:
+        """
+        Finds the entries closest to an embedding by cosine similarity.
+
+        Args:
+            vector (np.ndarray): A query embedding, e.g. from `SentimentAnalyzer.analyze_chunked`.
+            k (int): Maximum number of results.
+            exclude (date, optional): A day left out of the results.
+
+        Returns:
+            list[tuple[date, float]]: (date, similarity) pairs, most similar first.
+        """
+        self.load()
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            count = len(self._dates)
+            if count == 0 or k <= 0 or self._matrix.shape[1] != len(vector):
+                return []
+            similarities = self._matrix[:count] @ vector
+            dates = list(self._dates)
+            excluded_row = self._rows.get(exclude)
+
+        if excluded_row is not None:
+            similarities[excluded_row] = -np.inf
+            count -= 1
+        k = min(k, count)
+        if k <= 0:
+            return []
+        if k < len(similarities):
+            # Selecting the top k is linear; only those k are then sorted
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(len(similarities))
+        top = top[np.argsort(-similarities[top])]
+        return [(dates[i], float(similarities[i])) for i in top]
+
+    def clear(self):
+        """Drops all embeddings from memory (on logout)."""
+        with self._lock:
+            self._matrix = None
+            self._dates = []
+            self._rows = {}
+            self._pending = {}
@@ -2,18 +2,35 @@
 
 import os
 import sys
+import hashlib
 from datetime import date
-from PyQt5.QtWidgets import QApplication, QDialog, QMessageBox
+from PyQt5.QtWidgets import QApplication, QDialog, QInputDialog, QMessageBox
+from PyQt5.QtCore import QDate, QThreadPool, QTimer
 
 # Import from our packages
 from core.db import DatabaseHandler
 from core.auth import AuthHandler
-from core.encryption import EncryptionHandler, derive_key
-from core.sentiment import SentimentAnalyzer
-from ui.ui_auth import LoginDialog, RegisterDialog
+from core.encryption import EncryptionHandler
+from core.entry_cache import EntryCache
+from core.reencrypt import EntryFormatConverter
+from core.rescore import EntryRescorer
+from core.search import SearchIndex, SearchIndexBuilder
+from core.sentiment import SentimentAnalyzer, EncryptedSentimentStore, pack_scores
+from core.similarity import SimilarityIndex, pack_embedding
+from ui.ui_auth import LoginDialog, RegisterDialog, ChangePasswordDialog
 from ui.ui import MainWindow
+from ui.workers import JobQueue, Worker, WorkerSignals
 from visuals import StatsDialog
 
+# Minimum number of points the stats line chart should have before a coarser
+# rollup period is preferred over a finer one.
+STATS_MIN_POINTS = 3
+# Pause in typing after which the mood is re-analyzed. Only edited paragraphs are
+# rescored, so this is cheap enough to run while the user writes.
+LIVE_ANALYSIS_DELAY_MS = 800
+# Pause in typing after which a changed entry is saved automatically.
+AUTOSAVE_DELAY_MS = 3000
+
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
@@ -24,18 +41,34 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
+def content_hash(text):
+    """Fingerprint of an entry's text, used to skip saves that would change nothing."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
 class MoodVaultApp:
     def __init__(self):
         # Initialize all backend handlers
         self.db_handler = DatabaseHandler()
         self.auth_handler = AuthHandler(self.db_handler)
+        # Cheap to create; the model itself is loaded in the background once the
+        # login dialog is on screen (see _start_model_loading)
         self.sentiment_analyzer = SentimentAnalyzer()
+        self._model_loading = False
 
         # These will be initialized after successful login
         self.enc_handler = None
         self.main_window = None
         self.current_user_id = None
         self.current_username = None
+        self.format_converter = None
+        self.entry_cache = None
+        self.search_index = None
+        self.search_index_builder = None
+        self.similarity_index = None
+        self.rescorer = None
+        self._rescore_signals = None
+        # Analysis and save jobs for the open main window
+        self.jobs = None
 
  
     def run(self):
@@ -84,20 +117,29 @@ class MoodVaultApp:
             # If we get here, login was successful
             self.main_window = MainWindow(username=self.current_username)
             self._connect_signals()
+            self._update_model_status()
             self.main_window.show()
             
             # Load today's entry by default
             self._load_entry_for_date()
+            self._on_month_shown()
+            self._start_rescoring()
 
             # Start the Qt event loop. This blocks until the main window is closed.
             app.exec_()
             
             # When app.exec_() finishes (i.e., window is closed), the code continues.
+            # Finish the session's saves while the QApplication still exists, stop its
+            # background work and release the pooled connections; the pool reopens
+            # on demand.
+            self._end_session()
+
             # If the closure was NOT initiated by the logout button, we should exit.
             if not hasattr(self, '_logout_initiated') or not self._logout_initiated:
                 break # Exit the outer while loop, terminating the app.
             
             # If it was a logout, the loop will continue, showing the login screen.
+            self._logout_initiated = False
     
     def _logout(self):
         """Handles the user logout process."""
@@ -109,14 +151,22 @@ class MoodVaultApp:
     def show_registration_dialog(self):
         """Shows the registration dialog and handles user creation."""
         dialog = RegisterDialog()
+        dialog.register_requested.connect(
+            lambda username, password: self._start_registration(dialog, username, password)
+        )
         if dialog.exec_() == QDialog.Accepted:
-            username, password = dialog.get_credentials()
-            success, message = self.auth_handler.register_user(username, password)
-            QMessageBox.information(None, "Registration", message)
+            QMessageBox.information(None, "Registration", dialog.message)
             # We no longer auto-login here. User must now log in.
-            return True # Just signal that registration was attempted
+            return True # Just signal that registration succeeded
         return False # User cancelled
 
+    def _start_registration(self, dialog, username, password):
+        """Creates the account (calibration, key derivation, bcrypt) on a worker thread."""
+        worker = Worker(self.auth_handler.register_user, username, password)
+        worker.signals.result.connect(dialog.handle_register_result)
+        worker.signals.error.connect(dialog.handle_register_error)
+        QThreadPool.globalInstance().start(worker)
+
     def show_login_dialog(self):
         """
         Shows the login dialog and handles authentication.
@@ -124,19 +174,17 @@ class MoodVaultApp:
             tuple[bool, bool, bool]: A tuple of (login_success, wants_to_register, was_cancelled)
         """
         dialog = LoginDialog()
+        dialog.unlock_requested.connect(lambda username, password: self._start_unlock(dialog, username, password))
+        # Fires once the dialog's event loop is running, i.e. after it is shown
+        QTimer.singleShot(0, self._start_model_loading)
         result = dialog.exec_()
 
         if result == QDialog.Accepted:
-            # User clicked "Unlock"
-            username, password = dialog.get_credentials()
-            success, message = self.auth_handler.login_user(username, password)
-            if success:
-                self.current_username = username
-                self._post_login_setup(password)
-                return True, False, False # (login_success=True, wants_register=False, was_cancelled=False)
-            else:
-                QMessageBox.warning(None, "Login Failed", message)
-                return False, False, False # (login_success=False, ...)
+            # The vault was unlocked in the background while the dialog stayed responsive
+            username, _ = dialog.get_credentials()
+            self.current_username = username
+            self._post_login_setup(dialog.enc_handler)
+            return True, False, False # (login_success=True, wants_register=False, was_cancelled=False)
         
         # User closed dialog or clicked a button that calls reject()
         if dialog.wants_to_register:
@@ -145,31 +193,257 @@ class MoodVaultApp:
         # If we get here, the user must have cancelled (e.g., hit 'Exit' or closed the window)
         return False, False, True # (..., ..., was_cancelled=True)
 
-    def _post_login_setup(self, password):
+    def _start_unlock(self, dialog, username, password):
+        """Checks the password and derives the key on a worker thread."""
+        worker = Worker(self._unlock, username, password)
+        worker.signals.result.connect(dialog.handle_unlock_result)
+        worker.signals.error.connect(dialog.handle_unlock_error)
+        QThreadPool.globalInstance().start(worker)
+
+    def _unlock(self, username, password):
+        """
+        Runs on a worker thread. Verifies the password and builds the session's
+        EncryptionHandler without touching any widgets.
+        """
+        success, message, key = self.auth_handler.unlock(username, password)
+        return success, message, EncryptionHandler(key) if success else None
+
+    def _start_model_loading(self):
+        """Loads the sentiment model on a worker thread, once per process."""
+        if self._model_loading or self.sentiment_analyzer.is_ready or self.sentiment_analyzer.load_error:
+            return
+        self._model_loading = True
+        worker = Worker(self.sentiment_analyzer.load)
+        worker.signals.result.connect(lambda _: self._on_model_loaded())
+        worker.signals.error.connect(self._on_model_load_failed)
+        QThreadPool.globalInstance().start(worker)
+
+    def _on_model_loaded(self):
+        """Marks the model as ready. Jobs that were waiting for it continue on their own."""
+        self._model_loading = False
+        self._update_model_status()
+        self._start_rescoring()
+
+    def _on_model_load_failed(self, message):
+        """Reports the failure; waiting saves still go through, without a mood."""
+        self._model_loading = False
+        self._update_model_status()
+        if self.main_window:
+            QMessageBox.warning(self.main_window, "Mood Model Unavailable",
+                                f"The mood model could not be loaded: {message}\nEntries will be saved without a mood.")
+
+    def _start_rescoring(self):
+        """
+        Re-scores, in the background, entries stored with an older model or scoring
+        scheme. Needs the model and an open main window; called when either appears.
+        """
+        if self.rescorer or self.jobs is None or not self.sentiment_analyzer.is_ready:
+            return
+        # Progress arrives from the rescorer's thread; a signal hands it to the GUI thread
+        signals = WorkerSignals()
+        self.rescorer = EntryRescorer(
+            self.db_handler, self.enc_handler, self.sentiment_analyzer, self.current_user_id,
+            should_yield=lambda: self.jobs is not None and self.jobs.is_busy(),
+            progress_callback=signals.result.emit,
+        )
+        signals.result.connect(lambda progress, rescorer=self.rescorer: self._on_rescore_progress(rescorer, progress))
+        self._rescore_signals = signals
+        self.rescorer.start()
+
+    def _on_rescore_progress(self, rescorer, progress):
+        """Shows re-scoring progress and refreshes what depends on the scores once done."""
+        if rescorer is not self.rescorer:
+            return # From a previous session
+        for day in progress.dates:
+            # The cached mood of a re-scored day predates its new score
+            self.entry_cache.invalidate(day)
+        if not progress.finished:
+            self.main_window.set_rescore_status(f"Updating moods: {progress.done}/{progress.total}")
+            return
+        self.main_window.set_rescore_status("")
+        if rescorer.rescored:
+            # Cached embeddings may predate the new scores
+            self.similarity_index.clear()
+            self._refresh_calendar_marks()
+            self.main_window.status_bar.showMessage(f"Updated the moods of {rescorer.rescored} entries.", 5000)
+
+    def _submit_model_job(self, kind, key, fn, *args, description):
+        """
+        Queues a job that needs the model. Jobs submitted while the model is still
+        loading wait for it on their worker thread, never on the GUI thread.
+        """
+        if self._model_loading:
+            self.main_window.status_bar.showMessage(f"{description} will run as soon as the mood model is ready...")
+        self.jobs.submit(kind, key, fn, *args)
+
+    def _update_model_status(self):
+        """Shows whether the mood model is loading, ready or unavailable."""
+        if not self.main_window:
+            return
+        if self.sentiment_analyzer.is_ready:
+            self.main_window.set_model_status("ready")
+        elif self.sentiment_analyzer.load_error is not None:
+            self.main_window.set_model_status("unavailable")
+        else:
+            self.main_window.set_model_status("loading...")
+
+    def _change_password(self):
+        """Asks for a new master password and re-wraps the data key in the background."""
+        dialog = ChangePasswordDialog(parent=self.main_window)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        current_password, new_password = dialog.get_passwords()
+
+        self.main_window.change_password_action.setEnabled(False)
+        self.main_window.status_bar.showMessage("Changing master password...")
+        worker = Worker(self.auth_handler.change_password, self.current_username, current_password, new_password)
+        worker.signals.result.connect(self._on_password_changed)
+        worker.signals.error.connect(lambda message: self._on_password_changed((False, message)))
+        QThreadPool.globalInstance().start(worker)
+
+    def _on_password_changed(self, result):
+        """Reports the outcome of a background password change."""
+        success, message = result
+        self.main_window.change_password_action.setEnabled(True)
+        self.main_window.status_bar.showMessage(message, 5000)
+        if success:
+            QMessageBox.information(self.main_window, "Password Changed", message)
+        else:
+            QMessageBox.warning(self.main_window, "Password Not Changed", message)
+
+    def _post_login_setup(self, enc_handler):
         """Initializes user-specific handlers after a successful login."""
         self.current_user_id = self.db_handler.get_user_id(self.current_username)
-        salt = self.db_handler.get_user_salt(self.current_username)
-        key = derive_key(password, salt)
-        self.enc_handler = EncryptionHandler(key)
+        self.enc_handler = enc_handler
+
+        # Remember sentiment results across sessions, encrypted under the user's key
+        self.db_handler.prune_sentiment_cache(self.current_user_id)
+        self.sentiment_analyzer.cache.attach_store(
+            EncryptedSentimentStore(self.db_handler, self.enc_handler, self.current_user_id)
+        )
+
+        # Move any entries still in the legacy Fernet format to the current envelope
+        self.format_converter = EntryFormatConverter(self.db_handler, self.enc_handler, self.current_user_id)
+        self.format_converter.start()
+
+        # Decrypted entries for calendar navigation, prefetched a few months at a time
+        self.entry_cache = EntryCache(self.db_handler, self.enc_handler, self.current_user_id)
+
+        # Keyword search; saves keep it current, the builder indexes older entries
+        self.search_index = SearchIndex(self.db_handler, self.enc_handler, self.current_user_id)
+        self.search_index_builder = SearchIndexBuilder(self.search_index)
+        self.search_index_builder.start()
+
+        # Entry embeddings for "similar days", decrypted on the first query
+        self.similarity_index = SimilarityIndex(self.db_handler, self.enc_handler, self.current_user_id)
+
+    def _end_session(self):
+        """Stops per-session background jobs and releases pooled connections."""
+        if self.format_converter:
+            self.format_converter.stop()
+            self.format_converter = None
+        if self.search_index_builder:
+            self.search_index_builder.stop()
+            self.search_index_builder = None
+        if self.rescorer:
+            self.rescorer.stop()
+            self.rescorer = None
+            self._rescore_signals = None
+        if self.jobs:
+            # Persist the open entry, then let saves finish before the database
+            # closes; analyses are no longer wanted
+            self._save_if_changed()
+            self.jobs.blockSignals(True)
+            self.jobs.cancel("analyze")
+            self.jobs.wait()
+            self.jobs = None
+            self._unsaved_texts = {}
+        if self.entry_cache:
+            # Drop every decrypted entry with the session
+            self.entry_cache.close()
+            self.entry_cache = None
+        self.search_index = None
+        if self.similarity_index:
+            self.similarity_index.clear()
+            self.similarity_index = None
+        # Cached results are derived from the user's entries; drop them with the session
+        self.sentiment_analyzer.clear_cache()
+        self.db_handler.close()
 
     # --- Connector and Handler Methods ---
 
     def _connect_signals(self):
         """Connects UI element signals to the appropriate handler methods."""
         self.main_window.calendar.selectionChanged.connect(self._load_entry_for_date)
+        self.main_window.calendar.currentPageChanged.connect(self._on_month_shown)
         self.main_window.save_action.triggered.connect(self._save_entry)
         self.main_window.analyze_action.triggered.connect(self._analyze_mood)
+        self.main_window.similar_action.triggered.connect(self._find_similar_days)
         self.main_window.stats_action.triggered.connect(self._show_stats)
+        self.main_window.change_password_action.triggered.connect(self._change_password)
         self.main_window.logout_action.triggered.connect(self._logout)
 
+        self._live_analysis_timer = QTimer(self.main_window)
+        self._live_analysis_timer.setSingleShot(True)
+        self._live_analysis_timer.setInterval(LIVE_ANALYSIS_DELAY_MS)
+        self._live_analysis_timer.timeout.connect(self._live_analyze)
+        self.main_window.entry_editor.textChanged.connect(self._live_analysis_timer.start)
+
+        self.jobs = JobQueue(parent=self.main_window)
+        self.jobs.result.connect(self._on_job_result)
+        self.jobs.error.connect(self._on_job_error)
+
+        # Autosave: the date whose text is in the editor, the hash of what is stored
+        # (or being stored) for it, and texts whose save has not completed yet, which
+        # are shown instead of the database row if their day is reopened meanwhile
+        self._editor_date = None
+        self._saved_hash = None
+        self._unsaved_texts = {}
+        self._autosave_timer = QTimer(self.main_window)
+        self._autosave_timer.setSingleShot(True)
+        self._autosave_timer.setInterval(AUTOSAVE_DELAY_MS)
+        self._autosave_timer.timeout.connect(self._save_if_changed)
+        self.main_window.entry_editor.textChanged.connect(self._on_text_edited)
+
  
     def _load_entry_for_date(self):
         """Loads and decrypts a diary entry for the selected date."""
         selected_date = self.main_window.calendar.selectedDate().toPyDate()
-        encrypted_entry, mood_label = self.db_handler.get_entry_by_date(self.current_user_id, selected_date)
+        # Persist the day being left before the editor shows the next one
+        self._save_if_changed()
+        # Analyses of another day's text are stale now; saves always complete
+        self.jobs.cancel("analyze")
+
+        self._editor_date = selected_date
+        if selected_date in self._unsaved_texts:
+            # Its save is still running (or failed); the database row may be older than this
+            text, self._saved_hash = self._unsaved_texts[selected_date]
+            self.main_window.entry_editor.setPlainText(text)
+            self.main_window.mood_label.setText("Mood: Not saved yet")
+        else:
+            self._show_stored_entry(selected_date)
+            self._saved_hash = content_hash(self.main_window.entry_editor.toPlainText())
+
+        # Loading text is not typing; keep showing the saved mood
+        self._live_analysis_timer.stop()
+        if self._saved_hash is None:
+            # A failed save: try again shortly
+            self.main_window.set_save_status("Unsaved changes")
+            self._autosave_timer.start()
+        else:
+            self.main_window.set_save_status("All changes saved")
+            self._autosave_timer.stop()
 
-        if encrypted_entry:
-            decrypted_text = self.enc_handler.decrypt(encrypted_entry)
+    def _show_stored_entry(self, selected_date):
+        """Shows the saved entry for a date, from the prefetch cache when possible."""
+        found, decrypted_text, mood_label = self.entry_cache.get(selected_date)
+        if not found:
+            encrypted_entry, mood_label = self.db_handler.get_entry_by_date(self.current_user_id, selected_date)
+            decrypted_text = self.enc_handler.decrypt(encrypted_entry) if encrypted_entry else None
+            if decrypted_text is not None:
+                self.entry_cache.put(selected_date, decrypted_text, mood_label)
+
+        if decrypted_text is not None:
             self.main_window.entry_editor.setText(decrypted_text)
             self.main_window.mood_label.setText(f"Saved Mood: {mood_label}")
             self._update_editor_style(mood_label) 
@@ -178,49 +452,217 @@ class MoodVaultApp:
             self.main_window.mood_label.setText("Mood: Not Analyzed")
             self._update_editor_style("Neutral") 
 
+    def _on_text_edited(self):
+        """Marks the entry as changed and (re)starts the autosave countdown."""
+        self.main_window.set_save_status("Unsaved changes")
+        self._autosave_timer.start()
+
     
     def _analyze_mood(self):
-        """Analyzes the current text in the editor and updates the UI."""
+        """Analyzes the current text in the editor in the background; the UI updates when it finishes."""
         text = self.main_window.entry_editor.toPlainText()
         if not text.strip():
             self.main_window.mood_label.setText("Mood: Cannot analyze empty entry.")
             self._update_editor_style("Neutral") # Reset to neutral style
             return
 
-        mood_label, score = self.sentiment_analyzer.analyze(text)
+        self.main_window.mood_label.setText("Mood: Analyzing...")
+        self._submit_model_job("analyze", self._editor_date, self.sentiment_analyzer.analyze, text,
+                               description="Analysis")
+
+    def _live_analyze(self):
+        """Updates the mood while the user types, once the model is available."""
+        text = self.main_window.entry_editor.toPlainText()
+        if text.strip() and self.sentiment_analyzer.is_ready:
+            self.jobs.submit("analyze", self._editor_date, self.sentiment_analyzer.analyze, text)
+
+    def _show_mood(self, mood_label, score):
+        """Displays an analysis result under the editor."""
+        if mood_label is None:
+            self.main_window.mood_label.setText("Mood: Analysis failed.")
+            return
         self.main_window.mood_label.setText(f"Detected Mood: {mood_label} (Score: {score:.2f})")
         self._update_editor_style(mood_label) 
         
     def _save_entry(self):
-        """Encrypts and saves the current entry to the database."""
-        text_to_save = self.main_window.entry_editor.toPlainText()
-        if not text_to_save:
+        """Saves the current entry now, unless it is unchanged."""
+        if not self.main_window.entry_editor.toPlainText():
             QMessageBox.warning(self.main_window, "Empty Entry", "Cannot save an empty entry.")
             return
+        if not self._save_if_changed():
+            self.main_window.status_bar.showMessage("No changes to save.", 3000)
 
-        # Get mood from status bar or re-analyze
-        self._analyze_mood() # Ensure mood is up-to-date before saving
-        mood_label, score = self.sentiment_analyzer.analyze(text_to_save)
-        
+    def _save_if_changed(self):
+        """
+        Queues a background save of the editor text if it differs from what is
+        stored for its date. Empty text is never saved automatically.
+
+        Returns:
+            bool: True if a save was queued.
+        """
+        self._autosave_timer.stop()
+        text = self.main_window.entry_editor.toPlainText()
+        if self._editor_date is None or not text.strip():
+            return False
+        text_hash = content_hash(text)
+        if text_hash == self._saved_hash:
+            self.main_window.set_save_status("All changes saved")
+            return False
+
+        # The date is captured now: a queued save must not follow the calendar around
+        self._saved_hash = text_hash
+        self._unsaved_texts[self._editor_date] = (text, text_hash)
+        self.main_window.set_save_status("Saving...")
+        self._submit_model_job("save", self._editor_date, self._write_entry, text, self._editor_date,
+                               description="Saving")
+        return True
+
+    def _write_entry(self, text_to_save, selected_date):
+        """
+        Scores, encrypts and stores one entry. Runs on a worker thread, so it
+        must not touch any widgets.
+
+        Returns:
+            tuple[bool, str | None, float | None, bytes, numpy.ndarray | None]: Success flag, mood
+                label, score, the hash of the saved text and its embedding.
+        """
+        # Ensure mood is up-to-date before saving. Paragraphs scored while typing come
+        # from the cache, and the embedding comes from the same pass as the mood.
+        mood_label, score, embedding, distribution = None, None, None, None
+        analysis = self.sentiment_analyzer.analyze_chunked(text_to_save)
+        if analysis is not None:
+            mood_label, score, embedding = analysis.label, analysis.score, analysis.embedding
+            distribution = pack_scores(analysis.mean_scores)
         encrypted_data = self.enc_handler.encrypt(text_to_save)
-        selected_date = self.main_window.calendar.selectedDate().toPyDate()
+        encrypted_embedding = None
+        if embedding is not None:
+            encrypted_embedding = self.enc_handler.encrypt_bytes(pack_embedding(embedding), compress=False)
 
         success = self.db_handler.add_or_update_entry(
-            self.current_user_id, selected_date, encrypted_data, mood_label, score
+            self.current_user_id, selected_date, encrypted_data, mood_label, score,
+            term_hashes=self.search_index.term_hashes(text_to_save),
+            encrypted_embedding=encrypted_embedding,
+            sentiment_scores=distribution,
+            model_version=self.sentiment_analyzer.scoring_version if analysis is not None else None,
         )
+        return success, mood_label, score, content_hash(text_to_save), embedding
 
-        if success:
-            QMessageBox.information(self.main_window, "Success", "Entry saved securely.")
-        else:
-            QMessageBox.critical(self.main_window, "Error", "Failed to save entry.")
-    
+    def _find_similar_days(self):
+        """Looks for the entries most similar to the text in the editor."""
+        text = self.main_window.entry_editor.toPlainText()
+        if not text.strip():
+            QMessageBox.information(self.main_window, "Similar Days", "Write something first to find similar days.")
+            return
+        is_saved = self._editor_date not in self._unsaved_texts and content_hash(text) == self._saved_hash
+        self._submit_model_job("similar", self._editor_date, self._similar_entries, text, self._editor_date,
+                               is_saved, description="Finding similar days")
+
+    def _similar_entries(self, text, entry_date, is_saved=False):
+        """
+        Ranks the stored entries by similarity to a text. Runs on a worker thread.
+        A saved entry is looked up by its stored embedding. Otherwise the text is
+        embedded in the same pass that scores its mood, so if it was analyzed
+        already, no model work is left.
+
+        Returns:
+            list[tuple[date, float]]: (date, similarity) pairs, most similar first.
+        """
+        if is_saved:
+            results = self.similarity_index.similar_to(entry_date)
+            if results:
+                return results
+        analysis = self.sentiment_analyzer.analyze_chunked(text)
+        if analysis is None or analysis.embedding is None:
+            return []
+        return self.similarity_index.nearest(analysis.embedding, exclude=entry_date)
+
+    def _show_similar_days(self, results):
+        """Lets the user pick one of the similar days and opens it."""
+        if not results:
+            QMessageBox.information(self.main_window, "Similar Days", "No similar entries found yet.")
+            return
+        items = [f"{day:%a, %d %b %Y}  ({similarity:.0%} similar)" for day, similarity in results]
+        choice, ok = QInputDialog.getItem(self.main_window, "Similar Days", "Entries most like this one:",
+                                          items, 0, False)
+        if ok:
+            day = results[items.index(choice)][0]
+            self.main_window.calendar.setSelectedDate(QDate(day.year, day.month, day.day))
+
+    def _on_job_result(self, kind, entry_date, result):
+        """Applies a finished analysis or save to the UI."""
+        is_current = entry_date == self._editor_date
+        if kind == "analyze":
+            if is_current:
+                self._show_mood(*result)
+        elif kind == "similar":
+            if is_current:
+                self._show_similar_days(result)
+        elif kind == "save":
+            success, mood_label, score, text_hash, embedding = result
+            if not success:
+                self._on_save_failed(entry_date, text_hash)
+                return
+            self.similarity_index.update(entry_date, embedding)
+            # A newer save for the same day may already be waiting; keep its text
+            if self._unsaved_texts.get(entry_date, (None, None))[1] == text_hash:
+                text, _ = self._unsaved_texts.pop(entry_date)
+                self.entry_cache.put(entry_date, text, mood_label)
+            if is_current:
+                self._show_mood(mood_label, score)
+                if entry_date not in self._unsaved_texts and self._saved_hash == text_hash:
+                    self.main_window.set_save_status("All changes saved")
+            self._refresh_calendar_marks()
+            self.main_window.status_bar.showMessage(f"Entry for {entry_date:%d %b %Y} saved securely.", 5000)
+
+    def _on_job_error(self, kind, entry_date, message):
+        """Reports a job that raised an exception."""
+        if kind == "save":
+            self._on_save_failed(entry_date, None, message)
+        elif kind == "similar":
+            QMessageBox.warning(self.main_window, "Similar Days", f"Could not search for similar days: {message}")
+        elif entry_date == self._editor_date:
+            self.main_window.mood_label.setText("Mood: Analysis failed.")
+
+    def _on_save_failed(self, entry_date, text_hash, message=None):
+        """Keeps the unsaved text and makes the next autosave try again."""
+        text, pending_hash = self._unsaved_texts.get(entry_date, (None, None))
+        if text is not None and text_hash in (None, pending_hash):
+            # A None hash never matches, so reopening the day retries the save
+            self._unsaved_texts[entry_date] = (text, None)
+        if entry_date == self._editor_date and text_hash in (None, self._saved_hash):
+            self._saved_hash = None
+            self.main_window.set_save_status("Save failed")
+        detail = f": {message}" if message else "."
+        QMessageBox.critical(self.main_window, "Error", f"Failed to save entry{detail}")
+
+    def _on_month_shown(self, year=None, month=None):
+        """Marks the visible month's entries and prefetches it and its neighbours."""
+        calendar = self.main_window.calendar
+        if year is None or month is None:
+            year, month = calendar.yearShown(), calendar.monthShown()
+        self._refresh_calendar_marks(year, month)
+        self.entry_cache.prefetch(year, month)
+
+    def _refresh_calendar_marks(self, year=None, month=None):
+        """Highlights the days with saved entries in the month the calendar is showing."""
+        calendar = self.main_window.calendar
+        if year is None or month is None:
+            year, month = calendar.yearShown(), calendar.monthShown()
+        # Only the visible month is fetched, straight from the covering index
+        entries = self.db_handler.get_month_entries(self.current_user_id, year, month)
+        self.main_window.mark_entry_dates(date.fromisoformat(e['entry_date']) for e in entries)
 
     def _show_stats(self):
-        """Fetches user data and displays the statistics dialog."""
-        all_entries = self.db_handler.get_all_entries_for_user(self.current_user_id)
+        """Fetches pre-aggregated mood data and displays the statistics dialog."""
+        # Use the coarsest rollup period that still gives the line chart a few points,
+        # so the amount of data read grows with months of history, not with entries
+        for period in ("month", "week", "day"):
+            rollups = self.db_handler.get_mood_rollups(self.current_user_id, period)
+            if len({row['period_start'] for row in rollups}) >= STATS_MIN_POINTS:
+                break
         
         # We need at least 2 entries to draw a meaningful line chart
-        if len(all_entries) < 2:
+        if sum(row['entry_count'] for row in rollups) < 2:
             QMessageBox.information(
                 self.main_window, 
                 "Not Enough Data", 
@@ -228,8 +670,11 @@ class MoodVaultApp:
             )
             return
             
+        # Averages of the stored emotion distributions, from the same kind of rollups
+        emotions = self.db_handler.get_emotion_rollups(self.current_user_id, period)
+
         # Create and show the dialog, passing the data to it
-        stats_dialog = StatsDialog(data=all_entries, parent=self.main_window)
+        stats_dialog = StatsDialog(data=rollups, period=period, emotions=emotions, parent=self.main_window)
         stats_dialog.exec_()
     
     def _update_editor_style(self, mood="Neutral"):
@@ -245,7 +690,14 @@ class MoodVaultApp:
         editor.style().unpolish(editor)
         editor.style().polish(editor)
 
+    def shutdown(self):
+        """Releases backend resources before the process exits."""
+        self._end_session()
+
 
 if __name__ == '__main__':
     main_app = MoodVaultApp()
-    main_app.run()
\ No newline at end of file
+    try:
+        main_app.run()
+    finally:
+        main_app.shutdown()
\ No newline at end of file
@@ -0,0 +1,40 @@
+import pytest
+
+import core.db
+from core.rollups import recompute_rollups
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Points every DatabaseHandler at a fresh database file in a temporary directory."""
+    path = tmp_path / "moodvault.db"
+    monkeypatch.setattr(core.db, "get_db_path", lambda: path)
+    return path
+
+@pytest.fixture
+def db_handler(db_path):
+    """An open DatabaseHandler on an empty, fully migrated database."""
+    handler = core.db.DatabaseHandler()
+    yield handler
+    handler.close()
+
+def snapshot_rollups(conn):
+    """Reads both rollup tables in a stable order, with sums rounded for comparison."""
+    mood = conn.execute("""
+    SELECT user_id, period, period_start, sentiment_label, entry_count,
+           ROUND(score_sum, 6), ROUND(score_min, 6), ROUND(score_max, 6)
+    FROM mood_rollups ORDER BY user_id, period, period_start, sentiment_label
+    """).fetchall()
+    emotion = conn.execute("""
+    SELECT user_id, period, period_start, emotion, entry_count, ROUND(score_sum, 4)
+    FROM emotion_rollups ORDER BY user_id, period, period_start, emotion
+    """).fetchall()
+    return mood, emotion
+
+def assert_rollups_match_recompute(db_handler):
+    """Checks the incrementally maintained rollups against a rebuild from the entries table."""
+    with db_handler.pool.connection() as conn:
+        incremental = snapshot_rollups(conn)
+        recompute_rollups(conn.cursor())
+        conn.commit()
+        assert snapshot_rollups(conn) == incremental
+    return incremental
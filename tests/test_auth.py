@@ -0,0 +1,149 @@
+import bcrypt
+import pytest
+
+import core.auth
+import core.kdf
+from core.auth import AuthHandler, _bcrypt_rounds
+from core.encryption import EncryptionHandler, derive_key, generate_salt
+from core.kdf import (
+    KDF, MIN_PBKDF2_ITERATIONS, MIN_SCRYPT_N, PBKDF2KDF, ScryptKDF, calibrate, load_kdf, needs_upgrade,
+    preferred_kdf_class
+)
+
+PASSWORD = "correct horse battery"
+
+@pytest.fixture
+def fast_auth(monkeypatch):
+    """Keeps the real algorithms but at their floor costs, so each test takes well under a second."""
+    monkeypatch.setattr(core.kdf, "_calibration_cache", {})
+    monkeypatch.setattr(core.auth, "BCRYPT_ROUNDS", 5)
+    monkeypatch.setattr(core.auth, "calibrate", lambda: calibrate(target_seconds=1e-6))
+
+@pytest.fixture
+def auth_handler(db_handler, fast_auth):
+    return AuthHandler(db_handler)
+
+def _add_legacy_user(db_handler, username):
+    """An account from before per-user KDF settings: PBKDF2 at the old cost, no wrapped key, cheap bcrypt."""
+    salt = generate_salt()
+    db_handler.add_user(username, bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)), salt)
+    return derive_key(PASSWORD, salt)
+
+@pytest.mark.parametrize("kdf_class, floor", [
+    (PBKDF2KDF, lambda kdf: kdf.iterations == MIN_PBKDF2_ITERATIONS),
+    (ScryptKDF, lambda kdf: kdf.n == MIN_SCRYPT_N),
+])
+def test_calibration_never_goes_below_the_floor(fast_auth, kdf_class, floor):
+    kdf = calibrate(kdf_class, target_seconds=1e-6)
+    assert kdf.meets_minimum() and floor(kdf)
+
+def test_calibration_scales_with_the_target(fast_auth):
+    cheap = calibrate(PBKDF2KDF, target_seconds=1e-6)
+    costly = calibrate(PBKDF2KDF, target_seconds=5.0)
+    assert costly.iterations > cheap.iterations
+    # Cached per process and target
+    assert calibrate(PBKDF2KDF, target_seconds=5.0) is costly
+
+def test_scrypt_cost_stays_a_power_of_two():
+    n = ScryptKDF(2 ** 14).scaled(37.5).n
+    assert n & (n - 1) == 0 and n >= MIN_SCRYPT_N
+
+def test_kdf_record_round_trip():
+    kdf = ScryptKDF(2 ** 18, r=8, p=2)
+    assert load_kdf(kdf.to_record()) == kdf
+    assert load_kdf(None) == PBKDF2KDF(core.kdf.LEGACY_PBKDF2_ITERATIONS)
+    with pytest.raises(ValueError):
+        load_kdf('{"algorithm": "md5-crypt"}')
+
+def test_weak_or_outdated_kdfs_need_an_upgrade():
+    assert needs_upgrade(load_kdf(None))
+    assert not needs_upgrade(preferred_kdf_class()())
+    if preferred_kdf_class() is not PBKDF2KDF:
+        assert needs_upgrade(PBKDF2KDF(10 * MIN_PBKDF2_ITERATIONS))
+
+def test_incomplete_kdf_cannot_be_created():
+    class HalfDone(KDF):
+        name = "half-done"
+        def derive(self, password, salt):
+            return b""
+    with pytest.raises(TypeError):
+        HalfDone()
+
+def test_register_then_unlock(auth_handler):
+    assert auth_handler.register_user("alice", PASSWORD)[0]
+    assert auth_handler.unlock("alice", PASSWORD)[0]
+    record = auth_handler.db_handler.get_user_key_material("alice")
+    assert record["wrapped_key"] is not None
+    assert load_kdf(record["kdf_params"]).name == preferred_kdf_class().name
+    assert auth_handler.unlock("alice", "wrong password")[:2] == (False, "Invalid username or password.")
+    assert auth_handler.unlock("nobody", PASSWORD)[:2] == (False, "Invalid username or password.")
+
+def test_registration_rejects_short_passwords_and_duplicates(auth_handler):
+    assert not auth_handler.register_user("alice", "short")[0]
+    assert auth_handler.register_user("alice", PASSWORD)[0]
+    assert not auth_handler.register_user("alice", PASSWORD)[0]
+
+def test_unlock_upgrades_a_legacy_account_in_place(auth_handler, monkeypatch):
+    legacy_key = _add_legacy_user(auth_handler.db_handler, "bob")
+    token = EncryptionHandler(legacy_key).encrypt("written years ago")
+
+    success, _, key = auth_handler.unlock("bob", PASSWORD)
+    assert success and key == legacy_key
+    record = auth_handler.db_handler.get_user_key_material("bob")
+    assert record["wrapped_key"] is not None
+    assert not needs_upgrade(load_kdf(record["kdf_params"]))
+    assert _bcrypt_rounds(record["password_hash"]) == core.auth.BCRYPT_ROUNDS
+
+    # The next unlock finds nothing to upgrade and recovers the same data key
+    upgrades = []
+    monkeypatch.setattr(auth_handler, "_store_key_material", lambda *args: upgrades.append(args))
+    success, _, key = auth_handler.unlock("bob", PASSWORD)
+    assert success and key == legacy_key and not upgrades
+    assert EncryptionHandler(key).decrypt(token) == "written years ago"
+
+def test_raised_bcrypt_cost_is_applied_on_unlock(auth_handler, monkeypatch):
+    auth_handler.register_user("alice", PASSWORD)
+    monkeypatch.setattr(core.auth, "BCRYPT_ROUNDS", 6)
+    assert auth_handler.unlock("alice", PASSWORD)[0]
+    assert _bcrypt_rounds(auth_handler.db_handler.get_user_key_material("alice")["password_hash"]) == 6
+
+def test_change_password_rewraps_the_same_data_key(auth_handler, db_handler):
+    auth_handler.register_user("alice", PASSWORD)
+    _, _, data_key = auth_handler.unlock("alice", PASSWORD)
+    user_id = db_handler.get_user_id("alice")
+    db_handler.add_or_update_entry(user_id, "2024-05-01", EncryptionHandler(data_key).encrypt("before"), "Joy", 0.9)
+    with db_handler.pool.connection() as conn:
+        entries_before = conn.execute("SELECT encrypted_entry FROM entries").fetchall()
+    before = db_handler.get_user_key_material("alice")
+
+    assert auth_handler.change_password("alice", PASSWORD, "a brand new secret") == (
+        True, "Your master password has been changed."
+    )
+    after = db_handler.get_user_key_material("alice")
+    assert after["wrapped_key"] != before["wrapped_key"]
+    assert after["encryption_salt"] != before["encryption_salt"]
+    # Entries are not re-encrypted
+    with db_handler.pool.connection() as conn:
+        assert conn.execute("SELECT encrypted_entry FROM entries").fetchall() == entries_before
+
+    assert not auth_handler.unlock("alice", PASSWORD)[0]
+    success, _, key = auth_handler.unlock("alice", "a brand new secret")
+    assert success and key == data_key
+    blob, _ = db_handler.get_entry_by_date(user_id, "2024-05-01")
+    assert EncryptionHandler(key).decrypt(blob) == "before"
+
+def test_change_password_of_a_legacy_account_keeps_its_key(auth_handler):
+    legacy_key = _add_legacy_user(auth_handler.db_handler, "bob")
+    assert auth_handler.change_password("bob", PASSWORD, "a brand new secret")[0]
+    assert auth_handler.unlock("bob", "a brand new secret")[2] == legacy_key
+
+@pytest.mark.parametrize("current, new, message", [
+    ("wrong password", "a brand new secret", "Current password is incorrect."),
+    (PASSWORD, "short", "Your new master password must be at least 8 characters long."),
+])
+def test_rejected_password_change_keeps_the_old_password(auth_handler, current, new, message):
+    auth_handler.register_user("alice", PASSWORD)
+    before = auth_handler.db_handler.get_user_key_material("alice")
+    assert auth_handler.change_password("alice", current, new) == (False, message)
+    assert auth_handler.db_handler.get_user_key_material("alice") == before
+    assert auth_handler.unlock("alice", PASSWORD)[0]
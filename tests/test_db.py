@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+
+import pytest
+
+from core.db import CheckpointScheduler, ConnectionPool, DEFAULT_STORAGE_PROFILE, StorageProfile
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(tmp_path / "pool.db", max_size=2, timeout=0.2)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE notes (body TEXT)")
+        conn.commit()
+    yield pool
+    pool.close()
+
+def _in_thread(fn):
+    """Runs fn on another thread and returns its result or raises its exception."""
+    outcome = {}
+    def target():
+        try:
+            outcome["value"] = fn()
+        except Exception as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+def test_connection_is_reused_between_checkouts(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+
+def test_nested_checkout_shares_the_outer_connection(pool):
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+
+def test_threads_get_their_own_connections(pool):
+    with pool.connection() as mine:
+        def checkout():
+            with pool.connection() as theirs:
+                return theirs
+        assert _in_thread(checkout) is not mine
+
+def test_checkout_times_out_when_the_pool_is_exhausted(pool):
+    held = threading.Event()
+    release = threading.Event()
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with pool.connection():
+            # Both slots in use: this thread's and the holder's
+            with pytest.raises(sqlite3.OperationalError, match="Timed out"):
+                _in_thread(lambda: pool.connection().__enter__())
+    finally:
+        release.set()
+        thread.join()
+
+def test_open_transaction_is_rolled_back_on_release(pool):
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO notes VALUES ('never committed')")
+        assert conn.in_transaction
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+
+def test_failed_block_does_not_leak_its_writes(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO notes VALUES ('half done')")
+            raise RuntimeError("interrupted")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+
+def test_close_drops_idle_connections_and_reopens_lazily(pool):
+    with pool.connection() as old:
+        pass
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        old.execute("SELECT 1")
+    with pool.connection() as new:
+        assert new is not old
+        assert new.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+
+def test_connection_in_use_at_close_is_not_reused(pool):
+    with pool.connection() as busy:
+        pool.close()
+    with pool.connection() as conn:
+        assert conn is not busy
+
+def test_default_profile_is_applied_to_every_connection(tmp_path):
+    pool = ConnectionPool(tmp_path / "profile.db")
+    try:
+        with pool.connection() as conn:
+            pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("cache_size") == DEFAULT_STORAGE_PROFILE.cache_size
+            assert pragma("temp_store") == 2  # MEMORY
+            assert pragma("wal_autocheckpoint") == DEFAULT_STORAGE_PROFILE.wal_autocheckpoint
+            assert pragma("journal_size_limit") == DEFAULT_STORAGE_PROFILE.journal_size_limit
+            assert pragma("foreign_keys") == 1
+    finally:
+        pool.close()
+
+def test_custom_profile_is_applied(tmp_path):
+    pool = ConnectionPool(tmp_path / "profile.db", profile=StorageProfile(journal_mode="DELETE", synchronous="FULL"))
+    try:
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    finally:
+        pool.close()
+
+@pytest.mark.parametrize("field, value", [
+    ("journal_mode", "WAL; DROP TABLE users"),
+    ("synchronous", "SOMETIMES"),
+    ("temp_store", "DISK"),
+    ("cache_size", "16MB"),
+])
+def test_invalid_profile_is_rejected(field, value):
+    with pytest.raises(ValueError):
+        StorageProfile(**{field: value})
+
+def test_checkpointer_does_not_run_outside_wal(tmp_path):
+    pool = ConnectionPool(tmp_path / "profile.db", profile=StorageProfile(journal_mode="DELETE"))
+    scheduler = CheckpointScheduler(pool)
+    scheduler.ensure_started()
+    assert not scheduler.running
+    pool.close()
+
+def test_checkpointer_truncates_the_wal_when_stopped(pool):
+    scheduler = CheckpointScheduler(pool, interval=60)
+    scheduler.ensure_started()
+    assert scheduler.running
+    with pool.connection() as conn:
+        conn.executemany("INSERT INTO notes VALUES (?)", [("x" * 1000,)] * 200)
+        conn.commit()
+    wal = pool.db_path.with_name(pool.db_path.name + "-wal")
+    assert wal.stat().st_size > 0
+    busy, _, _ = scheduler.checkpoint("PASSIVE")
+    assert busy == 0
+    scheduler.stop()
+    assert not scheduler.running
+    assert wal.stat().st_size == 0
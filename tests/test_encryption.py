@@ -0,0 +1,105 @@
+import pytest
+
+import core.encryption
+from core.encryption import (
+    EncryptionHandler, generate_data_key, ENVELOPE_MAGIC, ENVELOPE_VERSION, FLAG_ZLIB, FLAG_ZSTD,
+    COMPRESSION_MIN_BYTES
+)
+
+# Long and repetitive enough that every compressor shrinks it.
+LONG_TEXT = "Walked to the park and sat by the pond for a while. " * 40
+
+@pytest.fixture
+def handler():
+    return EncryptionHandler(generate_data_key())
+
+def _flags(token):
+    assert token[:2] == ENVELOPE_MAGIC
+    assert token[2] == ENVELOPE_VERSION
+    return token[3]
+
+def test_short_text_is_stored_uncompressed(handler):
+    text = "A quiet day."
+    assert len(text) < COMPRESSION_MIN_BYTES
+    token = handler.encrypt(text)
+    assert _flags(token) == 0
+    assert handler.decrypt(token) == text
+
+def test_zlib_envelope_round_trip(handler, monkeypatch):
+    monkeypatch.setattr(core.encryption, "zstandard", None)
+    token = handler.encrypt(LONG_TEXT)
+    assert _flags(token) == FLAG_ZLIB
+    assert len(token) < len(LONG_TEXT)
+    assert handler.decrypt(token) == LONG_TEXT
+
+def test_zstd_envelope_round_trip(handler):
+    pytest.importorskip("zstandard")
+    token = handler.encrypt(LONG_TEXT)
+    assert _flags(token) == FLAG_ZSTD
+    assert handler.decrypt(token) == LONG_TEXT
+
+def test_uncompressed_bytes_round_trip(handler):
+    data = bytes(range(256)) * 4
+    token = handler.encrypt_bytes(data, compress=False)
+    assert _flags(token) == 0
+    assert handler.decrypt_bytes(token) == data
+
+def test_legacy_fernet_token_decrypts(handler):
+    legacy = handler.fernet.encrypt("Written before the envelope existed.".encode("utf-8"))
+    assert legacy[:2] != ENVELOPE_MAGIC
+    assert handler.decrypt(legacy) == "Written before the envelope existed."
+
+def test_tampered_envelope_is_rejected(handler):
+    token = bytearray(handler.encrypt("Do not change me."))
+    token[-1] ^= 0x01
+    assert handler.decrypt(bytes(token)) is None
+
+def test_header_is_authenticated(handler, monkeypatch):
+    monkeypatch.setattr(core.encryption, "zstandard", None)
+    token = bytearray(handler.encrypt(LONG_TEXT))
+    # Claiming "uncompressed" must not hand back the compressed bytes
+    token[3] = 0
+    assert handler.decrypt(bytes(token)) is None
+
+def test_other_key_cannot_decrypt(handler):
+    token = handler.encrypt("Private.")
+    assert EncryptionHandler(generate_data_key()).decrypt(token) is None
+
+@pytest.mark.parametrize("workers, chunk_size", [(1, 64), (4, 1), (4, 7)])
+def test_encrypt_many_and_decrypt_many_keep_input_order(handler, workers, chunk_size):
+    texts = [f"entry {i} " * (i % 50) for i in range(200)]
+    tokens = [result.value for result in handler.encrypt_many(texts, workers=workers, chunk_size=chunk_size)]
+    results = list(handler.decrypt_many(tokens, workers=workers, chunk_size=chunk_size))
+    assert [result.index for result in results] == list(range(len(texts)))
+    assert [result.value for result in results] == texts
+
+def test_decrypt_many_reads_both_formats(handler, monkeypatch):
+    monkeypatch.setattr(core.encryption, "zstandard", None)
+    texts = ["short", LONG_TEXT, "legacy entry"]
+    tokens = [handler.encrypt(texts[0]), handler.encrypt(texts[1]), handler.fernet.encrypt(texts[2].encode("utf-8"))]
+    assert [result.value for result in handler.decrypt_many(tokens, workers=2, chunk_size=1)] == texts
+
+def test_decrypt_many_reports_failures_per_item(handler):
+    other = EncryptionHandler(generate_data_key())
+    tokens = [handler.encrypt("mine"), other.encrypt("not mine"), b"MV\x01\x00garbage", handler.encrypt("also mine")]
+    results = list(handler.decrypt_many(tokens, workers=2, chunk_size=1))
+    assert [result.value for result in results] == ["mine", None, None, "also mine"]
+    assert [type(result.error).__name__ for result in results] == ["NoneType", "InvalidToken", "InvalidToken", "NoneType"]
+
+def test_decrypt_many_binary(handler):
+    data = [bytes([i]) * 300 for i in range(5)]
+    tokens = [handler.encrypt_bytes(item) for item in data]
+    assert [result.value for result in handler.decrypt_many(tokens, binary=True)] == data
+
+def test_batch_apis_consume_input_lazily(handler):
+    consumed = []
+    def texts():
+        for i in range(1000):
+            consumed.append(i)
+            yield f"entry {i}"
+    results = handler.encrypt_many(texts(), workers=2, chunk_size=10)
+    first = next(results)
+    assert first.index == 0 and first.error is None
+    # Only a bounded window of chunks is read ahead
+    assert len(consumed) <= 2 * 2 * 10 + 10
+    results.close()
@@ -0,0 +1,89 @@
+import datetime
+import threading
+
+import pytest
+
+from core.encryption import EncryptionHandler, generate_data_key
+from core.entry_cache import EntryCache
+
+MARCH = [datetime.date(2024, 3, day) for day in (1, 5, 9, 20)]
+
+@pytest.fixture
+def cache(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    user_id = db_handler.get_user_id("alice")
+    enc_handler = EncryptionHandler(generate_data_key())
+    for day in MARCH:
+        db_handler.add_or_update_entry(user_id, day, enc_handler.encrypt(f"{day} stored"), "Joy", 0.8)
+    cache = EntryCache(db_handler, enc_handler, user_id)
+    yield cache
+    cache.close()
+
+def test_prefetched_month_is_answered_from_memory(cache):
+    assert cache.get(MARCH[0]) == (False, None, None)
+    cache.prefetch(2024, 3).result()
+    assert cache.get(MARCH[1]) == (True, f"{MARCH[1]} stored", "Joy")
+    # Days without an entry are known too
+    assert cache.get(datetime.date(2024, 3, 2)) == (True, None, None)
+    assert cache.get(datetime.date(2024, 2, 10)) == (True, None, None)
+    assert cache.prefetch(2024, 3) is None
+
+def test_invalidate_forgets_the_day_and_its_month(cache):
+    cache.prefetch(2024, 3, neighbours=0).result()
+    cache.invalidate(MARCH[0])
+    assert cache.get(MARCH[0]) == (False, None, None)
+    assert cache.get(datetime.date(2024, 3, 2)) == (False, None, None)
+    assert cache.get(MARCH[1])[0]
+
+def test_stale_prefetch_does_not_overwrite_a_newer_write(cache, monkeypatch):
+    reading = threading.Event()
+    written = threading.Event()
+    query = cache.db_handler.get_entry_blobs_between
+    def slow_query(*args):
+        rows = query(*args)
+        reading.set()
+        written.wait(5)
+        return rows
+    monkeypatch.setattr(cache.db_handler, "get_entry_blobs_between", slow_query)
+
+    future = cache.prefetch(2024, 3, neighbours=0)
+    reading.wait(5)
+    cache.put(MARCH[0], "edited meanwhile", "Fear")
+    written.set()
+    future.result()
+    assert cache.get(MARCH[0]) == (True, "edited meanwhile", "Fear")
+    assert cache.get(MARCH[1]) == (True, f"{MARCH[1]} stored", "Joy")
+
+def test_invalidation_during_a_prefetch_keeps_the_month_incomplete(cache, monkeypatch):
+    reading = threading.Event()
+    invalidated = threading.Event()
+    query = cache.db_handler.get_entry_blobs_between
+    def slow_query(*args):
+        rows = query(*args)
+        reading.set()
+        invalidated.wait(5)
+        return rows
+    monkeypatch.setattr(cache.db_handler, "get_entry_blobs_between", slow_query)
+
+    future = cache.prefetch(2024, 3, neighbours=0)
+    reading.wait(5)
+    # E.g. a day that gained an entry after the query ran
+    cache.invalidate(datetime.date(2024, 3, 2))
+    invalidated.set()
+    future.result()
+    assert cache.get(datetime.date(2024, 3, 2)) == (False, None, None)
+
+def test_eviction_forgets_that_the_month_was_complete(cache):
+    cache.max_size = 3
+    cache.prefetch(2024, 3, neighbours=0).result()
+    # Four entries do not fit, so the month is never marked complete
+    assert cache.get(datetime.date(2024, 3, 2)) == (False, None, None)
+    assert cache.get(MARCH[0]) == (False, None, None)
+    assert cache.get(MARCH[3])[0]
+
+    cache.max_size = 4
+    cache.prefetch(2024, 3, neighbours=0).result()
+    assert cache.get(datetime.date(2024, 3, 2))[0]
+    cache.put(datetime.date(2024, 4, 1), "April", "Joy")
+    # Evicting the least recently used March entry drops March's completeness
+    assert cache.get(datetime.date(2024, 3, 2)) == (False, None, None)
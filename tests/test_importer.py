@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+from core.encryption import EncryptionHandler, generate_data_key
+from core.importer import EntryImporter
+from core.sentiment import ChunkedAnalysis
+from tests.conftest import assert_rollups_match_recompute
+
+FIRST_DAY = datetime.date(2024, 1, 25)
+
+class FakeAnalyzer:
+    """Scores every text as Joy and records what it was asked to score."""
+    scoring_version = "fake-v1"
+
+    def __init__(self):
+        self.scored = []
+
+    def analyze_chunked_batch(self, texts):
+        self.scored.extend(texts)
+        return [ChunkedAnalysis("Joy", 0.75, {"joy": 0.75, "neutral": 0.25}, {}, [], None) for _ in texts]
+
+def _history(count, fail_at=None):
+    """Yields (date, text) pairs, raising at item `fail_at` like an interrupted read."""
+    for i in range(count):
+        if i == fail_at:
+            raise OSError("export file went away")
+        yield FIRST_DAY + datetime.timedelta(days=i), f"day {i}"
+
+@pytest.fixture
+def importer(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    enc_handler = EncryptionHandler(generate_data_key())
+    return EntryImporter(db_handler, enc_handler, FakeAnalyzer(), db_handler.get_user_id("alice"))
+
+def _stored_dates(importer):
+    with importer.db_handler.pool.connection() as conn:
+        rows = conn.execute("SELECT entry_date FROM entries WHERE user_id = ? ORDER BY entry_date",
+                            (importer.user_id,)).fetchall()
+    return [row[0] for row in rows]
+
+def test_import_writes_every_entry_in_chunks(importer):
+    progress = []
+    result = importer.add_or_update_entries(_history(10), chunk_size=4, progress_callback=progress.append)
+    assert (result.processed, result.written, result.chunks) == (10, 10, 3)
+    assert [p.processed for p in progress] == [4, 8, 10]
+    assert len(_stored_dates(importer)) == 10
+    blob, mood = importer.db_handler.get_entry_by_date(importer.user_id, FIRST_DAY)
+    assert importer.enc_handler.decrypt(blob) == "day 0" and mood == "Joy"
+
+def test_interrupted_import_resumes_after_the_last_committed_chunk(importer):
+    with pytest.raises(OSError):
+        importer.add_or_update_entries(_history(10, fail_at=7), job_id="export.json", chunk_size=3)
+    # Items 0-5 were committed in two chunks; the chunk holding item 6 was never written
+    assert importer.db_handler.get_import_checkpoint(importer.user_id, "export.json") == 6
+    assert len(_stored_dates(importer)) == 6
+
+    importer.sentiment_analyzer.scored.clear()
+    result = importer.add_or_update_entries(_history(10), job_id="export.json", chunk_size=3)
+    assert (result.processed, result.written) == (10, 4)
+    # Only the items after the checkpoint were scored again
+    assert importer.sentiment_analyzer.scored == [f"day {i}" for i in range(6, 10)]
+    assert len(_stored_dates(importer)) == 10
+    assert importer.db_handler.get_import_checkpoint(importer.user_id, "export.json") == 0
+
+def test_empty_entries_are_skipped(importer):
+    entries = [(FIRST_DAY, "written"), (FIRST_DAY + datetime.timedelta(days=1), "   ")]
+    result = importer.add_or_update_entries(entries)
+    assert (result.processed, result.written) == (2, 1)
+    assert len(_stored_dates(importer)) == 1
+
+def test_invalid_chunk_size_is_rejected(importer):
+    with pytest.raises(ValueError):
+        importer.add_or_update_entries(_history(1), chunk_size=0)
+
+def test_bulk_writes_keep_rollups_in_step(importer):
+    db_handler = importer.db_handler
+    db_handler.add_or_update_entry(importer.user_id, FIRST_DAY, b"old", "Sadness", 0.4)
+    db_handler.add_or_update_entry(importer.user_id, datetime.date(2023, 6, 1), b"untouched", "Fear", 0.6)
+    # Replaces one entry and spans a month boundary and a gap of several months
+    importer.add_or_update_entries(_history(10), chunk_size=4)
+    db_handler.add_or_update_entries(importer.user_id, [
+        (datetime.date(2024, 9, 30), b"bulk", "Anger", 0.6, None, None, None),
+    ])
+    mood, _ = assert_rollups_match_recompute(db_handler)
+    assert sum(row[4] for row in mood if row[1] == "month") == 12
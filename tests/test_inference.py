@@ -0,0 +1,28 @@
+import pytest
+
+from core.inference import BACKEND_ENV_VAR, DEFAULT_BACKEND, InferenceBackend, OnnxBackend, create_backend
+from core.sentiment import MODEL_ID, SentimentAnalyzer
+
+def test_backend_is_chosen_from_the_environment(monkeypatch):
+    monkeypatch.setenv(BACKEND_ENV_VAR, "onnx")
+    assert isinstance(create_backend(None, MODEL_ID), OnnxBackend)
+    monkeypatch.delenv(BACKEND_ENV_VAR)
+    assert create_backend(None, MODEL_ID).name == DEFAULT_BACKEND
+
+def test_unknown_backend_in_the_environment_falls_back_to_the_default(monkeypatch, capsys):
+    monkeypatch.setenv(BACKEND_ENV_VAR, "tensorrt")
+    analyzer = SentimentAnalyzer()
+    assert analyzer.backend.name == DEFAULT_BACKEND
+    assert "unknown inference backend 'tensorrt'" in capsys.readouterr().out
+
+def test_unknown_backend_passed_explicitly_is_rejected():
+    with pytest.raises(ValueError):
+        create_backend("tensorrt", MODEL_ID)
+
+def test_incomplete_backend_cannot_be_created():
+    class LoadOnly(InferenceBackend):
+        name = "load-only"
+        def load(self):
+            pass
+    with pytest.raises(TypeError):
+        LoadOnly(MODEL_ID)
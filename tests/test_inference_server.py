@@ -0,0 +1,80 @@
+import os
+import socket
+import sys
+import threading
+import types
+
+import pytest
+
+import core.inference_server
+from core.inference_server import (
+    MAX_MESSAGE_BYTES, TRUSTED_USER_ENV_VAR, RemoteBackend, check_server_trusted, recv_message, send_message
+)
+from core.sentiment import MODEL_ID
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    yield left, right
+    left.close()
+    right.close()
+
+def test_messages_are_framed_by_length(pair):
+    left, right = pair
+    for payload in (b"", b"first", b"\x00" * 100_000):
+        sender = threading.Thread(target=send_message, args=(left, payload))
+        sender.start()
+        assert recv_message(right) == payload
+        sender.join()
+    left.close()
+    assert recv_message(right) is None
+
+def test_oversized_message_is_rejected_before_it_is_read(pair):
+    left, right = pair
+    left.sendall(core.inference_server._LENGTH.pack(MAX_MESSAGE_BYTES + 1))
+    with pytest.raises(ValueError):
+        recv_message(right)
+
+def test_server_of_the_same_user_is_trusted(pair, monkeypatch):
+    monkeypatch.delenv(TRUSTED_USER_ENV_VAR, raising=False)
+    check_server_trusted(pair[0], None)
+
+def test_server_of_another_user_is_trusted_only_when_named(pair, monkeypatch):
+    real_uid = os.getuid()
+    monkeypatch.delenv(TRUSTED_USER_ENV_VAR, raising=False)
+    monkeypatch.setattr(core.inference_server.os, "getuid", lambda: real_uid + 1)
+    with pytest.raises(PermissionError):
+        check_server_trusted(pair[0], None)
+    monkeypatch.setenv(TRUSTED_USER_ENV_VAR, str(real_uid))
+    check_server_trusted(pair[0], None)
+    monkeypatch.setenv(TRUSTED_USER_ENV_VAR, "no-such-user-here")
+    with pytest.raises(ValueError):
+        check_server_trusted(pair[0], None)
+
+def test_failed_tokenizer_load_leaves_the_backend_unloaded(tmp_path, monkeypatch):
+    path = str(tmp_path / "inference.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    def answer_hello():
+        conn, _ = listener.accept()
+        with conn:
+            recv_message(conn)
+            send_message(conn, b'{"model_id": "%s", "labels": ["joy"]}' % MODEL_ID.encode())
+            recv_message(conn)  # Wait for the client to hang up
+    server = threading.Thread(target=answer_hello)
+    server.start()
+
+    def from_pretrained(model_id):
+        raise OSError("no network")
+    transformers = types.SimpleNamespace(AutoTokenizer=types.SimpleNamespace(from_pretrained=from_pretrained))
+    monkeypatch.setitem(sys.modules, "transformers", transformers)
+    backend = RemoteBackend(MODEL_ID, socket_path=path)
+    try:
+        with pytest.raises(OSError, match="no network"):
+            backend.load()
+        assert not backend.is_loaded and not backend.is_remote
+    finally:
+        server.join(timeout=5)
+        listener.close()
+    assert not server.is_alive()
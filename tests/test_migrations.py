@@ -0,0 +1,143 @@
+import datetime
+import sqlite3
+
+import pytest
+
+import core.migrations
+from core.db import ConnectionPool
+from core.migrations import (
+    BACKFILL_MAX_FAILURES, BACKFILLS, BackfillRunner, LATEST_VERSION, _create_baseline_schema, get_schema_version,
+    migrate
+)
+from core.rollups import recompute_rollups
+from core.sentiment import pack_scores
+from tests.conftest import snapshot_rollups
+
+def _create_unversioned_database(path):
+    """Writes a database as the first release left it: two tables, user_version 0, a year of entries."""
+    conn = sqlite3.connect(path)
+    _create_baseline_schema(conn.cursor())
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, encryption_salt) VALUES (?, 'hash', x'00')",
+        [("alice",), ("bob",)]
+    )
+    first_day = datetime.date(2023, 11, 20)
+    conn.executemany("""
+    INSERT INTO entries (user_id, entry_date, encrypted_entry, sentiment_label, sentiment_score)
+    VALUES (?, ?, x'00', ?, ?)
+    """, [
+        (user_id, (first_day + datetime.timedelta(days=day)).isoformat(),
+         ("Joy", "Sadness", "Fear")[day % 3], round(0.4 + (day % 7) / 12, 3))
+        for user_id in (1, 2) for day in range(0, 400, 3)
+    ])
+    conn.commit()
+    assert get_schema_version(conn) == 0
+    conn.close()
+
+@pytest.fixture
+def pool(tmp_path):
+    path = tmp_path / "moodvault.db"
+    _create_unversioned_database(path)
+    pool = ConnectionPool(path)
+    yield pool
+    pool.close()
+
+def _pending_backfills(pool):
+    with pool.connection() as conn:
+        return dict(conn.execute("SELECT name, position FROM migration_backfills WHERE done = 0").fetchall())
+
+def test_migrates_unversioned_database_to_latest(pool):
+    with pool.connection() as conn:
+        assert migrate(conn) == list(range(1, LATEST_VERSION + 1))
+        assert get_schema_version(conn) == LATEST_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 2 * 134
+        # Running again is a no-op
+        assert migrate(conn) == []
+    assert _pending_backfills(pool) == {"emotion_rollups": None, "mood_rollups": None}
+
+def test_newer_schema_is_left_alone(pool):
+    with pool.connection() as conn:
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION + 1}")
+        assert migrate(conn) == []
+        assert get_schema_version(conn) == LATEST_VERSION + 1
+
+def test_backfills_resume_and_match_a_full_recompute(pool, monkeypatch):
+    monkeypatch.setattr(core.migrations, "ROLLUP_BACKFILL_MONTHS", 2)
+    with pool.connection() as conn:
+        migrate(conn)
+        # Entries scored after upgrading, but before the emotion backfill ran
+        conn.execute("UPDATE entries SET sentiment_scores = ? WHERE id % 2 = 0",
+                     (pack_scores({"joy": 0.625, "sadness": 0.25, "neutral": 0.125}),))
+        conn.commit()
+
+    for name in ("mood_rollups", "emotion_rollups"):
+        # Stop after one chunk, as at logout; a new runner continues from the stored position
+        position = BackfillRunner(pool).run_chunk(name, None)
+        assert position is not None
+        assert _pending_backfills(pool)[name] == position
+
+        chunks = 1
+        runner = BackfillRunner(pool)
+        while position is not None:
+            position = runner.run_chunk(name, _pending_backfills(pool)[name])
+            chunks += 1
+        # Two users, each spanning 14 months in two-month chunks
+        assert chunks > 10
+    assert _pending_backfills(pool) == {}
+
+    with pool.connection() as conn:
+        backfilled = snapshot_rollups(conn)
+        recompute_rollups(conn.cursor())
+        conn.commit()
+        assert snapshot_rollups(conn) == backfilled
+    mood, emotion = backfilled
+    assert sum(row[4] for row in mood if row[1] == "month") == 2 * 134
+    assert sum(row[4] for row in emotion if row[1] == "month" and row[3] == "joy") == 134
+
+def _failures(pool, name):
+    with pool.connection() as conn:
+        return conn.execute("SELECT failures FROM migration_backfills WHERE name = ?", (name,)).fetchone()[0]
+
+def _run_once(runner):
+    runner.ensure_started()
+    runner._thread.join()
+
+def test_failing_backfill_is_counted_and_not_restarted(pool):
+    with pool.connection() as conn:
+        migrate(conn)
+        # Sorts after every real date of the first user, so earlier chunks succeed first
+        conn.execute("""
+        INSERT INTO entries (user_id, entry_date, encrypted_entry, sentiment_label, sentiment_score, sentiment_scores)
+        VALUES (1, '2024-13-45', x'00', 'Joy', 0.5, ?)
+        """, (pack_scores({"joy": 1.0}),))
+        conn.commit()
+
+    runner = BackfillRunner(pool, pause=0)
+    _run_once(runner)
+    assert runner.finished
+    # An sqlite3.Error (mood) and a ValueError (emotion) are both counted
+    assert _failures(pool, "mood_rollups") == _failures(pool, "emotion_rollups") == 1
+    # Chunks committed before the bad row are kept for the next attempt
+    assert _pending_backfills(pool)["mood_rollups"].startswith("1,")
+    # Later queries do not start the failing backfills again
+    runner.ensure_started()
+    assert not runner.running and _failures(pool, "mood_rollups") == 1
+
+def test_backfill_is_given_up_after_repeated_failures(pool, monkeypatch):
+    with pool.connection() as conn:
+        migrate(conn)
+    calls = []
+    def broken(cursor, position):
+        calls.append(position)
+        cursor.execute("UPDATE entries SET sentiment_label = 'Broken'")
+        raise ValueError("bad stored date")
+    monkeypatch.setitem(BACKFILLS, "mood_rollups", broken)
+
+    # One attempt per app start
+    for _ in range(BACKFILL_MAX_FAILURES + 2):
+        _run_once(BackfillRunner(pool, pause=0))
+    assert len(calls) == BACKFILL_MAX_FAILURES
+    assert _failures(pool, "mood_rollups") == BACKFILL_MAX_FAILURES
+    with pool.connection() as conn:
+        # Each failed chunk was rolled back
+        assert conn.execute("SELECT COUNT(*) FROM entries WHERE sentiment_label = 'Broken'").fetchone()[0] == 0
@@ -0,0 +1,120 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import core.rescore
+from core.encryption import EncryptionHandler, generate_data_key
+from core.jobs import BackgroundBatchJob
+from core.rescore import EntryRescorer
+from core.sentiment import ChunkedAnalysis, pack_scores
+from tests.conftest import assert_rollups_match_recompute
+
+FIRST_DAY = datetime.date(2024, 5, 1)
+NEW_VERSION = "fake-model:v2"
+
+class FakeAnalyzer:
+    """Scores every text as Fear and counts its batches."""
+    scoring_version = NEW_VERSION
+
+    def __init__(self):
+        self.batches = []
+
+    def analyze_chunked_batch(self, texts):
+        self.batches.append(list(texts))
+        return [
+            ChunkedAnalysis("Fear", 0.9, {"fear": 0.9, "neutral": 0.1}, {}, [], np.ones(4, dtype=np.float32) / 2)
+            if text.strip() else None
+            for text in texts
+        ]
+
+@pytest.fixture
+def rescorer(db_handler, monkeypatch):
+    monkeypatch.setattr(core.rescore, "RESCORE_YIELD_PAUSE", 0)
+    db_handler.add_user("alice", b"hash", b"salt")
+    user_id = db_handler.get_user_id("alice")
+    enc_handler = EncryptionHandler(generate_data_key())
+    for i in range(5):
+        db_handler.add_or_update_entry(user_id, FIRST_DAY + datetime.timedelta(days=i), enc_handler.encrypt(f"day {i}"),
+                                       "Joy", 0.7, sentiment_scores=pack_scores({"joy": 0.7, "neutral": 0.3}),
+                                       model_version="fake-model:v1")
+    progress = []
+    rescorer = EntryRescorer(db_handler, enc_handler, FakeAnalyzer(), user_id, batch_size=2, pause=0,
+                             progress_callback=progress.append)
+    rescorer.progress = progress
+    return rescorer
+
+def _versions(rescorer):
+    with rescorer.db_handler.pool.connection() as conn:
+        rows = conn.execute("SELECT model_version, sentiment_label FROM entries ORDER BY entry_date").fetchall()
+    return rows
+
+def test_stale_entries_are_rescored_with_the_new_version(rescorer):
+    db_handler = rescorer.db_handler
+    assert db_handler.count_stale_entries(rescorer.user_id, NEW_VERSION) == 5
+    rescorer.run()
+    assert db_handler.count_stale_entries(rescorer.user_id, NEW_VERSION) == 0
+    assert set(_versions(rescorer)) == {(NEW_VERSION, "Fear")}
+    assert rescorer.rescored == 5 and rescorer.failed == 0
+    assert [len(batch) for batch in rescorer.sentiment_analyzer.batches] == [2, 2, 1]
+    assert [(p.done, p.total, p.finished) for p in rescorer.progress] == [
+        (2, 5, False), (4, 5, False), (5, 5, False), (5, 5, True)
+    ]
+    assert_rollups_match_recompute(db_handler)
+    # Nothing is left for the next run
+    rescorer.run()
+    assert len(rescorer.sentiment_analyzer.batches) == 3
+
+def test_entry_saved_meanwhile_is_not_overwritten(rescorer, monkeypatch):
+    db_handler = rescorer.db_handler
+    day = FIRST_DAY + datetime.timedelta(days=1)
+    get_stale_entries = db_handler.get_stale_entries
+    def save_after_read(*args, **kwargs):
+        rows = get_stale_entries(*args, **kwargs)
+        db_handler.add_or_update_entry(rescorer.user_id, day, rescorer.enc_handler.encrypt("edited"), "Anger", 0.8,
+                                       model_version=NEW_VERSION)
+        return rows
+    monkeypatch.setattr(db_handler, "get_stale_entries", save_after_read)
+    rescorer.run()
+    assert _versions(rescorer)[1] == (NEW_VERSION, "Anger")
+    assert_rollups_match_recompute(db_handler)
+
+def test_unreadable_entries_are_left_stale(rescorer):
+    other = EncryptionHandler(generate_data_key())
+    rescorer.db_handler.add_or_update_entry(rescorer.user_id, FIRST_DAY, other.encrypt("not mine"), "Joy", 0.7)
+    rescorer.run()
+    assert rescorer.rescored == 4 and rescorer.failed == 1
+    assert rescorer.db_handler.count_stale_entries(rescorer.user_id, NEW_VERSION) == 1
+
+def test_rescorer_yields_to_foreground_work(rescorer):
+    checks = []
+    def should_yield():
+        # Busy for the first three checks, as while the user saves an entry
+        checks.append(len(rescorer.sentiment_analyzer.batches))
+        return len(checks) <= 3
+    rescorer.should_yield = should_yield
+    rescorer.run()
+    assert checks[:4] == [0, 0, 0, 0]
+    assert rescorer.rescored == 5
+
+def test_stopping_while_yielding_writes_nothing(rescorer):
+    def should_yield():
+        rescorer._stop_event.set()
+        return True
+    rescorer.should_yield = should_yield
+    rescorer.run()
+    assert not rescorer.sentiment_analyzer.batches
+    assert rescorer.progress[-1].finished is False
+    assert rescorer.db_handler.count_stale_entries(rescorer.user_id, NEW_VERSION) == 5
+
+def test_background_job_runs_and_stops_on_its_thread(rescorer):
+    rescorer.start()
+    rescorer._thread.join(5)
+    rescorer.stop()
+    assert rescorer.rescored == 5
+
+def test_incomplete_job_cannot_be_created():
+    class NoRun(BackgroundBatchJob):
+        pass
+    with pytest.raises(TypeError):
+        NoRun(batch_size=1, pause=0)
@@ -0,0 +1,135 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from core.rollups import period_bounds, rollup_remove
+from core.sentiment import EMOTION_LABELS, SCORE_LABELS, pack_scores
+from tests.conftest import assert_rollups_match_recompute
+
+# Spans a week that crosses a month boundary and two months of the same year.
+DAYS = [datetime.date(2024, 1, 29), datetime.date(2024, 1, 31), datetime.date(2024, 2, 1),
+        datetime.date(2024, 2, 3), datetime.date(2024, 2, 14), datetime.date(2024, 3, 1)]
+
+@pytest.fixture
+def user_id(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    user_id = db_handler.get_user_id("alice")
+    for i, day in enumerate(DAYS):
+        assert db_handler.add_or_update_entry(user_id, day, f"entry {i}".encode(),
+                                              ("Joy", "Sadness")[i % 2], 0.5 + i / 20)
+    return user_id
+
+def _distribution(i):
+    return pack_scores({"joy": 0.5 - i / 20, "sadness": 0.25 + i / 20, "fear": 0.25})
+
+@pytest.fixture
+def scored_user_id(db_handler):
+    """Like user_id, but every entry also stores its full emotion distribution."""
+    db_handler.add_user("bob", b"hash", b"salt")
+    user_id = db_handler.get_user_id("bob")
+    for i, day in enumerate(DAYS):
+        assert db_handler.add_or_update_entry(user_id, day, f"entry {i}".encode(), ("Joy", "Sadness")[i % 2],
+                                              0.5 + i / 20, sentiment_scores=_distribution(i))
+    return user_id
+
+def _delete_entry(db_handler, user_id, day):
+    """Deletes an entry the way a delete API would, backing it out of the rollups."""
+    with db_handler.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+        SELECT sentiment_label, sentiment_score, sentiment_scores FROM entries
+        WHERE user_id = ? AND entry_date = ?
+        """, (user_id, day))
+        previous = cursor.fetchone()
+        cursor.execute("DELETE FROM entries WHERE user_id = ? AND entry_date = ?", (user_id, day))
+        rollup_remove(cursor, user_id, day, *previous)
+        conn.commit()
+
+@pytest.mark.parametrize("period, day, expected", [
+    ("day", "2024-02-29", ("2024-02-29", "2024-02-29")),
+    ("week", "2024-02-29", ("2024-02-26", "2024-03-03")),
+    ("week", "2024-03-03", ("2024-02-26", "2024-03-03")),
+    ("month", "2024-02-10", ("2024-02-01", "2024-02-29")),
+    ("month", "2023-12-31", ("2023-12-01", "2023-12-31")),
+])
+def test_period_bounds(period, day, expected):
+    assert tuple(d.isoformat() for d in period_bounds(period, day)) == expected
+
+def test_unknown_period_is_rejected():
+    with pytest.raises(ValueError):
+        period_bounds("year", "2024-01-01")
+
+def test_added_entries_match_recompute(db_handler, user_id):
+    mood, _ = assert_rollups_match_recompute(db_handler)
+    assert sum(row[4] for row in mood if row[1] == "month") == len(DAYS)
+    # Jan 29 - Feb 4 is one week even though it spans two months
+    week = period_bounds("week", DAYS[0])[0].isoformat()
+    assert sum(row[4] for row in mood if row[1] == "week" and row[2] == week) == 4
+
+def test_rollups_answer_period_queries(db_handler, user_id):
+    january = db_handler.get_mood_rollups(user_id, "month", "2024-01-01", "2024-01-31")
+    assert [(row["sentiment_label"], row["entry_count"]) for row in january] == [("Joy", 1), ("Sadness", 1)]
+    assert january[0]["mean_score"] == pytest.approx(0.5)
+
+def test_replaced_entries_match_recompute(db_handler, user_id):
+    # A new label, a new extreme score, and an entry losing its mood
+    db_handler.add_or_update_entry(user_id, DAYS[1], b"edited", "Fear", 0.99)
+    db_handler.add_or_update_entry(user_id, DAYS[2], b"edited", "Joy", 0.05)
+    db_handler.add_or_update_entry(user_id, DAYS[3], b"edited", None, None)
+    mood, _ = assert_rollups_match_recompute(db_handler)
+    february_joy = [row for row in mood if row[1] == "month" and row[2] == "2024-02-01" and row[3] == "Joy"]
+    assert february_joy[0][6:] == (0.05, 0.7)
+
+def test_deleted_entries_match_recompute(db_handler, user_id):
+    _delete_entry(db_handler, user_id, DAYS[0])
+    _delete_entry(db_handler, user_id, DAYS[5])
+    mood, _ = assert_rollups_match_recompute(db_handler)
+    # March had a single entry; its rows are gone rather than left at zero
+    assert not [row for row in mood if row[2] == "2024-03-01"]
+
+def test_emotion_distributions_are_rolled_up(db_handler, scored_user_id):
+    _, emotion = assert_rollups_match_recompute(db_handler)
+    assert {row[3] for row in emotion} == EMOTION_LABELS
+    february = {row["emotion"]: row for row in db_handler.get_emotion_rollups(scored_user_id, "month",
+                                                                               "2024-02-01", "2024-02-01")}
+    # Days 2-4 of DAYS: joy 0.4, 0.35, 0.3
+    assert february["joy"]["entry_count"] == 3
+    assert february["joy"]["mean_score"] == pytest.approx(0.35, abs=1e-3)
+    assert february["anger"]["mean_score"] == 0
+
+def test_replaced_distributions_match_recompute(db_handler, scored_user_id):
+    # A new distribution, an entry losing its distribution, and one losing its mood
+    db_handler.add_or_update_entry(scored_user_id, DAYS[1], b"edited", "Fear", 0.99,
+                                   sentiment_scores=pack_scores({"fear": 1.0}))
+    db_handler.add_or_update_entry(scored_user_id, DAYS[2], b"edited", "Joy", 0.05)
+    db_handler.add_or_update_entry(scored_user_id, DAYS[3], b"edited", None, None)
+    _, emotion = assert_rollups_match_recompute(db_handler)
+    february_joy = [row for row in emotion if row[1] == "month" and row[2] == "2024-02-01" and row[3] == "joy"]
+    assert february_joy[0][4] == 1
+
+def test_deleted_distributions_match_recompute(db_handler, scored_user_id):
+    _delete_entry(db_handler, scored_user_id, DAYS[5])
+    _, emotion = assert_rollups_match_recompute(db_handler)
+    assert not [row for row in emotion if row[2] == "2024-03-01"]
+
+def test_bulk_written_distributions_match_recompute(db_handler, scored_user_id):
+    assert db_handler.add_or_update_entries(scored_user_id, [
+        (datetime.date(2023, 12, 31), b"bulk", "Joy", 0.8, None, _distribution(1), None),
+        (DAYS[1], b"bulk", "Anger", 0.6, None, None, None),
+        (datetime.date(2025, 6, 2), b"bulk", "Fear", 0.4, None, _distribution(2), None),
+    ])
+    assert_rollups_match_recompute(db_handler)
+
+def test_entry_scores_are_read_without_copies(db_handler, scored_user_id):
+    db_handler.add_or_update_entry(scored_user_id, DAYS[2], b"edited", "Joy", 0.05)
+    rows = db_handler.get_entry_scores_between(scored_user_id, "2024-01-31", "2024-02-14")
+    # The entry without a distribution is left out
+    assert [day for day, _ in rows] == [DAYS[1].isoformat(), DAYS[3].isoformat(), DAYS[4].isoformat()]
+    day, scores = rows[0]
+    assert dict(zip(SCORE_LABELS, scores.tolist()))["sadness"] == pytest.approx(0.3, abs=1e-3)
+    # A view of the fetched blob, not a copy
+    assert isinstance(scores.base, bytes) and not scores.flags.owndata and not scores.flags.writeable
+    assert np.shares_memory(scores, np.frombuffer(scores.base, dtype=scores.dtype))
+    assert db_handler.get_entry_scores_between(scored_user_id, "2030-01-01", "2030-12-31") == []
@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+
+from core.encryption import EncryptionHandler, generate_data_key
+from core.search import MAX_PREFIX_LENGTH, SearchIndex, parse_query
+
+DAY = datetime.date(2024, 6, 1)
+
+ENTRIES = ["Walked to the park, sunny.", "Rainy walk on the beach.", "Stayed in and read."]
+
+@pytest.fixture
+def index(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    return SearchIndex(db_handler, EncryptionHandler(generate_data_key()), db_handler.get_user_id("alice"))
+
+def _save(index, day, text, with_terms=True):
+    index.db_handler.add_or_update_entry(index.user_id, day, index.enc_handler.encrypt(text), "Joy", 0.8,
+                                         term_hashes=index.term_hashes(text) if with_terms else None)
+
+def test_words_are_anded():
+    assert parse_query("park sunny") == [[("word", "park"), ("word", "sunny")]]
+
+def test_explicit_and_is_ignored():
+    assert parse_query("park AND sunny") == parse_query("park sunny")
+
+def test_or_binds_more_loosely_than_and():
+    assert parse_query("walk* AND park OR beach") == [
+        [("prefix", "walk"), ("word", "park")],
+        [("word", "beach")],
+    ]
+
+def test_words_are_case_folded():
+    assert parse_query("Park STRASSE") == [[("word", "park"), ("word", "strasse")]]
+
+def test_lower_case_or_is_a_word():
+    assert parse_query("this or that") == [[("word", "this"), ("word", "or"), ("word", "that")]]
+
+def test_punctuation_splits_words_and_star_applies_to_the_last():
+    assert parse_query("don't walk*") == [[("word", "don"), ("word", "t"), ("prefix", "walk")]]
+    assert parse_query("rock-climb*") == [[("word", "rock"), ("prefix", "climb")]]
+
+def test_long_prefix_is_truncated():
+    prefix = "a" * (MAX_PREFIX_LENGTH + 5)
+    assert parse_query(prefix + "*") == [[("prefix", "a" * MAX_PREFIX_LENGTH)]]
+
+def test_empty_groups_are_dropped():
+    assert parse_query("OR park OR OR !!! OR") == [[("word", "park")]]
+
+def test_short_prefix_is_rejected():
+    with pytest.raises(ValueError, match="at least"):
+        parse_query("park wa*")
+
+@pytest.mark.parametrize("query", ["", "   ", "OR", "AND OR", "?!"])
+def test_query_without_words_is_rejected(query):
+    with pytest.raises(ValueError):
+        parse_query(query)
+
+def test_search_answers_from_the_blind_index(index):
+    for i, text in enumerate(ENTRIES):
+        _save(index, DAY + datetime.timedelta(days=i), text)
+    assert index.search("park") == [DAY]
+    assert index.search("walk") == [DAY + datetime.timedelta(days=1)]
+    assert index.search("walk*") == [DAY, DAY + datetime.timedelta(days=1)]
+    assert index.search("walk* AND sunny OR read") == [DAY, DAY + datetime.timedelta(days=2)]
+    assert index.search("snow") == []
+    # No plaintext word reaches the table
+    with index.db_handler.pool.connection() as conn:
+        stored = b"".join(row[0] for row in conn.execute("SELECT term_hash FROM entry_terms"))
+    assert b"park" not in stored
+
+def test_edits_replace_an_entrys_terms(index):
+    _save(index, DAY, ENTRIES[0])
+    _save(index, DAY, ENTRIES[2])
+    assert index.search("park") == []
+    assert index.search("read") == [DAY]
+
+def test_entries_written_before_the_index_are_backfilled(index):
+    _save(index, DAY, ENTRIES[0], with_terms=False)
+    assert index.search("park") == []
+    assert index.index_entries(batch_size=1) == 1
+    assert index.search("park") == [DAY]
+    assert index.index_entries() == 0
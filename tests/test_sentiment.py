@@ -0,0 +1,79 @@
+import pytest
+
+from core.encryption import EncryptionHandler, generate_data_key
+from core.sentiment import EncryptedSentimentStore, SentimentCache, normalize_text, split_paragraphs
+
+@pytest.mark.parametrize("text, expected", [
+    ("One line.", [(0, "One line.")]),
+    ("  Woke up late.\nMissed the bus.\n", [(2, "Woke up late.\nMissed the bus.")]),
+    ("First.\n\nSecond\nstill second.", [(0, "First."), (8, "Second\nstill second.")]),
+    ("First.\n  \t\n\n  Second.  ", [(0, "First."), (14, "Second.")]),
+    ("First.\r\n\r\nSecond.", [(0, "First."), (10, "Second.")]),
+    (" \n\n ", []),
+])
+def test_paragraphs_are_split_on_blank_lines(text, expected):
+    paragraphs = split_paragraphs(text)
+    assert paragraphs == expected
+    assert all(text[offset:offset + len(paragraph)] == paragraph for offset, paragraph in paragraphs)
+
+def test_normalized_text_keeps_its_paragraphs():
+    text = "  Woke up   late.\nMissed the bus.\n \n\n  Good  coffee though. "
+    assert normalize_text(text) == "Woke up late.\nMissed the bus.\n\nGood coffee though."
+    assert [paragraph for _, paragraph in split_paragraphs(normalize_text(text))] == [
+        "Woke up late.\nMissed the bus.", "Good coffee though."
+    ]
+
+@pytest.fixture
+def store(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    return EncryptedSentimentStore(db_handler, EncryptionHandler(generate_data_key()), db_handler.get_user_id("alice"))
+
+def test_cache_evicts_the_least_recently_used_result():
+    cache = SentimentCache(max_size=2)
+    first, second, third = (cache.key(text) for text in ("first", "second", "third"))
+    cache.put(first, ("Joy", 0.9))
+    cache.put(second, ("Fear", 0.8))
+    assert cache.get(first) == ("Joy", 0.9)
+    cache.put(third, ("Anger", 0.7))
+    assert cache.get(second) is None
+    assert cache.get(first) == ("Joy", 0.9) and cache.get(third) == ("Anger", 0.7)
+
+def test_cache_keys_ignore_spacing_but_not_line_breaks():
+    cache = SentimentCache()
+    assert cache.key("a  good\n  day ") == cache.key("a good\nday")
+    assert cache.key("a good\n \n\n\nday") == cache.key("a good\n\nday")
+    assert cache.key("a good\nday") != cache.key("a good day")
+    assert cache.key("a good\nday") != cache.key("a good\n\nday")
+    assert SentimentCache(normalize=False).key("a  good day") != SentimentCache(normalize=False).key("a good day")
+    assert SentimentCache("model-a").key("same") != SentimentCache("model-b").key("same")
+
+def test_encrypted_tier_is_written_through_and_promoted(store):
+    cache = SentimentCache(max_size=1)
+    cache.attach_store(store)
+    key = cache.key("a quiet evening")
+    cache.put(key, ("Joy", 0.6))
+
+    # Nothing readable is stored: the key is HMAC'd and the result encrypted
+    with store.db_handler.pool.connection() as conn:
+        key_hash, blob = conn.execute("SELECT key_hash, encrypted_result FROM sentiment_cache").fetchone()
+    assert key_hash != key and b"Joy" not in blob
+
+    # A fresh session misses in memory, falls through to disk and promotes the hit
+    restarted = SentimentCache(max_size=1)
+    restarted.attach_store(store)
+    assert restarted.get(key) == ("Joy", 0.6)
+    restarted.store = None
+    assert restarted.get(key) == ("Joy", 0.6)
+
+def test_encrypted_tier_is_unreadable_with_another_key(store):
+    store.save(b"k" * 32, ("Joy", 0.6))
+    other = EncryptedSentimentStore(store.db_handler, EncryptionHandler(generate_data_key()), store.user_id)
+    assert other.load(b"k" * 32) is None
+
+def test_clear_forgets_results_and_detaches_the_tier(store):
+    cache = SentimentCache()
+    cache.attach_store(store)
+    key = cache.key("text")
+    cache.put(key, ("Joy", 0.6))
+    cache.clear()
+    assert cache.store is None and cache.get(key) is None
@@ -0,0 +1,61 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from core.encryption import EncryptionHandler, generate_data_key
+from core.similarity import INITIAL_CAPACITY, SimilarityIndex, pack_embedding
+
+DAY = datetime.date(2024, 4, 1)
+
+def _day(i):
+    return DAY + datetime.timedelta(days=i)
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+# Ordered from closest to farthest from the first axis
+EMBEDDINGS = [_unit(1, 0, 0), _unit(1, 0.1, 0), _unit(1, 0.5, 0), _unit(1, 1, 1), _unit(0, 1, 0), _unit(-1, 0, 0)]
+
+@pytest.fixture
+def index(db_handler):
+    db_handler.add_user("alice", b"hash", b"salt")
+    user_id = db_handler.get_user_id("alice")
+    enc_handler = EncryptionHandler(generate_data_key())
+    for i, embedding in enumerate(EMBEDDINGS):
+        db_handler.add_or_update_entry(user_id, _day(i), enc_handler.encrypt(f"day {i}"), "Joy", 0.8,
+                                       encrypted_embedding=enc_handler.encrypt_bytes(pack_embedding(embedding)))
+    return SimilarityIndex(db_handler, enc_handler, user_id)
+
+def test_nearest_returns_the_top_k_most_similar_first(index):
+    results = index.nearest([1, 0, 0], k=3)
+    assert [day for day, _ in results] == [_day(0), _day(1), _day(2)]
+    assert results[0][1] == pytest.approx(1.0, abs=1e-3)
+    similarities = [similarity for _, similarity in index.nearest([1, 0, 0], k=100)]
+    assert len(similarities) == len(EMBEDDINGS) and similarities == sorted(similarities, reverse=True)
+
+def test_similar_to_leaves_out_the_day_itself(index):
+    results = index.similar_to(_day(0), k=2)
+    assert [day for day, _ in results] == [_day(1), _day(2)]
+    assert len(index.similar_to(_day(0), k=100)) == len(EMBEDDINGS) - 1
+    assert index.similar_to(_day(99)) == []
+
+def test_nearest_can_exclude_a_day(index):
+    assert [day for day, _ in index.nearest([1, 0, 0], k=2, exclude=_day(1))] == [_day(0), _day(2)]
+    assert index.nearest([1, 0, 0], k=0) == []
+    # A query from another model cannot be compared
+    assert index.nearest([1, 0, 0, 0]) == []
+
+def test_updates_replace_and_grow_the_index(index):
+    index.update(_day(5), _unit(1, 0, 0.01))
+    assert index.nearest([1, 0, 0], k=2)[1][0] == _day(5)
+    for i in range(len(EMBEDDINGS), INITIAL_CAPACITY + 10):
+        index.update(_day(i), _unit(0, 0, 1))
+    assert len(index) == INITIAL_CAPACITY + 10
+    assert index.nearest([1, 0, 0], k=1)[0][0] == _day(0)
+
+def test_updates_made_before_loading_are_kept(index):
+    index.update(_day(0), _unit(0, 0, 1))
+    assert not index.is_loaded
+    assert index.nearest([0, 0, 1], k=1)[0][0] == _day(0)
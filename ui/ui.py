@@ -42,10 +42,12 @@ class MainWindow(QMainWindow):
         # We create the actions as instance attributes so we can connect them later
         self.save_action = QAction("Save Entry", self)
         self.analyze_action = QAction("Analyze Mood", self)
+        self.similar_action = QAction("Similar Days", self)
         self.stats_action = QAction("View Stats", self)
         
         toolbar.addAction(self.save_action)
         toolbar.addAction(self.analyze_action)
+        toolbar.addAction(self.similar_action)
         toolbar.addSeparator()
         toolbar.addAction(self.stats_action)
          # --- ADD THE FOLLOWING ---
@@ -54,6 +56,10 @@ class MainWindow(QMainWindow):
         spacer.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         toolbar.addWidget(spacer)
 
+        # Account actions
+        self.change_password_action = QAction("Change Password", self)
+        toolbar.addAction(self.change_password_action)
+
         # Logout action
         self.logout_action = QAction("Logout", self)
         toolbar.addAction(self.logout_action)
@@ -88,6 +94,9 @@ class MainWindow(QMainWindow):
         # Add the calendar widget (left side) and the editor layout (right side)
         self.main_layout.addWidget(self.calendar)
         self.main_layout.addLayout(self.editor_layout) # This line was accidentally duplicated before
+
+        # Dates currently highlighted as having a saved entry
+        self._marked_dates = []
     # Add this entire method inside the MainWindow class in ui/ui.py
     
     def _style_calendar_weekends(self):
@@ -102,12 +111,56 @@ class MainWindow(QMainWindow):
         self.calendar.setWeekdayTextFormat(Qt.Saturday, weekend_format)
         self.calendar.setWeekdayTextFormat(Qt.Sunday, weekend_format)
 
+    def mark_entry_dates(self, dates):
+        """
+        Highlights the calendar days that have a saved entry.
+
+        Args:
+            dates (Iterable[datetime.date]): The days with entries in the visible month.
+        """
+        # Clear the previous month's highlights
+        for qdate in self._marked_dates:
+            self.calendar.setDateTextFormat(qdate, QTextCharFormat())
+
+        entry_format = QTextCharFormat()
+        entry_format.setForeground(QColor("#D4AF37")) # Golden accent
+        font = QFont()
+        font.setBold(True)
+        entry_format.setFont(font)
+
+        self._marked_dates = [QDate(d.year, d.month, d.day) for d in dates]
+        for qdate in self._marked_dates:
+            self.calendar.setDateTextFormat(qdate, entry_format)
+
     def _create_status_bar(self):
         """Creates a status bar to display mood and other info."""
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Welcome to MoodVault! Select a date to begin.")
 
+        # Permanent indicator on the right, so it is not replaced by transient messages
+        self.save_status_label = QLabel("")
+        self.status_bar.addPermanentWidget(self.save_status_label)
+        self.model_status_label = QLabel("Mood model: loading...")
+        self.status_bar.addPermanentWidget(self.model_status_label)
+        # Progress of background re-scoring; hidden when there is none
+        self.rescore_status_label = QLabel("")
+        self.rescore_status_label.hide()
+        self.status_bar.addPermanentWidget(self.rescore_status_label)
+
+    def set_save_status(self, text):
+        """Shows whether the open entry has unsaved changes."""
+        self.save_status_label.setText(text)
+
+    def set_model_status(self, text):
+        """Shows the state of the mood model in the status bar."""
+        self.model_status_label.setText(f"Mood model: {text}")
+
+    def set_rescore_status(self, text):
+        """Shows the progress of background re-scoring, or hides it for empty text."""
+        self.rescore_status_label.setText(text)
+        self.rescore_status_label.setVisible(bool(text))
+
 # --- Testing Block ---
 # This allows us to run this file directly to see and test the UI layout
 if __name__ == "__main__":
@@ -2,9 +2,9 @@
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QDialog, QWidget, QVBoxLayout, QHBoxLayout,
-    QLineEdit, QPushButton, QLabel, QMessageBox
+    QLineEdit, QPushButton, QLabel, QMessageBox, QProgressBar
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 
 class AuthDialog(QDialog):
     """Base class for authentication dialogs with shared styling and structure."""
@@ -32,10 +32,21 @@ class AuthDialog(QDialog):
         return self.username_edit.text().strip(), self.password_edit.text()
 
 class LoginDialog(AuthDialog):
-    """The dialog window for user login."""
+    """
+    The dialog window for user login.
+
+    Clicking "Unlock" does not close the dialog. It switches to a non-blocking
+    "unlocking" state and emits `unlock_requested`; whoever performs the (slow)
+    password check and key derivation on a worker reports back through
+    `handle_unlock_result`. On success the dialog keeps the ready
+    EncryptionHandler in `enc_handler` and closes with `accept`.
+    """
+    unlock_requested = pyqtSignal(str, str)  # username, password
+
     def setup_ui(self):
         self.setWindowTitle("Login to MoodVault")
         self.wants_to_register = False
+        self.enc_handler = None
         # Add widgets
         self.layout.addWidget(QLabel("Username:"))
         self.layout.addWidget(self.username_edit)
@@ -48,7 +59,7 @@ class LoginDialog(AuthDialog):
         # Buttons
         button_layout = QHBoxLayout()
         self.login_button = QPushButton("Unlock")
-        self.login_button.clicked.connect(self.accept) # `accept` closes the dialog with a "success" signal
+        self.login_button.clicked.connect(self.request_unlock)
         
         self.cancel_button = QPushButton("Exit")
         self.cancel_button.clicked.connect(self.reject) # `reject` closes with a "failure" signal
@@ -66,7 +77,64 @@ class LoginDialog(AuthDialog):
         self.layout.addLayout(button_layout)
         
         self.login_button.setDefault(True)
-        
+
+        # Shown while the vault is being unlocked in the background
+        self.unlock_status = QLabel("Unlocking your vault...")
+        self.unlock_progress = QProgressBar()
+        self.unlock_progress.setRange(0, 0) # Indeterminate "busy" animation
+        self.unlock_progress.setTextVisible(False)
+        self.layout.addWidget(self.unlock_status)
+        self.layout.addWidget(self.unlock_progress)
+        self.unlock_status.hide()
+        self.unlock_progress.hide()
+
+    def request_unlock(self):
+        """Enters the unlocking state and asks for the credentials to be checked."""
+        username, password = self.get_credentials()
+        if not username or not password:
+            QMessageBox.warning(self, "Login Failed", "Please enter your username and password.")
+            return
+        self.set_unlocking(True)
+        self.unlock_requested.emit(username, password)
+
+    def set_unlocking(self, unlocking):
+        """Shows or hides the busy indicator and locks the inputs while unlocking."""
+        for widget in (self.username_edit, self.password_edit, self.login_button,
+                       self.go_to_register_button, self.cancel_button):
+            widget.setEnabled(not unlocking)
+        self.unlock_status.setVisible(unlocking)
+        self.unlock_progress.setVisible(unlocking)
+
+    @pyqtSlot(object)
+    def handle_unlock_result(self, result):
+        """
+        Receives the outcome of a background unlock.
+
+        Args:
+            result (tuple[bool, str, EncryptionHandler | None]): Success flag, message
+                                                                and the session's handler.
+        """
+        success, message, enc_handler = result
+        if success:
+            self.enc_handler = enc_handler
+            self.accept() # `accept` closes the dialog with a "success" signal
+            return
+        self.set_unlocking(False)
+        self.password_edit.clear()
+        QMessageBox.warning(self, "Login Failed", message)
+
+    @pyqtSlot(str)
+    def handle_unlock_error(self, message):
+        """Restores the dialog if the background unlock raised an error."""
+        self.set_unlocking(False)
+        QMessageBox.critical(self, "Login Failed", f"Could not unlock the vault: {message}")
+
+    def reject(self):
+        # Ignore Esc / window close while a worker still holds the credentials
+        if self.unlock_progress.isVisible():
+            return
+        super().reject()
+
     def switch_to_register(self): 
         """Sets the flag and closes the dialog."""
         self.wants_to_register = True
@@ -74,9 +142,20 @@ class LoginDialog(AuthDialog):
 
 
 class RegisterDialog(AuthDialog):
-    """The dialog window for first-time user registration."""
+    """
+    The dialog window for first-time user registration.
+
+    Like LoginDialog, "Create Account" does not close the dialog. It switches to
+    a busy state and emits `register_requested`; whoever creates the account
+    (KDF calibration, key derivation and bcrypt) on a worker reports back through
+    `handle_register_result`. On success the dialog keeps the outcome in
+    `message` and closes with `accept`.
+    """
+    register_requested = pyqtSignal(str, str)  # username, password
+
     def setup_ui(self):
         self.setWindowTitle("Create Your MoodVault Account")
+        self.message = None
         
         self.password_confirm_edit = QLineEdit()
         self.password_confirm_edit.setEchoMode(QLineEdit.Password)
@@ -100,8 +179,18 @@ class RegisterDialog(AuthDialog):
 
         self.register_button.setDefault(True)
 
+        # Shown while the account is being created in the background
+        self.register_status = QLabel("Creating your account...")
+        self.register_progress = QProgressBar()
+        self.register_progress.setRange(0, 0) # Indeterminate "busy" animation
+        self.register_progress.setTextVisible(False)
+        self.layout.addWidget(self.register_status)
+        self.layout.addWidget(self.register_progress)
+        self.register_status.hide()
+        self.register_progress.hide()
+
     def validate_and_accept(self):
-        """Check if passwords match before accepting."""
+        """Checks that the passwords match, then asks for the account to be created."""
         user, pw1 = self.get_credentials()
         pw2 = self.password_confirm_edit.text()
         
@@ -113,6 +202,99 @@ class RegisterDialog(AuthDialog):
             QMessageBox.warning(self, "Passwords Mismatch", "The passwords you entered do not match. Please try again.")
             return
         
-        # If all checks pass, accept the dialog
-        self.accept()
+        # If all checks pass, create the account in the background
+        self.set_registering(True)
+        self.register_requested.emit(user, pw1)
+
+    def set_registering(self, registering):
+        """Shows or hides the busy indicator and locks the inputs while registering."""
+        for widget in (self.username_edit, self.password_edit, self.password_confirm_edit, self.register_button):
+            widget.setEnabled(not registering)
+        self.register_status.setVisible(registering)
+        self.register_progress.setVisible(registering)
+
+    @pyqtSlot(object)
+    def handle_register_result(self, result):
+        """
+        Receives the outcome of a background registration.
+
+        Args:
+            result (tuple[bool, str]): Success flag and message.
+        """
+        success, message = result
+        if success:
+            self.message = message
+            self.accept()
+            return
+        self.set_registering(False)
+        QMessageBox.warning(self, "Registration Failed", message)
+
+    @pyqtSlot(str)
+    def handle_register_error(self, message):
+        """Restores the dialog if the background registration raised an error."""
+        self.set_registering(False)
+        QMessageBox.critical(self, "Registration Failed", f"Could not create the account: {message}")
+
+    def reject(self):
+        # Ignore Esc / window close while a worker still holds the credentials
+        if self.register_progress.isVisible():
+            return
+        super().reject()
+
 
+class ChangePasswordDialog(QDialog):
+    """The dialog window for changing the master password of the logged-in user."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Change Master Password")
+        self.setMinimumSize(400, 250)
+        self.setModal(True)
+        self.layout = QVBoxLayout(self)
+
+        self.current_password_edit = QLineEdit()
+        self.new_password_edit = QLineEdit()
+        self.confirm_password_edit = QLineEdit()
+        for edit in (self.current_password_edit, self.new_password_edit, self.confirm_password_edit):
+            edit.setEchoMode(QLineEdit.Password)
+
+        self.layout.addWidget(QLabel("Current Master Password:"))
+        self.layout.addWidget(self.current_password_edit)
+        self.layout.addWidget(QLabel("New Master Password (min. 8 characters):"))
+        self.layout.addWidget(self.new_password_edit)
+        self.layout.addWidget(QLabel("Confirm New Master Password:"))
+        self.layout.addWidget(self.confirm_password_edit)
+
+        # Buttons
+        button_layout = QHBoxLayout()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.reject)
+        self.change_button = QPushButton("Change Password")
+        self.change_button.clicked.connect(self.validate_and_accept)
+        button_layout.addStretch()
+        button_layout.addWidget(self.cancel_button)
+        button_layout.addWidget(self.change_button)
+        self.layout.addLayout(button_layout)
+
+        self.change_button.setDefault(True)
+
+    def get_passwords(self):
+        """Returns the entered current and new passwords."""
+        return self.current_password_edit.text(), self.new_password_edit.text()
+
+    def validate_and_accept(self):
+        """Check the new password before accepting."""
+        current, new = self.get_passwords()
+
+        if len(new) < 8:
+            QMessageBox.warning(self, "Password Too Short", "Your master password must be at least 8 characters long.")
+            return
+
+        if new != self.confirm_password_edit.text():
+            QMessageBox.warning(self, "Passwords Mismatch", "The passwords you entered do not match. Please try again.")
+            return
+
+        if new == current:
+            QMessageBox.warning(self, "Same Password", "The new password must be different from the current one.")
+            return
+
+        self.accept()
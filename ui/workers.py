@@ -0,0 +1,118 @@
+import traceback
+from PyQt5.QtCore import QCoreApplication, QObject, QRunnable, QThreadPool, pyqtSignal
+
+# Threads in a JobQueue's own pool: enough to save while an analysis runs.
+JOB_THREADS = 2
+
+class WorkerSignals(QObject):
+    """
+    Signals emitted by a Worker. QRunnable is not a QObject, so the signals live
+    on this helper, which is created on the GUI thread; results are therefore
+    delivered to GUI slots through queued connections.
+    """
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    finished = pyqtSignal()
+
+class Worker(QRunnable):
+    """
+    Runs a function on a QThreadPool thread and reports back through signals.
+
+    Example:
+        worker = Worker(auth_handler.unlock, username, password)
+        worker.signals.result.connect(dialog.handle_unlock_result)
+        QThreadPool.globalInstance().start(worker)
+    """
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+class JobQueue(QObject):
+    """
+    Runs named jobs (e.g. 'analyze', 'save') for keys (e.g. an entry date) on a
+    private QThreadPool and posts their results back through signals.
+
+    At most one job per (kind, key) runs at a time. Submitting while one is
+    running keeps only the newest request, which starts when the running job
+    finishes, so repeated requests coalesce and writes for one key stay in order.
+    Cancelling drops waiting jobs and discards the result of a running one; the
+    running job itself cannot be interrupted and finishes in the background.
+    """
+    result = pyqtSignal(str, object, object) # kind, key, value
+    error = pyqtSignal(str, object, str) # kind, key, message
+
+    def __init__(self, parent=None, max_threads=JOB_THREADS):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self._running = {}
+        self._pending = {}
+        # Bumped on cancel; results from an older generation are dropped
+        self._generations = {}
+
+    def submit(self, kind, key, fn, *args, **kwargs):
+        """Queues `fn(*args, **kwargs)` as the latest `kind` job for `key`."""
+        slot = (kind, key)
+        if slot in self._running:
+            self._pending[slot] = (fn, args, kwargs)
+            return
+        self._start(slot, fn, args, kwargs)
+
+    def cancel(self, kind, key=None):
+        """Cancels `kind` jobs for `key`, or for every key if None."""
+        for slot in set(self._running) | set(self._pending):
+            if slot[0] == kind and (key is None or slot[1] == key):
+                self._pending.pop(slot, None)
+                self._generations[slot] = self._generations.get(slot, 0) + 1
+
+    def is_busy(self, kind=None):
+        """True while any job (of `kind`, if given) is running or waiting."""
+        return any(kind is None or slot[0] == kind for slot in list(self._running) + list(self._pending))
+
+    def wait(self):
+        """
+        Blocks until every running and waiting job has finished. Use it before
+        closing the database so no save is lost; block this object's signals
+        first if the results should not reach the UI any more.
+        """
+        while self._running or self._pending:
+            self.pool.waitForDone()
+            # Deliver the finished notifications, which start waiting jobs
+            QCoreApplication.processEvents()
+
+    def _start(self, slot, fn, args, kwargs):
+        generation = self._generations.get(slot, 0)
+        worker = Worker(fn, *args, **kwargs)
+        worker.signals.result.connect(lambda value: self._on_result(slot, generation, value))
+        worker.signals.error.connect(lambda message: self._on_error(slot, generation, message))
+        worker.signals.finished.connect(lambda: self._on_finished(slot))
+        self._running[slot] = worker
+        self.pool.start(worker)
+
+    def _on_result(self, slot, generation, value):
+        if generation == self._generations.get(slot, 0):
+            self.result.emit(slot[0], slot[1], value)
+
+    def _on_error(self, slot, generation, message):
+        if generation == self._generations.get(slot, 0):
+            self.error.emit(slot[0], slot[1], message)
+
+    def _on_finished(self, slot):
+        self._running.pop(slot, None)
+        if slot in self._pending:
+            fn, args, kwargs = self._pending.pop(slot)
+            self._start(slot, fn, args, kwargs)
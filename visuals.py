@@ -5,6 +5,8 @@ from PyQt5.QtWidgets import QDialog, QVBoxLayout
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
+from core.sentiment import SCORE_LABELS
+
 MOOD_COLORS = {
     'Joy': '#4A532E',       # Olive Green
     'Sadness': '#334257',   # Somber Blue
@@ -18,11 +20,22 @@ BG_COLOR = '#3E2723'      # Main background
 TEXT_COLOR = '#F5F5DC'    # Parchment text
 ACCENT_COLOR = '#D4AF37'   # Golden accent
 
+PERIOD_NAMES = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}
+
 class StatsDialog(QDialog):
     """A dialog to display mood statistics and visualizations."""
-    def __init__(self, data, parent=None):
+    def __init__(self, data, period='month', emotions=None, parent=None):
+        """
+        Args:
+            data (list[dict]): Mood rollup rows from DatabaseHandler.get_mood_rollups.
+            period (str): The rollup period of `data` ('day', 'week' or 'month').
+            emotions (list[dict], optional): Emotion rollup rows for the same period, from
+                                             DatabaseHandler.get_emotion_rollups. They add
+                                             a chart of all emotions over time.
+        """
         super().__init__(parent)
         self.data = data
+        self.period = period
         self.setWindowTitle("Your Mood Statistics")
         self.setMinimumSize(800, 600)
 
@@ -32,19 +45,40 @@ class StatsDialog(QDialog):
         # Create the plots
         self.df = pd.DataFrame(self.data)
         if not self.df.empty:
-            self.df['entry_date'] = pd.to_datetime(self.df['entry_date'])
+            self.df['period_start'] = pd.to_datetime(self.df['period_start'])
+
+            # Collapse the per-label rollups into one average score per period
+            per_period = self.df.groupby('period_start')[['entry_count', 'score_sum']].sum()
+            self.trend = per_period['score_sum'] / per_period['entry_count']
+            self.mood_counts = self.df.groupby('sentiment_label')['entry_count'].sum().sort_values(ascending=False)
 
             # Add plots to the layout
             line_chart_canvas = self.create_line_chart()
             pie_chart_canvas = self.create_pie_chart()
             layout.addWidget(line_chart_canvas)
             layout.addWidget(pie_chart_canvas)
+
+            self.emotion_trend = self._emotion_trend(emotions or [])
+            if self.emotion_trend is not None:
+                self.setMinimumSize(800, 850)
+                layout.addWidget(self.create_emotion_chart())
         else:
             # Handle case with no data
             from PyQt5.QtWidgets import QLabel
             label = QLabel("Not enough data to display statistics.")
             layout.addWidget(label)
 
+    def _emotion_trend(self, rows):
+        """Pivots the emotion rollups into one column per emotion. None if fewer than two entries have them."""
+        frame = pd.DataFrame(rows)
+        if frame.empty or frame.groupby('period_start')['entry_count'].max().sum() < 2:
+            return None
+        frame['period_start'] = pd.to_datetime(frame['period_start'])
+        trend = frame.pivot(index='period_start', columns='emotion', values='mean_score')
+        trend = trend[[label for label in SCORE_LABELS if label in trend.columns]].fillna(0.0)
+        trend.columns = [label.capitalize() for label in trend.columns]
+        return trend
+
     def create_line_chart(self):
         """Creates a line chart of mood score over time."""
         fig, ax = plt.subplots(figsize=(8, 3))
@@ -52,10 +86,11 @@ class StatsDialog(QDialog):
         ax.set_facecolor(BG_COLOR)
 
         # Plotting the data
-        ax.plot(self.df['entry_date'], self.df['sentiment_score'], color=ACCENT_COLOR, marker='o', linestyle='-')
+        ax.plot(self.trend.index, self.trend.values, color=ACCENT_COLOR, marker='o', linestyle='-')
 
         # Styling
-        ax.set_title('Mood Score Over Time', color=TEXT_COLOR, fontsize=14, weight='bold')
+        period_name = PERIOD_NAMES.get(self.period, '')
+        ax.set_title(f'Mood Score Over Time ({period_name} Average)', color=TEXT_COLOR, fontsize=14, weight='bold')
         ax.set_xlabel('Date', color=TEXT_COLOR)
         ax.set_ylabel('Sentiment Score (-1 to 1)', color=TEXT_COLOR)
         ax.tick_params(axis='x', colors=TEXT_COLOR, rotation=25)
@@ -75,7 +110,7 @@ class StatsDialog(QDialog):
         fig.patch.set_facecolor(BG_COLOR)
 
         # Data preparation
-        mood_counts = self.df['sentiment_label'].value_counts()
+        mood_counts = self.mood_counts
         
         # Get colors for the moods present in the data
         pie_colors = [MOOD_COLORS.get(mood, '#888888') for mood in mood_counts.index]
@@ -100,4 +135,36 @@ class StatsDialog(QDialog):
         ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
         
         plt.tight_layout()
-        return FigureCanvas(fig)
\ No newline at end of file
+        return FigureCanvas(fig)
+
+    def create_emotion_chart(self):
+        """Creates a stacked area chart of the share of each emotion over time."""
+        fig, ax = plt.subplots(figsize=(8, 3))
+        fig.patch.set_facecolor(BG_COLOR)
+        ax.set_facecolor(BG_COLOR)
+
+        trend = self.emotion_trend
+        ax.stackplot(
+            trend.index, trend.T.values,
+            labels=trend.columns,
+            colors=[MOOD_COLORS.get(mood, '#888888') for mood in trend.columns],
+            alpha=0.9,
+        )
+
+        # Styling
+        period_name = PERIOD_NAMES.get(self.period, '')
+        ax.set_title(f'Emotions Over Time ({period_name} Average)', color=TEXT_COLOR, fontsize=14, weight='bold')
+        ax.set_ylabel('Share of Entry', color=TEXT_COLOR)
+        ax.tick_params(axis='x', colors=TEXT_COLOR, rotation=25)
+        ax.tick_params(axis='y', colors=TEXT_COLOR)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['left'].set_color(TEXT_COLOR)
+        ax.spines['bottom'].set_color(TEXT_COLOR)
+        ax.set_ylim(0, 1)
+        legend = ax.legend(loc='upper left', bbox_to_anchor=(1.0, 1.0), fontsize=8, frameon=False)
+        for text in legend.get_texts():
+            text.set_color(TEXT_COLOR)
+
+        plt.tight_layout()
+        return FigureCanvas(fig)